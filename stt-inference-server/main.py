@@ -1,17 +1,88 @@
+from utils import import_clock
+import time
+import asyncio
 import uvicorn
 import argparse
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import transcribe, live_transcription
-from server_metadata import server_metadata, Backend, Device, Quantization
+from routers import transcribe, live_transcription, jobs, admin
+from server_metadata import server_metadata, model_stats, profile_stats, Backend, Device, Quantization, BatchingConfig, VADConfig, LiveConfig, InferenceConfig, AutotuneConfig, WorkerPoolConfig, CacheConfig, LongAudioConfig, AdmissionConfig, SchedulerConfig, JobsConfig, LoggingConfig, StartupConfig, ModelSpec, ModelsConfig, AdminConfig, ShutdownConfig
 from utils.logger import main_logger as logger
 from models.model_manager import model_manager
-from concurrent.futures import ThreadPoolExecutor
+from models.batch_scheduler import batch_scheduler
+from models.worker_pool import WorkerPoolModel
+from models.result_cache import result_cache
+from models.admission import admission
+from models.job_queue import job_queue
+from models.autotune import autotune
+from utils.priority_executor import PriorityExecutor, Priority
+from utils.metrics import metrics
+from utils.audio_utils import buffer_pool
 import multiprocessing
 
-# Determine the number of worker threads
-num_workers = multiprocessing.cpu_count() * 2 + 1
+# Timed by the first import only: uvicorn imports this module again to load the app, when its
+# dependencies are already loaded
+if server_metadata.stats.import_time is None:
+    server_metadata.stats.import_time = time.perf_counter() - import_clock.started
+
+def thread_pool_workers() -> int:
+    config = server_metadata.scheduler
+    if config.workers:
+        return config.workers
+    # The model's num_workers bounds the calls it runs at once; the pool needs a thread for each
+    # live decode, job file and long upload chunk that can wait on it besides, or uploads'
+    # audio work stalls behind them
+    needed = config.realtime_reserved + job_queue.concurrency + server_metadata.long_audio.parallelism
+    return max(multiprocessing.cpu_count() * 2 + 1, needed)
+
+def create_thread_pool() -> PriorityExecutor:
+    config = server_metadata.scheduler
+    return PriorityExecutor(
+        max_workers=thread_pool_workers(),
+        reserved={
+            Priority.REALTIME: config.realtime_reserved,
+            Priority.INTERACTIVE: config.interactive_reserved,
+            Priority.BULK: config.bulk_reserved
+        }
+    )
+
+def parse_models(entries) -> dict:
+    """`[name=]model_id[@quantization]` entries of `--models`, by name (the model ID if unnamed)."""
+    models = {}
+    for entry in entries:
+        name, _, spec = entry.partition("=") if "=" in entry else ("", "", entry)
+        model_id, _, quantization = spec.partition("@")
+        models[name or model_id] = ModelSpec(model_id=model_id, quantization=Quantization(quantization) if quantization else None)
+    return models
+
+def register_metrics(app: FastAPI):
+    """Export the counters and gauges that components keep themselves."""
+    metrics.callback("stt_requests_total", "Transcriptions run", "counter", lambda: server_metadata.stats.total_requests)
+    metrics.callback("stt_live_chunks_total", "Live audio chunks received", "counter", lambda: server_metadata.stats.live_chunks)
+    metrics.callback("stt_skipped_live_chunks_total", "Live audio chunks not decoded by the VAD", "counter",
+                     lambda: server_metadata.stats.skipped_live_chunks)
+    metrics.gauge("stt_in_flight_requests", "Requests running inference", lambda: admission.in_flight)
+    metrics.gauge("stt_queued_requests", "Requests waiting for an inference slot", lambda: admission.queued_requests)
+    metrics.gauge("stt_queued_audio_seconds", "Audio waiting for an inference slot", lambda: admission.queued_audio)
+    metrics.gauge("stt_live_sessions", "Open live transcription sessions", lambda: admission.live_sessions)
+    for reason in admission.rejected:
+        metrics.callback("stt_rejected_total", "Requests and sessions turned away", "counter",
+                         lambda reason=reason: admission.rejected[reason], reason=reason)
+    metrics.gauge("stt_cache_bytes", "Memory used by cached results", lambda: result_cache.bytes)
+    metrics.gauge("stt_cache_hit_ratio", "Share of cache lookups served without inference",
+                  lambda: result_cache.stats()["hit_ratio"])
+    for status in ("queued", "running", "done", "failed"):
+        metrics.gauge("stt_job_files", "Job files by status", lambda status=status: job_queue.stats().get(status, 0),
+                      status=status)
+    if isinstance(app.state.thread_pool, PriorityExecutor):
+        for priority in Priority:
+            name = priority.name.lower()
+            metrics.gauge("stt_executor_queued", "Work waiting for a thread, by priority class",
+                          lambda priority=priority: app.state.thread_pool.queued(priority), priority=name)
+            metrics.gauge("stt_executor_running", "Work running on a thread, by priority class",
+                          lambda priority=priority: app.state.thread_pool.running(priority), priority=name)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,20 +90,28 @@ async def lifespan(app: FastAPI):
     logger.info("Server starting up")
     logger.info(f"Server metadata: {server_metadata.model_dump()}")
     
-    # Create ThreadPoolExecutor
-    app.state.thread_pool = ThreadPoolExecutor(max_workers=num_workers)
+    # Create the thread pool; live sessions, uploads and bulk work are run in priority order
+    app.state.thread_pool = create_thread_pool()
+    register_metrics(app)
     
-    if not model_manager.is_loaded:
-        logger.info("Loading model...")
-        try:
-            model_manager.load_model()
-            logger.info(f"Model loaded successfully with server_metadata {server_metadata.model_dump()}.")
-        except Exception as e:
-            logger.error(f"Failed to load the model: {str(e)}")
+    if server_metadata.batching.enabled:
+        batch_scheduler.start(app.state.thread_pool)
+    result_cache.start(app.state.thread_pool)
+    await job_queue.start(app.state.thread_pool)
+
+    # Load and warm up the model in the background: the server answers /health/live meanwhile,
+    # and /health/ready once requests get full speed
+    loop = asyncio.get_running_loop()
+    preparing = loop.run_in_executor(app.state.thread_pool, model_manager.prepare)
+    preparing.add_done_callback(lambda _: logger.info(f"Model {model_manager.status()}, startup timings {startup_timings()}"))
     yield
     # Shutdown
     logger.info("Server shutting down")
+    await job_queue.stop()
+    await batch_scheduler.stop()
     app.state.thread_pool.shutdown()
+    result_cache.close()
+    model_manager.unload_model()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -47,17 +126,39 @@ app.add_middleware(
 
 app.include_router(transcribe.router)
 app.include_router(live_transcription.router)
+app.include_router(jobs.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def root():
     logger.info("Root endpoint accessed")
     return {"message": "Welcome to the STT Inference Server"}
 
+def startup_timings():
+    return {
+        "import": server_metadata.stats.import_time,
+        **model_manager.timings,
+        "first_inference": server_metadata.stats.first_inference_time
+    }
+
+@app.get("/health/live")
+async def health_live():
+    # The process only needs restarting if the model couldn't be loaded
+    if model_manager.status() == "failed":
+        return JSONResponse({"status": "failed", "error": model_manager.error}, status_code=503)
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    # A draining server is taken out of rotation while it finishes its work
+    status = "draining" if admission.draining else model_manager.status()
+    return JSONResponse({"status": status, "startup": startup_timings()}, status_code=200 if status == "ready" else 503)
+
 @app.get("/metadata")
 async def get_metadata():
     try:
         logger.info("Metadata endpoint accessed")
-        return server_metadata.model_dump()
+        return {**server_metadata.model_dump(), "resident_models": model_manager.stats()}
     except Exception as e:
         logger.error(f"Error retrieving metadata: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -71,12 +172,75 @@ async def get_stats():
             "total_audio_duration": server_metadata.stats.total_audio_duration,
             "total_inference_time": server_metadata.stats.total_inference_time,
             "average_inference_time": server_metadata.stats.average_inference_time,
-            "real_time_factor": server_metadata.stats.real_time_factor
+            "real_time_factor": server_metadata.stats.real_time_factor,
+            "live_chunks": server_metadata.stats.live_chunks,
+            "skipped_live_chunks": server_metadata.stats.skipped_live_chunks,
+            "vad_skip_ratio": server_metadata.stats.vad_skip_ratio,
+            "startup": startup_timings(),
+            "models": model_stats(),
+            "profiles": profile_stats(),
+            "stages": {
+                labels["stage"]: histogram.summary(scale=1000)
+                for labels, histogram in metrics.children("stt_stage_seconds")
+            },
+            "live_chunk_latency_ms": live_transcription.chunk_latency.summary(scale=1000),
+            "live_sessions": live_transcription.session_stats(),
+            "live_buffers": buffer_pool.stats(),
+            "batching": batch_scheduler.stats(),
+            "cache": result_cache.stats(),
+            "admission": admission.stats(),
+            "jobs": job_queue.stats(),
+            "scheduler": app.state.thread_pool.stats() if isinstance(app.state.thread_pool, PriorityExecutor) else None,
+            "worker_pool": model_manager.model.stats() if isinstance(model_manager.model, WorkerPoolModel) else None
         }
     except Exception as e:
         logger.error(f"Error retrieving stats: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def drain(timeout: float) -> bool:
+    """
+    Turn new requests and live sessions away and wait up to `timeout` seconds for the admitted
+    ones to finish. Returns whether they all did.
+    """
+    admission.drain()
+    logger.info(f"Draining {admission.in_flight + admission.queued_requests} requests "
+                f"and {admission.live_sessions} live sessions")
+    deadline = time.monotonic() + timeout
+    while not admission.idle and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if not admission.idle:
+        logger.warning(f"Shutting down with {admission.in_flight + admission.queued_requests} requests "
+                       f"and {admission.live_sessions} live sessions unfinished")
+    return admission.idle
+
+class DrainingServer(uvicorn.Server):
+    """
+    Drains on the first SIGTERM or SIGINT (see `drain`) before uvicorn stops accepting
+    connections; a second signal shuts down straight away.
+    """
+
+    async def startup(self, sockets=None):
+        self._loop = asyncio.get_running_loop()
+        self._draining = None
+        await super().startup(sockets)
+
+    def handle_exit(self, sig, frame):
+        if self._draining is not None or server_metadata.shutdown.drain_timeout <= 0:
+            super().handle_exit(sig, frame)
+            return
+        # Runs as a signal handler between steps of the event loop
+        self._loop.call_soon_threadsafe(self._start_drain, sig)
+
+    def _start_drain(self, sig):
+        if self._draining is None:
+            self._draining = asyncio.ensure_future(drain(server_metadata.shutdown.drain_timeout))
+            self._draining.add_done_callback(lambda _: uvicorn.Server.handle_exit(self, sig, None))
+
 def main():
     parser = argparse.ArgumentParser(description="Run the STT Inference Server")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to run the server on")
@@ -84,7 +248,50 @@ def main():
     parser.add_argument("--model_id", type=str, default="base", help="Model ID or path to load")
     parser.add_argument("--backend", type=str, default="faster_whisper", choices=["faster_whisper", "openai_whisper", "pytorch"], help="Backend to use")
     parser.add_argument("--device", type=str, default="cpu", choices=["cpu", "cuda"], help="Device to run the model on")
-    parser.add_argument("--dtype", type=str, default="int8", choices=["float32", "float16", "int8"], help="Quantization for model computations")
+    parser.add_argument("--dtype", type=str, default="int8", choices=["float32", "float16", "int8", "int8_float32"], help="Quantization for model computations")
+    parser.add_argument("--cpu_threads", type=int, default=0, help="Intra-op threads of each of the model's workers in the server process (0 splits the cores between --num_workers workers, or lets the backend choose with one)")
+    parser.add_argument("--num_workers", type=int, default=0, help="Calls the faster-whisper model in the server process runs at once (0 matches --long_audio_parallelism)")
+    parser.add_argument("--autotune", action="store_true", help="Time the CPU quantizations and thread splits at startup and use the best, overriding --dtype, --cpu_threads and --num_workers")
+    parser.add_argument("--autotune_target", type=str, default="throughput", choices=["throughput", "latency"], help="Tune for throughput at --autotune_concurrency calls at once, or for the latency of one call")
+    parser.add_argument("--autotune_concurrency", type=int, default=0, help="Calls at once the throughput target is measured with (0 uses --max_in_flight)")
+    parser.add_argument("--autotune_path", type=str, default="autotune.json", help="JSON file keeping tuned settings by CPU model and model ID, reused on later starts")
+    parser.add_argument("--models", type=str, nargs="*", default=[], help="Further models requests can select, loaded on first use, as [name=]model_id[@dtype]")
+    parser.add_argument("--model_memory_budget_mb", type=float, default=0.0, help="Memory for models loaded on demand in MB, unloading the least recently used beyond it (0 is unlimited)")
+    parser.add_argument("--live_draft_model", type=str, default=None, help="Model from --models producing live partial results, with the session's model only decoding finished utterances")
+    parser.add_argument("--admin_token", type=str, default=None, help="Bearer token required by the admin endpoints (unset leaves them open)")
+    parser.add_argument("--drain_timeout", type=float, default=30.0, help="Seconds requests and live sessions get to finish after SIGTERM (0 stops straight away)")
+    parser.add_argument("--max_batch_size", type=int, default=1, help="Maximum number of requests decoded in one batch (1 disables batching)")
+    parser.add_argument("--max_batch_wait_ms", type=float, default=10.0, help="How long the first request of a batch waits for others to join")
+    parser.add_argument("--disable_vad", action="store_true", help="Decode every live chunk instead of gating inference on voice activity")
+    parser.add_argument("--vad_max_latency", type=float, default=1.0, help="Seconds of ongoing speech buffered before a live decode")
+    parser.add_argument("--live_language_confidence", type=float, default=0.8, help="Probability at which a live session pins its detected language and stops detecting it")
+    parser.add_argument("--live_language_recheck", type=float, default=0.0, help="Seconds of session audio after which a pinned language is detected again (0 keeps it)")
+    parser.add_argument("--live_prompt_words", type=int, default=50, help="Committed words passed as the prompt of each live decode (0 disables the prompt)")
+    parser.add_argument("--live_lag_warning", type=float, default=1.0, help="Seconds a live decode can lag behind the audio before the client gets a lag message (0 disables)")
+    parser.add_argument("--live_max_lag", type=float, default=5.0, help="Seconds a live decode can lag behind the audio before the late audio is skipped (0 never skips)")
+    parser.add_argument("--workers", type=int, default=0, help="Number of inference worker processes, each with its own model (0 runs the model in the server process)")
+    parser.add_argument("--threads_per_worker", type=int, default=0, help="Intra-op threads per worker (0 splits the CPU cores evenly)")
+    parser.add_argument("--cache_max_mb", type=float, default=64.0, help="Memory for cached transcription results in MB (0 disables the cache)")
+    parser.add_argument("--cache_ttl", type=float, default=86400.0, help="Seconds a cached result stays valid (0 keeps it until evicted)")
+    parser.add_argument("--cache_path", type=str, default=None, help="SQLite file that keeps cached results across restarts")
+    parser.add_argument("--long_audio_min_duration", type=float, default=120.0, help="Split uploads at least this many seconds long into chunks transcribed in parallel (0 disables)")
+    parser.add_argument("--long_audio_parallelism", type=int, default=4, help="Chunks of a long upload transcribed at the same time")
+    parser.add_argument("--max_in_flight", type=int, default=8, help="Requests running inference at once (0 is unlimited)")
+    parser.add_argument("--max_queued_audio", type=float, default=3600.0, help="Seconds of audio allowed to wait for inference before rejecting with 429 (0 is unlimited)")
+    parser.add_argument("--max_queue_wait", type=float, default=60.0, help="Estimated wait in seconds beyond which requests are rejected with 503 (0 disables)")
+    parser.add_argument("--max_live_sessions", type=int, default=64, help="Concurrent live transcription sessions (0 is unlimited)")
+    parser.add_argument("--thread_pool_workers", type=int, default=0, help="Threads running inference and audio work (0 uses twice the CPU cores plus one, and at least enough for the reserved live threads, job workers and long audio chunks)")
+    parser.add_argument("--realtime_reserved", type=int, default=1, help="Threads kept free for live sessions")
+    parser.add_argument("--bulk_reserved", type=int, default=0, help="Threads kept for bulk uploads so they aren't starved")
+    parser.add_argument("--jobs_path", type=str, default="jobs.db", help="SQLite file holding the job queue")
+    parser.add_argument("--jobs_concurrency", type=int, default=0, help="Job files transcribed at the same time (0 matches the batch size, at least 2)")
+    parser.add_argument("--jobs_input_dir", type=str, default=None, help="Directory that server-local job paths and globs are resolved in")
+    parser.add_argument("--log_format", type=str, default="text", choices=["text", "json"], help="Write log records as text lines or JSON objects")
+    parser.add_argument("--disable_transcript_logging", action="store_true", help="Leave transcribed text out of the live transcription log")
+    parser.add_argument("--transcript_log_sample_rate", type=float, default=1.0, help="Share of live results written to the transcription log")
+    parser.add_argument("--transcript_log_max_per_second", type=float, default=50.0, help="Most live results written to the transcription log per second (0 is unlimited)")
+    parser.add_argument("--disable_warmup", action="store_true", help="Report ready as soon as the model is loaded, without a warm-up transcription")
+    parser.add_argument("--warmup_audio", type=str, default=None, help="Clip transcribed to warm the model up (defaults to data/audio.wav)")
     args = parser.parse_args()
 
     try:
@@ -95,11 +302,74 @@ def main():
             device=Device(args.device),
             quantization=Quantization(args.dtype)
         )
+        server_metadata.models = ModelsConfig(
+            available=parse_models(args.models),
+            memory_budget_mb=args.model_memory_budget_mb,
+            live_draft=args.live_draft_model
+        )
+        server_metadata.admin = AdminConfig(token=args.admin_token)
+        server_metadata.shutdown = ShutdownConfig(drain_timeout=args.drain_timeout)
+        server_metadata.batching = BatchingConfig(
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_batch_wait_ms
+        )
+        server_metadata.vad = VADConfig(enabled=not args.disable_vad, max_latency=args.vad_max_latency)
+        server_metadata.live = LiveConfig(
+            language_confidence=args.live_language_confidence,
+            language_recheck=args.live_language_recheck,
+            prompt_words=args.live_prompt_words,
+            lag_warning=args.live_lag_warning,
+            max_lag=args.live_max_lag
+        )
+        server_metadata.inference = InferenceConfig(cpu_threads=args.cpu_threads, num_workers=args.num_workers)
+        server_metadata.autotune = AutotuneConfig(
+            enabled=args.autotune,
+            target=args.autotune_target,
+            concurrency=args.autotune_concurrency,
+            path=args.autotune_path
+        )
+        server_metadata.worker_pool = WorkerPoolConfig(workers=args.workers, threads_per_worker=args.threads_per_worker)
+        server_metadata.cache = CacheConfig(max_mb=args.cache_max_mb, ttl=args.cache_ttl, path=args.cache_path)
+        server_metadata.admission = AdmissionConfig(
+            max_in_flight=args.max_in_flight,
+            max_queued_audio=args.max_queued_audio,
+            max_queue_wait=args.max_queue_wait,
+            max_live_sessions=args.max_live_sessions
+        )
+        server_metadata.scheduler = SchedulerConfig(
+            workers=args.thread_pool_workers,
+            realtime_reserved=args.realtime_reserved,
+            bulk_reserved=args.bulk_reserved
+        )
+        server_metadata.jobs = JobsConfig(
+            path=args.jobs_path,
+            concurrency=args.jobs_concurrency,
+            input_dir=args.jobs_input_dir
+        )
+        server_metadata.logging = LoggingConfig(
+            format=args.log_format,
+            transcripts=not args.disable_transcript_logging,
+            transcript_sample_rate=args.transcript_log_sample_rate,
+            transcript_max_per_second=args.transcript_log_max_per_second
+        )
+        server_metadata.startup = StartupConfig(warmup=not args.disable_warmup, warmup_audio=args.warmup_audio)
+        server_metadata.long_audio = LongAudioConfig(
+            min_duration=args.long_audio_min_duration,
+            parallelism=args.long_audio_parallelism
+        )
 
         # logger.info(f"Updated server metadata: {server_metadata.model_dump()}")
 
-        # Run the server
-        uvicorn.run("main:app", host=args.host, port=args.port, reload=False)
+        if server_metadata.autotune.enabled:
+            # Before the thread pool is sized and the model loaded, both of which depend on the result
+            start = time.perf_counter()
+            autotune()
+            model_manager.timings["autotune"] = time.perf_counter() - start
+
+        # Run the server; after draining, uvicorn waits as long again for the last responses to go out
+        config = uvicorn.Config("main:app", host=args.host, port=args.port, reload=False,
+                                timeout_graceful_shutdown=max(1.0, args.drain_timeout))
+        DrainingServer(config).run()
     except Exception as e:
         logger.error(f"Error starting server: {str(e)}")
         raise
@@ -0,0 +1,179 @@
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional
+from server_metadata import server_metadata
+from utils.logger import main_logger as logger
+from utils.metrics import queue_wait
+
+class Overloaded(Exception):
+    """Raised when a request or session can't be admitted; carries the HTTP status and a retry hint."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float = 1.0):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+@dataclass
+class _Waiter:
+    audio_duration: float
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+class Ticket:
+    """An admitted request's inference slot. Releasing it more than once is harmless."""
+
+    def __init__(self, controller: "AdmissionController", audio_duration: float):
+        self._controller = controller
+        self.audio_duration = audio_duration
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+    async def __aenter__(self) -> "Ticket":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+class AdmissionController:
+    """
+    Bounds the work the server takes on, configured by `server_metadata.admission`.
+
+    At most `max_in_flight` requests run inference at once; others wait in FIFO order as long
+    as the audio waiting stays under `max_queued_audio` seconds (429 beyond that) and the wait
+    estimated from the real-time factor stays under `max_queue_wait` (503 beyond that). Live
+    sessions are capped at `max_live_sessions`. Once draining for shutdown, new requests and
+    sessions are turned away while admitted ones finish.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.in_flight_audio = 0.0
+        self.queued_audio = 0.0
+        self.live_sessions = 0
+        self.draining = False
+        self.rejected: Dict[str, int] = {"queue_full": 0, "wait_too_long": 0, "live_sessions": 0, "draining": 0}
+        self.queue_wait = queue_wait("admission")
+        self._waiters: Deque[_Waiter] = deque()
+
+    def check(self):
+        """Cheap early rejection before an upload is decoded, when nothing more can be queued."""
+        config = server_metadata.admission
+        if self.draining:
+            self._reject("draining", 503, "Server is shutting down", 1.0)
+        if self._has_slot():
+            return
+        if config.max_queued_audio > 0 and self.queued_audio >= config.max_queued_audio:
+            self._reject("queue_full", 429, "Too many requests queued")
+
+    async def acquire(self, audio_duration: float) -> Ticket:
+        """Wait for an inference slot for `audio_duration` seconds of audio, or raise Overloaded."""
+        config = server_metadata.admission
+        if self.draining:
+            self._reject("draining", 503, "Server is shutting down", 1.0)
+        if self._has_slot() and not self._waiters:
+            return self._admit(audio_duration)
+
+        if config.max_queued_audio > 0 and self.queued_audio + audio_duration > config.max_queued_audio:
+            self._reject("queue_full", 429, "Too many requests queued")
+        wait = self.estimated_wait()
+        if config.max_queue_wait > 0 and wait > config.max_queue_wait:
+            self._reject("wait_too_long", 503, f"Server overloaded, estimated wait {wait:.1f}s", wait)
+
+        waiter = _Waiter(audio_duration, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self.queued_audio += audio_duration
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just as the caller went away: hand the slot on.
+                waiter.future.result().release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self.queued_audio -= audio_duration
+            raise
+
+    def open_session(self):
+        config = server_metadata.admission
+        if self.draining:
+            self._reject("draining", 1013, "Server is shutting down", 1.0)
+        if 0 < config.max_live_sessions <= self.live_sessions:
+            self._reject("live_sessions", 1013, "Too many live sessions")
+        self.live_sessions += 1
+
+    def close_session(self):
+        self.live_sessions -= 1
+
+    def drain(self):
+        """Turn new requests and live sessions away from now on."""
+        self.draining = True
+
+    @property
+    def queued_requests(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def idle(self) -> bool:
+        """No request is running or waiting, and no live session is open."""
+        return not self.in_flight and not self._waiters and not self.live_sessions
+
+    def estimated_wait(self) -> float:
+        """
+        Seconds a new request would wait for a slot, assuming the audio ahead of it is processed
+        at the server's real-time factor across all inference slots.
+        """
+        rtf = server_metadata.stats.real_time_factor
+        slots = server_metadata.admission.max_in_flight or 1
+        return (self.in_flight_audio + self.queued_audio) * rtf / slots
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **server_metadata.admission.model_dump(),
+            "in_flight": self.in_flight,
+            "queued_requests": self.queued_requests,
+            "queued_audio": self.queued_audio,
+            "live_sessions": self.live_sessions,
+            "draining": self.draining,
+            "estimated_wait": self.estimated_wait(),
+            "rejected": dict(self.rejected),
+            "queue_wait_ms": self.queue_wait.summary(scale=1000)
+        }
+
+    def _has_slot(self) -> bool:
+        max_in_flight = server_metadata.admission.max_in_flight
+        return max_in_flight <= 0 or self.in_flight < max_in_flight
+
+    def _admit(self, audio_duration: float) -> Ticket:
+        self.in_flight += 1
+        self.in_flight_audio += audio_duration
+        return Ticket(self, audio_duration)
+
+    def _release(self, ticket: Ticket):
+        self.in_flight -= 1
+        self.in_flight_audio -= ticket.audio_duration
+        while self._waiters and self._has_slot():
+            waiter = self._waiters.popleft()
+            self.queued_audio -= waiter.audio_duration
+            if waiter.future.done():
+                continue
+            self.queue_wait.observe(time.perf_counter() - waiter.enqueued_at)
+            waiter.future.set_result(self._admit(waiter.audio_duration))
+
+    def _reject(self, reason: str, status_code: int, detail: str, retry_after: Optional[float] = None):
+        self.rejected[reason] += 1
+        logger.warning(f"Rejected request: {detail}")
+        raise Overloaded(status_code, detail, self.estimated_wait() if retry_after is None else retry_after)
+
+admission = AdmissionController()
@@ -0,0 +1,155 @@
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+import numpy as np
+from server_metadata import server_metadata, Backend, Device, Quantization, InferenceConfig
+from models.model_manager import ModelManager, create_model
+from utils.audio_utils import SAMPLE_RATE
+from utils.logger import model_logger as logger
+
+# Compute types timed on CPU, for the backends that have them
+CPU_QUANTIZATIONS = [Quantization.INT8, Quantization.INT8_FLOAT32, Quantization.FLOAT32]
+TARGETS = ("throughput", "latency")
+
+@dataclass(frozen=True)
+class Candidate:
+    quantization: Quantization
+    # Intra-op threads of each call
+    cpu_threads: int
+    # Calls the model runs at once
+    num_workers: int
+
+def cpu_model() -> str:
+    """The CPU's model name and core count, which tuned settings are kept by."""
+    name = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{name} x{multiprocessing.cpu_count()}"
+
+def candidates(backend: Backend, cores: int, concurrency: int) -> List[Candidate]:
+    """
+    Every compute type with every split of the cores into calls run at once and threads per
+    call, from one call on all cores up to `concurrency` calls. Backends without compute types
+    keep the configured quantization, and those that don't limit their calls (all but
+    faster-whisper) run on all cores.
+    """
+    quantizations = CPU_QUANTIZATIONS if backend == Backend.FASTER_WHISPER else [server_metadata.quantization]
+    max_workers = max(1, min(cores, concurrency)) if backend == Backend.FASTER_WHISPER else 1
+    splits, workers = [], 1
+    while workers <= max_workers:
+        splits.append((max(1, cores // workers), workers))
+        workers *= 2
+    return [Candidate(quantization, threads, workers) for quantization in quantizations for threads, workers in splits]
+
+def measure(candidate: Candidate, audio: np.ndarray, target: str, concurrency: int, rounds: int = 2) -> float:
+    """
+    Load the model with `candidate`'s settings and time it on `audio`: the median seconds of a
+    call for the latency target, or the seconds of audio transcribed per second with
+    `concurrency` calls at once for the throughput target.
+    """
+    model = create_model(server_metadata.backend, server_metadata.model_id, Device.CPU, candidate.quantization,
+                         cpu_threads=candidate.cpu_threads, num_workers=candidate.num_workers)
+    try:
+        def run():
+            for _ in model.transcribe_sync(audio):
+                pass
+
+        run()  # the first call pays for lazy initialisation
+        if target == "latency":
+            durations = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                run()
+                durations.append(time.perf_counter() - start)
+            return statistics.median(durations)
+        calls = concurrency * rounds
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            for future in [executor.submit(run) for _ in range(calls)]:
+                future.result()
+            elapsed = time.perf_counter() - start
+        return calls * len(audio) / SAMPLE_RATE / elapsed
+    finally:
+        model.close()
+
+def tune(target: str, concurrency: int) -> Dict[str, Any]:
+    """Time every candidate on the warm-up clip and return the best with the measurements."""
+    audio = ModelManager._warmup_audio()
+    measurements = []
+    for candidate in candidates(server_metadata.backend, multiprocessing.cpu_count(), concurrency):
+        score = measure(candidate, audio, target, concurrency)
+        logger.info(f"Autotune: {candidate} {'took' if target == 'latency' else 'transcribed'} "
+                    f"{score:.3f}{'s' if target == 'latency' else ' audio seconds per second'}")
+        measurements.append({**asdict(candidate), "quantization": candidate.quantization.value, target: score})
+    pick = min if target == "latency" else max
+    best = pick(measurements, key=lambda measurement: measurement[target])
+    return {
+        "quantization": best["quantization"],
+        "cpu_threads": best["cpu_threads"],
+        "num_workers": best["num_workers"],
+        "target": target,
+        "concurrency": concurrency,
+        "measurements": measurements,
+        "tuned_at": time.time()
+    }
+
+def autotune() -> Dict[str, Any]:
+    """
+    Apply the quantization and thread split tuned for this CPU and model to `server_metadata`,
+    timing them first unless `server_metadata.autotune.path` has them for the same target.
+
+    :raises ValueError: If the target is unknown or the model isn't run on the CPU in-process
+    """
+    config = server_metadata.autotune
+    if config.target not in TARGETS:
+        raise ValueError(f"Unsupported autotune target {config.target!r}, expected one of {list(TARGETS)}")
+    if server_metadata.device != Device.CPU or server_metadata.worker_pool.enabled:
+        raise ValueError("Autotuning only applies to models run on the CPU in the server process")
+    concurrency = 1 if config.target == "latency" else \
+        config.concurrency or server_metadata.admission.max_in_flight or multiprocessing.cpu_count()
+    key = f"{cpu_model()}/{server_metadata.backend.value}/{server_metadata.model_id}"
+
+    tuned = _load(config.path)
+    entry = tuned.get(key)
+    if entry is not None and (entry["target"], entry["concurrency"]) == (config.target, concurrency):
+        logger.info(f"Autotune: reusing settings tuned for {key} from {config.path}")
+    else:
+        logger.info(f"Autotune: timing settings for {key}, target {config.target} at concurrency {concurrency}")
+        entry = tune(config.target, concurrency)
+        tuned[key] = entry
+        _save(config.path, tuned)
+
+    server_metadata.quantization = Quantization(entry["quantization"])
+    server_metadata.inference = InferenceConfig(cpu_threads=entry["cpu_threads"], num_workers=entry["num_workers"])
+    logger.info(f"Autotune: using {entry['quantization']} with {entry['num_workers']} workers "
+                f"of {entry['cpu_threads']} threads")
+    return entry
+
+def _load(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable autotune file {path}: {str(e)}")
+        return {}
+
+def _save(path: str, tuned: Dict[str, Any]):
+    # Written whole and renamed into place, so a crash never leaves a truncated file
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(tuned, f, indent=2)
+    os.replace(temporary, path)
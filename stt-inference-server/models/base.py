@@ -1,11 +1,139 @@
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Dict, Any, Union
+from concurrent.futures import Executor
+from typing import AsyncGenerator, Dict, Any, Iterator, List, Optional, Union
+import asyncio
+import threading
+import time
+import numpy as np
+from utils.metrics import current_compute_time
+from .decoding import DecodeOptions
+
+_ITEM, _DONE, _ERROR = range(3)
+
+def options_kwargs(options: Optional[DecodeOptions]) -> Dict[str, Any]:
+    """Keyword arguments passing `options` on to a backend, leaving them out when there are none."""
+    return {"options": options} if options is not None else {}
 
 class BaseModel(ABC):
+    # Maximum number of results buffered between the inference worker and the event loop.
+    # When the consumer (e.g. a slow SSE client) falls behind, the worker blocks instead of
+    # decoding further ahead.
+    result_queue_size: int = 32
+    # Whether `transcribe_batch` is implemented.
+    supports_batching: bool = False
+
     @abstractmethod
-    async def transcribe(self, audio_file: Union[str, bytes], stream: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+    def transcribe_sync(self, audio_file: Union[str, np.ndarray], stream: bool = False,
+                        options: Optional[DecodeOptions] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Run inference on the calling thread and yield results as they are decoded.
+
+        Called from a worker thread by `transcribe`, never from the event loop. Without `options`,
+        the backend's default decode settings are used; callers only pass them when set.
+        """
         pass
 
     @abstractmethod
-    async def live_transcribe(self, audio_chunk: bytes) -> Dict[str, Any]:
+    def live_transcribe(self, audio: np.ndarray, options: Optional[DecodeOptions] = None,
+                        prompt: Optional[str] = None, language: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Transcribe float32 16 kHz mono audio, returning its words with timestamps relative to its start,
+        and the language with the probability it was detected with.
+
+        Live sessions pass the text preceding `audio` as `prompt`, and `language` once they know it,
+        which skips detection. Like `options`, both are only passed when set.
+        """
+        pass
+
+    def transcribe_batch(self, audio_files: List[Union[str, np.ndarray]],
+                         options: Optional[DecodeOptions] = None) -> List[Dict[str, Any]]:
+        """
+        Transcribe several clips of at most 30 seconds in one batched model pass.
+
+        Returns one non-streaming result per input, in the same order.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support batched inference")
+
+    def warm_up(self, audio: np.ndarray):
+        """
+        Run the inference paths requests take once, so the first requests don't pay for lazy
+        initialisation and memory allocation.
+        """
+        for _ in self.transcribe_sync(audio):
+            pass
+        self.live_transcribe(audio)
+        if self.supports_batching:
+            self.transcribe_batch([audio])
+
+    def memory_bytes(self) -> Optional[int]:
+        """
+        Memory the model takes outside the server process, if any; None counts the growth of
+        the server process while it was loaded.
+        """
+        return None
+
+    def close(self):
+        """Release resources held by the backend beyond its memory."""
         pass
+
+    async def transcribe(self, audio_file: Union[str, np.ndarray], stream: bool = False,
+                         executor: Optional[Executor] = None,
+                         options: Optional[DecodeOptions] = None) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Run `transcribe_sync` on `executor` and hand its results back to the event loop, at most
+        `result_queue_size` of them ahead of the consumer.
+
+        :param audio_file: Audio to transcribe, as accepted by the backend
+        :param stream: Yield words as they are decoded instead of a single result
+        :param executor: Executor to run inference on (the loop's default executor if None)
+        :param options: Decode settings, or None for the backend's defaults
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        # Free places in the queue; the worker waits for one before handing a result over
+        space = threading.Semaphore(self.result_queue_size)
+        cancelled = threading.Event()
+        compute_time = current_compute_time()
+
+        def put(kind, payload) -> bool:
+            while not space.acquire(timeout=0.1):
+                if cancelled.is_set():
+                    return False
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (kind, payload))
+            except RuntimeError:
+                # The loop closed under the consumer
+                return False
+            return True
+
+        def produce():
+            try:
+                items = self.transcribe_sync(audio_file, stream=stream, **options_kwargs(options))
+                while True:
+                    # Time spent handing results over isn't the model's
+                    start = time.perf_counter()
+                    item = next(items, _DONE)
+                    if compute_time is not None:
+                        compute_time.add(time.perf_counter() - start)
+                    if item is _DONE:
+                        break
+                    if cancelled.is_set() or not put(_ITEM, item):
+                        return
+            except Exception as e:
+                put(_ERROR, e)
+            else:
+                put(_DONE, None)
+
+        loop.run_in_executor(executor, produce)
+        try:
+            while True:
+                kind, payload = await queue.get()
+                space.release()
+                if kind == _DONE:
+                    break
+                if kind == _ERROR:
+                    raise payload
+                yield payload
+        finally:
+            # Stop the worker if the consumer went away before it finished.
+            cancelled.set()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from .base import BaseModel, options_kwargs
+from .decoding import DecodeOptions
+from server_metadata import server_metadata
+from utils.logger import model_logger as logger
+from utils.metrics import ComputeTime, Distribution, current_compute_time, queue_wait
+from .model_manager import model_manager
+
+# Whisper encodes audio in 30-second windows; requests that fit in one window are batched.
+MAX_BATCH_AUDIO_DURATION = 30.0
+
+@dataclass
+class _PendingRequest:
+    audio: Any
+    future: asyncio.Future
+    model: BaseModel
+    options: Optional[DecodeOptions] = None
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    compute_time: Optional[ComputeTime] = field(default_factory=current_compute_time)
+
+class BatchScheduler:
+    """
+    Gathers transcription requests that arrive within `max_wait_ms` of each other (up to
+    `max_batch_size`) and runs them through the model as one batched encoder/decoder pass.
+
+    One batch is in flight at a time; requests arriving while it runs form the next batch.
+    Requests for different models or with different decode settings are batched separately.
+    """
+
+    def __init__(self):
+        self.batch_size = Distribution()
+        self.queue_wait = queue_wait("batch")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[Executor] = None
+
+    def start(self, executor: Executor):
+        self._executor = executor
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._dispatch())
+        logger.info(f"Batch scheduler started with {server_metadata.batching.model_dump()}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        while not self._queue.empty():
+            request = self._queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    def accepts(self, audio_duration: float, stream: bool = False, model: Optional[BaseModel] = None,
+                options: Optional[DecodeOptions] = None) -> bool:
+        if self._task is None or stream or not server_metadata.batching.enabled:
+            return False
+        if options is not None and options.timestamps(default=False):
+            # Batched decodes don't align words
+            return False
+        if audio_duration > MAX_BATCH_AUDIO_DURATION:
+            return False
+        return (model or model_manager.get_model()).supports_batching
+
+    async def submit(self, audio: Any, model: Optional[BaseModel] = None,
+                     options: Optional[DecodeOptions] = None) -> Dict[str, Any]:
+        """Transcribe `audio` in a batch with other requests for `model` (the default model if None)."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_PendingRequest(audio, future, model or model_manager.get_model(), options))
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **server_metadata.batching.model_dump(),
+            "batch_size": self.batch_size.summary(),
+            "queue_wait_ms": self.queue_wait.summary(scale=1000)
+        }
+
+    async def _dispatch(self):
+        while True:
+            batch = await self._collect()
+            groups: Dict[Any, List[_PendingRequest]] = {}
+            for request in batch:
+                groups.setdefault((id(request.model), request.options), []).append(request)
+            for group in groups.values():
+                await self._run(group)
+
+    async def _collect(self) -> List[_PendingRequest]:
+        config = server_metadata.batching
+        first = await self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + config.max_wait_ms / 1000
+        while len(batch) < config.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        # Callers that went away while waiting don't need a slot in the batch.
+        return [request for request in batch if not request.future.done()]
+
+    async def _run(self, batch: List[_PendingRequest]):
+        started_at = time.perf_counter()
+        self.batch_size.observe(len(batch))
+        for request in batch:
+            self.queue_wait.observe(started_at - request.enqueued_at)
+
+        def transcribe_batch():
+            start = time.perf_counter()
+            results = batch[0].model.transcribe_batch([request.audio for request in batch],
+                                                      **options_kwargs(batch[0].options))
+            return results, time.perf_counter() - start
+
+        loop = asyncio.get_running_loop()
+        try:
+            results, seconds = await loop.run_in_executor(self._executor, transcribe_batch)
+        except asyncio.CancelledError:
+            for request in batch:
+                request.future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Error in batched transcription of {len(batch)} requests: {str(e)}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        for request, result in zip(batch, results):
+            # Every clip is padded to the same 30-second window, so each costs the same share
+            if request.compute_time is not None:
+                request.compute_time.add(seconds / len(batch))
+            if not request.future.done():
+                request.future.set_result(result)
+
+batch_scheduler = BatchScheduler()
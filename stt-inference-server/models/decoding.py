@@ -0,0 +1,87 @@
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, Optional, Tuple
+from server_metadata import profile_real_time_factor
+
+@dataclass(frozen=True)
+class DecodeOptions:
+    """Decode settings of a request, passed to the backends. None where a backend keeps its default."""
+    profile: str = "accurate"
+    beam_size: int = 5
+    # Temperatures tried in turn while a decode fails Whisper's quality thresholds; one entry disables the fallback
+    temperature: Tuple[float, ...] = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+    # Unset aligns words for streamed and live results only
+    word_timestamps: Optional[bool] = None
+    # Unset detects the language
+    language: Optional[str] = None
+    condition_on_previous_text: bool = True
+
+    def timestamps(self, default: bool) -> bool:
+        return default if self.word_timestamps is None else self.word_timestamps
+
+    def cache_params(self) -> Dict[str, Any]:
+        # The profile's name doesn't change the result, only its settings do
+        params = asdict(self)
+        del params["profile"]
+        return params
+
+# Cheapest first. A request that sets nothing reaches the backends as no options, and they keep
+# their own defaults: the accurate profile's settings on faster-whisper, greedy decoding on openai-whisper.
+PROFILES: Dict[str, DecodeOptions] = {
+    "fast": DecodeOptions(profile="fast", beam_size=1, temperature=(0.0,), condition_on_previous_text=False),
+    "balanced": DecodeOptions(profile="balanced", beam_size=1),
+    "accurate": DecodeOptions(profile="accurate"),
+}
+DEFAULT_PROFILE = "accurate"
+
+def decode_options(profile: Optional[str] = None, beam_size: Optional[int] = None,
+                   temperature: Optional[str] = None, word_timestamps: Optional[bool] = None,
+                   language: Optional[str] = None,
+                   condition_on_previous_text: Optional[bool] = None) -> Optional[DecodeOptions]:
+    """
+    A profile with a request's overrides applied, or None if the request sets neither.
+
+    :param temperature: Comma-separated temperatures to fall back through
+    :raises ValueError: If the profile is unknown or an override is out of range
+    """
+    if profile is not None and profile not in PROFILES:
+        raise ValueError(f"Unsupported profile {profile!r}, expected one of {list(PROFILES)}")
+    if beam_size is not None and beam_size < 1:
+        raise ValueError("beam_size must be at least 1")
+    overrides = {
+        "beam_size": beam_size,
+        "temperature": _temperatures(temperature) if temperature is not None else None,
+        "word_timestamps": word_timestamps,
+        "language": language or None,
+        "condition_on_previous_text": condition_on_previous_text
+    }
+    overrides = {name: value for name, value in overrides.items() if value is not None}
+    if profile is None and not overrides:
+        return None
+    return replace(PROFILES[profile or DEFAULT_PROFILE], **overrides)
+
+def measured_profile(options: Optional[DecodeOptions]) -> Optional[str]:
+    """The profile whose real-time factor a request's timing counts towards; None if its overrides change the cost."""
+    if options is None:
+        return DEFAULT_PROFILE
+    return options.profile if replace(options, language=None) == PROFILES[options.profile] else None
+
+def choose_profile(model_id: str, audio_duration: float, latency_budget: float) -> str:
+    """
+    The cheapest profile expected to transcribe `audio_duration` seconds within `latency_budget`
+    seconds at its measured real-time factor on `model_id`, or the cheapest one overall if none
+    is. Profiles not measured on the model yet aren't expected to fit.
+    """
+    for name in PROFILES:
+        real_time_factor = profile_real_time_factor(model_id, name)
+        if real_time_factor is not None and real_time_factor * audio_duration <= latency_budget:
+            return name
+    return next(iter(PROFILES))
+
+def _temperatures(value: str) -> Tuple[float, ...]:
+    try:
+        temperatures = tuple(float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError(f"Invalid temperature {value!r}, expected comma-separated numbers")
+    if any(not 0 <= temperature <= 1 for temperature in temperatures):
+        raise ValueError("Temperatures must be between 0 and 1")
+    return temperatures
@@ -1,32 +1,110 @@
 from .base import BaseModel
-from faster_whisper import WhisperModel
-from typing import AsyncGenerator, Dict, Any, Union
+from .decoding import DecodeOptions
+from faster_whisper import WhisperModel, decode_audio
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+from utils.metrics import stage, record_encoder, encoder_seconds
+import ctranslate2
 import numpy as np
+import time
+
+_FEATURES = stage("features")
+_DECODER = stage("decoder")
 
 class FasterWhisperModel(BaseModel):
-    def __init__(self, model_id: str, device: str, compute_type: str):
-        self.model = WhisperModel(model_id, device=device, compute_type=compute_type)
+    supports_batching = True
+
+    def __init__(self, model_id: str, device: str, compute_type: str, cpu_threads: int = 0, num_workers: int = 1):
+        # num_workers > 1 lets concurrent calls (e.g. chunks of a long upload) run in parallel
+        self.model = WhisperModel(model_id, device=device, compute_type=compute_type, cpu_threads=cpu_threads,
+                                  num_workers=num_workers)
+        # WhisperModel runs every encoder pass through `encode`; time them there
+        encode = self.model.encode
+
+        def timed_encode(features):
+            start = time.perf_counter()
+            try:
+                return encode(features)
+            finally:
+                record_encoder(time.perf_counter() - start)
 
-    async def transcribe(self, audio_file: Union[str, bytes], stream: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
-        segments, info = self.model.transcribe(audio_file, beam_size=5, word_timestamps=stream)
+        self.model.encode = timed_encode
+
+    def transcribe_sync(self, audio_file: Union[str, np.ndarray], stream: bool = False,
+                        options: Optional[DecodeOptions] = None) -> Iterator[Dict[str, Any]]:
+        options = options or DecodeOptions()
+        word_timestamps = options.timestamps(default=stream)
+        segments, info = self._transcribe(audio_file, **self._decode_kwargs(options, word_timestamps))
         
         if stream:
-            async for word in self._stream_words(segments):
-                yield word
+            yield from self._stream_words(segments)
         else:
-            yield {
-                "transcription": " ".join([segment.text for segment in list(segments)]),
+            segments = list(segments)
+            result = {
+                "transcription": " ".join([segment.text for segment in segments]),
                 "language": info.language,
                 "language_probability": info.language_probability
             }
+            if word_timestamps:
+                result["words"] = list(self._stream_words(segments))
+            yield result
 
-    def live_transcribe(self, audio_chunk: bytes) -> Dict[str, Any]:
-        # Convert bytes to numpy array
-        audio_np = np.frombuffer(audio_chunk, dtype=np.int16).astype(np.float32) / 32768.0
-        
-        segments, info = self.model.transcribe(audio_np, beam_size=5, word_timestamps=True)
-        words = [{"word": word.word, "start": word.start, "end": word.end} 
-                for segment in segments for word in segment.words]
+    def transcribe_batch(self, audio_files: List[Union[str, np.ndarray]],
+                         options: Optional[DecodeOptions] = None) -> List[Dict[str, Any]]:
+        # One deterministic pass per clip: no temperature fallback, and no earlier text to condition on
+        options = options or DecodeOptions()
+        feature_extractor = self.model.feature_extractor
+        start = time.perf_counter()
+        features = np.stack([
+            pad_or_trim(feature_extractor(self._load_audio(audio_file))[..., :feature_extractor.nb_max_frames])
+            for audio_file in audio_files
+        ])
+        encoded = time.perf_counter()
+        _FEATURES.observe(encoded - start)
+        encoder_output = self.model.model.encode(ctranslate2.StorageView.from_array(np.ascontiguousarray(features)))
+        start = time.perf_counter()
+        record_encoder(start - encoded)
+
+        if options.language is not None:
+            languages = [(options.language, 1.0)] * len(audio_files)
+        elif self.model.model.is_multilingual:
+            languages = [(token[2:-2], probability) for token, probability in
+                         (candidates[0] for candidates in self.model.model.detect_language(encoder_output))]
+        else:
+            languages = [("en", 1.0)] * len(audio_files)
+
+        tokenizers = {}
+        prompts = []
+        for language, _ in languages:
+            if language not in tokenizers:
+                tokenizers[language] = Tokenizer(
+                    self.model.hf_tokenizer, self.model.model.is_multilingual, task="transcribe", language=language
+                )
+            tokenizer = tokenizers[language]
+            prompts.append(tokenizer.sot_sequence + [tokenizer.no_timestamps])
+
+        results = self.model.model.generate(
+            encoder_output, prompts, beam_size=options.beam_size, max_length=self.model.max_length, suppress_blank=True
+        )
+        _DECODER.observe(time.perf_counter() - start)
+        return [
+            {
+                "transcription": tokenizers[language].decode(result.sequences_ids[0]),
+                "language": language,
+                "language_probability": probability
+            }
+            for result, (language, probability) in zip(results, languages)
+        ]
+
+    def live_transcribe(self, audio: np.ndarray, options: Optional[DecodeOptions] = None,
+                        prompt: Optional[str] = None, language: Optional[str] = None) -> Dict[str, Any]:
+        options = options or DecodeOptions()
+        kwargs = self._decode_kwargs(options, options.timestamps(default=True))
+        if language is not None:
+            kwargs["language"] = language
+        segments, info = self._transcribe(audio, initial_prompt=prompt, **kwargs)
+        words = list(self._stream_words(segments))
         
         return {
             "words": words,
@@ -34,12 +112,60 @@ class FasterWhisperModel(BaseModel):
             "language_probability": info.language_probability
         }
     
+    def _transcribe(self, audio_file: Union[str, np.ndarray], **kwargs) -> Tuple[Iterator[Any], Any]:
+        """
+        `WhisperModel.transcribe`, timing its stages: the call itself extracts features and detects
+        the language, and iterating the segments decodes them (encoder passes are timed apart).
+        """
+        encoded = encoder_seconds()
+        start = time.perf_counter()
+        segments, info = self.model.transcribe(audio_file, **kwargs)
+        _FEATURES.observe(time.perf_counter() - start - (encoder_seconds() - encoded))
+        return self._timed_segments(segments), info
+
+    @staticmethod
+    def _timed_segments(segments: Iterable[Any]) -> Iterator[Any]:
+        """Yield `segments`, recording the time spent producing them, less encoding, as decoder time."""
+        iterator = iter(segments)
+        encoded = encoder_seconds()
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    segment = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield segment
+        finally:
+            _DECODER.observe(elapsed - (encoder_seconds() - encoded))
+
+    @staticmethod
+    def _decode_kwargs(options: DecodeOptions, word_timestamps: bool) -> Dict[str, Any]:
+        return {
+            "beam_size": options.beam_size,
+            "temperature": list(options.temperature),
+            "language": options.language,
+            "condition_on_previous_text": options.condition_on_previous_text,
+            "word_timestamps": word_timestamps
+        }
+
     @staticmethod
-    async def _stream_words(segments) -> AsyncGenerator[Dict[str, Any], None]:
+    def _stream_words(segments) -> Iterator[Dict[str, Any]]:
         for segment in segments:
+            if segment.words is None:
+                # Without word alignment, each segment is passed on as a single unit
+                yield {"word": segment.text, "start": segment.start, "end": segment.end}
+                continue
             for word in segment.words:
                 yield {
                     "word": word.word,
                     "start": word.start,
                     "end": word.end
-                }
\ No newline at end of file
+                }
+
+    @staticmethod
+    def _load_audio(audio_file: Union[str, np.ndarray]) -> np.ndarray:
+        return audio_file if isinstance(audio_file, np.ndarray) else decode_audio(audio_file)
@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Dict, Optional, Tuple
+import numpy as np
+from . import long_audio
+from .base import BaseModel
+from .batch_scheduler import batch_scheduler
+from .decoding import DecodeOptions
+from .result_cache import result_cache
+
+async def cache_key(audio: np.ndarray, executor: Executor, stream: bool, params: Optional[Dict[str, Any]] = None,
+                    options: Optional[DecodeOptions] = None) -> Optional[str]:
+    """
+    :param params: Settings beyond the server's that the transcription depends on, such as a
+        model other than the default one
+    :param options: Decode settings of the request, if it has any
+    """
+    if not result_cache.enabled:
+        return None
+    params = {"stream": stream, **(params or {}), **(options.cache_params() if options is not None else {})}
+    # Hashing a long recording takes a while; keep it off the event loop.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, result_cache.key, audio, params)
+
+async def run_inference(model: BaseModel, audio: np.ndarray, executor: Executor, audio_duration: float,
+                        options: Optional[DecodeOptions] = None) -> Dict[str, Any]:
+    """Non-streaming transcription, batched with other requests or split into parallel chunks where possible."""
+    if batch_scheduler.accepts(audio_duration, model=model, options=options):
+        return await batch_scheduler.submit(audio, model, options)
+    if long_audio.accepts(audio_duration):
+        return await long_audio.transcribe_long(model, audio, executor, options=options)
+    transcribe_generator = model.transcribe(audio, stream=False, executor=executor, options=options)
+    try:
+        return await anext(transcribe_generator)
+    finally:
+        await transcribe_generator.aclose()
+
+async def transcribe_audio(model: BaseModel, audio: np.ndarray, executor: Executor, audio_duration: float,
+                           params: Optional[Dict[str, Any]] = None,
+                           options: Optional[DecodeOptions] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Non-streaming transcription through the result cache.
+
+    :return: The result, and whether it came from the cache (or another request's inference)
+    """
+    if batch_scheduler.accepts(audio_duration, model=model, options=options):
+        # Batched decodes skip temperature fallback and return less than single ones; keep their results apart
+        params = {**(params or {}), "batched": True}
+    key = await cache_key(audio, executor, stream=False, params=params, options=options)
+    if key is None:
+        return await run_inference(model, audio, executor, audio_duration, options), False
+    # Identical requests in flight at the same time share one inference
+    return await result_cache.get_or_compute(key, lambda: run_inference(model, audio, executor, audio_duration, options))
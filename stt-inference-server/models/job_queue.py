@@ -0,0 +1,342 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+from server_metadata import server_metadata
+from utils.audio_utils import decode_audio, SAMPLE_RATE
+from utils.logger import model_logger as logger
+from utils.priority_executor import Priority, set_scheduling
+from .admission import admission, Overloaded
+from .inference import transcribe_audio
+from .model_manager import model_manager
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT,
+    content BLOB,
+    status TEXT NOT NULL,
+    audio_duration REAL,
+    result TEXT,
+    error TEXT,
+    started_at REAL,
+    finished_at REAL,
+    finished_seq INTEGER,
+    PRIMARY KEY (job_id, position)
+);
+CREATE INDEX IF NOT EXISTS job_files_status ON job_files (status);
+CREATE INDEX IF NOT EXISTS job_files_finished ON job_files (job_id, finished_seq);
+"""
+
+@dataclass
+class JobFile:
+    """One file of a job: uploaded `content`, or a server-local `path`."""
+    name: str
+    path: Optional[str] = None
+    content: Optional[bytes] = None
+
+class JobStore:
+    """SQLite tables of jobs and their files; every method blocks, so call them on a worker thread."""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+            row = self._connection.execute("SELECT MAX(finished_seq) FROM job_files").fetchone()
+            self._finished_seq = row[0] or 0
+
+    def recover(self) -> int:
+        """Requeue files that were running when the server stopped."""
+        with self._lock:
+            return self._connection.execute(
+                "UPDATE job_files SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING)
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM job_files GROUP BY status").fetchall()
+        return {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)} | dict(rows)
+
+    def create(self, files: List[JobFile]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.execute("INSERT INTO jobs (id, created_at) VALUES (?, ?)", (job_id, time.time()))
+            self._connection.executemany(
+                "INSERT INTO job_files (job_id, position, name, path, content, status) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, position, file.name, file.path, file.content, QUEUED) for position, file in enumerate(files)]
+            )
+            self._connection.execute("COMMIT")
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, int, JobFile]]:
+        """Take the oldest queued file, marking it running."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT job_id, position, name, path, content FROM job_files WHERE status = ? ORDER BY rowid LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE job_files SET status = ?, started_at = ? WHERE job_id = ? AND position = ?",
+                (RUNNING, time.time(), row[0], row[1])
+            )
+        return row[0], row[1], JobFile(row[2], row[3], row[4])
+
+    def requeue(self, job_id: str, position: int):
+        """Put a claimed file back at the head of the queue."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE job_files SET status = ?, started_at = NULL WHERE job_id = ? AND position = ?",
+                (QUEUED, job_id, position)
+            )
+
+    def finish(self, job_id: str, position: int, audio_duration: Optional[float],
+               result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._lock:
+            self._finished_seq += 1
+            self._connection.execute("BEGIN")
+            # The upload is no longer needed once it has a result
+            self._connection.execute(
+                "UPDATE job_files SET status = ?, audio_duration = ?, result = ?, error = ?, finished_at = ?, "
+                "finished_seq = ?, content = NULL WHERE job_id = ? AND position = ?",
+                (FAILED if error else DONE, audio_duration, json.dumps(result) if result is not None else None,
+                 error, time.time(), self._finished_seq, job_id, position)
+            )
+            self._connection.execute(
+                "UPDATE jobs SET finished_at = ? WHERE id = ? AND NOT EXISTS "
+                "(SELECT 1 FROM job_files WHERE job_id = ? AND status IN (?, ?))",
+                (time.time(), job_id, job_id, QUEUED, RUNNING)
+            )
+            self._connection.execute("COMMIT")
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._connection.execute("SELECT created_at, finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*), SUM(audio_duration), MIN(started_at) FROM job_files WHERE job_id = ? GROUP BY status",
+                (job_id,)
+            ).fetchall()
+        return {"created_at": job[0], "finished_at": job[1], "files": {row[0]: row[1:] for row in rows}}
+
+    def finished_files(self, job_id: str, after: int) -> List[Dict[str, Any]]:
+        """Files of a job that finished after `finished_seq` `after`, in the order they finished."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT position, name, status, audio_duration, result, error, finished_seq FROM job_files "
+                "WHERE job_id = ? AND finished_seq > ? ORDER BY finished_seq",
+                (job_id, after)
+            ).fetchall()
+        return [
+            {
+                "index": position,
+                "file": name,
+                "status": status,
+                "audio_duration": audio_duration,
+                **(json.loads(result) if result else {}),
+                **({"error": error} if error else {}),
+                "finished_seq": finished_seq
+            }
+            for position, name, status, audio_duration, result, error, finished_seq in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class JobQueue:
+    """
+    Durable queue of bulk transcription jobs, worked through in the background.
+
+    Jobs are stored in SQLite at `server_metadata.jobs.path`, so queued files survive a restart.
+    `concurrency` workers take files in submission order and transcribe them at bulk priority
+    through the same path as uploads, so short files are batched together when batching is on.
+    Each file is admitted like an upload; one turned away by admission goes back in the queue,
+    and no files are taken while the server drains.
+    """
+
+    def __init__(self):
+        self.store: Optional[JobStore] = None
+        self._executor: Optional[Executor] = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        # Events of the streams watching each job, set when one of its files finishes
+        self._job_events: Dict[str, Set[asyncio.Event]] = {}
+        self._counts: Dict[str, int] = {}
+
+    @property
+    def concurrency(self) -> int:
+        return server_metadata.jobs.concurrency or max(2, server_metadata.batching.max_batch_size)
+
+    async def start(self, executor: Executor):
+        loop = asyncio.get_running_loop()
+        self._executor = executor
+        self.store = await loop.run_in_executor(executor, JobStore, server_metadata.jobs.path)
+        recovered = await loop.run_in_executor(executor, self.store.recover)
+        self._counts = await loop.run_in_executor(executor, self.store.counts)
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        logger.info(f"Job queue started with {self.concurrency} workers, {self._counts[QUEUED]} files queued "
+                    f"({recovered} recovered)")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    async def submit(self, files: List[JobFile]) -> str:
+        job_id = await asyncio.get_running_loop().run_in_executor(self._executor, self.store.create, files)
+        self._counts[QUEUED] += len(files)
+        self._wakeup.set()
+        return job_id
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await asyncio.get_running_loop().run_in_executor(self._executor, self.store.job, job_id)
+        if job is None:
+            return None
+        files = job["files"]
+        count = {status: files[status][0] if status in files else 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        total = sum(count.values())
+        finished = count[DONE] + count[FAILED]
+        done_audio = (files[DONE][1] or 0.0) if DONE in files else 0.0
+        started = [files[status][2] for status in files if files[status][2] is not None]
+
+        # Audio of unfinished files isn't known until they are decoded: assume the average so far.
+        remaining_audio = done_audio / count[DONE] * (count[QUEUED] + count[RUNNING]) if count[DONE] else None
+        rtf = server_metadata.stats.real_time_factor
+        eta = remaining_audio * rtf / self.concurrency if remaining_audio is not None and rtf else None
+        elapsed = (job["finished_at"] or time.time()) - min(started) if started else 0.0
+        if job["finished_at"]:
+            status = "completed"
+        elif count[RUNNING] or finished:
+            status = "running"
+        else:
+            status = "queued"
+        return {
+            "id": job_id,
+            "status": status,
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+            "files": total,
+            **count,
+            "progress": finished / total if total else 1.0,
+            "audio_duration": done_audio,
+            "throughput": done_audio / elapsed if elapsed > 0 else None,
+            "eta": 0.0 if job["finished_at"] else eta
+        }
+
+    async def results(self, job_id: str):
+        """Yield the job's finished files as they finish, ending once the whole job has."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        self._job_events.setdefault(job_id, set()).add(event)
+        after = 0
+        try:
+            while True:
+                event.clear()
+                # Read the status first: if the job had finished by then, the query below sees every file.
+                status = await self.status(job_id)
+                files = await loop.run_in_executor(self._executor, self.store.finished_files, job_id, after)
+                for file in files:
+                    after = file.pop("finished_seq")
+                    yield file
+                if status["finished_at"]:
+                    return
+                if not files:
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            watchers = self._job_events.get(job_id)
+            if watchers is not None:
+                watchers.discard(event)
+                if not watchers:
+                    del self._job_events[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"concurrency": self.concurrency, **self._counts}
+
+    async def _work(self):
+        # Job files yield the thread pool to live sessions and interactive uploads
+        set_scheduling(Priority.BULK)
+        loop = asyncio.get_running_loop()
+        # Queued files wait for the model, which is loaded after the queue starts
+        while not model_manager.is_loaded:
+            await asyncio.sleep(1.0)
+        while True:
+            claimed = await loop.run_in_executor(self._executor, self.store.claim) if not admission.draining else None
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._counts[QUEUED] -= 1
+            self._counts[RUNNING] += 1
+            await self._process(*claimed)
+
+    async def _process(self, job_id: str, position: int, file: JobFile):
+        loop = asyncio.get_running_loop()
+        audio_duration, result, error = None, None, None
+        try:
+            content = file.content if file.content is not None else \
+                await loop.run_in_executor(self._executor, _read_file, file.path)
+            audio = await loop.run_in_executor(self._executor, decode_audio, content)
+            del content
+            audio_duration = len(audio) / SAMPLE_RATE
+            async with await model_manager.acquire() as lease:
+                async with await admission.acquire(audio_duration):
+                    # Timed once admitted, so the real-time factor is the transcription's own
+                    start_time = time.time()
+                    result, cached = await transcribe_audio(lease.model, audio, self._executor, audio_duration,
+                                                            params=lease.cache_params)
+            if not cached:
+                server_metadata.update_stats(audio_duration, time.time() - start_time, lease.model_id)
+        except asyncio.CancelledError:
+            raise
+        except Overloaded as e:
+            # Tried again once the server has room, or after a restart if it is draining
+            await loop.run_in_executor(self._executor, self.store.requeue, job_id, position)
+            self._counts[RUNNING] -= 1
+            self._counts[QUEUED] += 1
+            await asyncio.sleep(e.retry_after)
+            return
+        except Exception as e:
+            logger.error(f"Error transcribing {file.name} of job {job_id}: {str(e)}")
+            error = str(e)
+        await loop.run_in_executor(self._executor, self.store.finish, job_id, position, audio_duration, result, error)
+        self._counts[RUNNING] -= 1
+        self._counts[FAILED if error else DONE] += 1
+        for event in self._job_events.get(job_id, ()):
+            event.set()
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+job_queue = JobQueue()
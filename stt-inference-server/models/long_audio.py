@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from server_metadata import server_metadata
+from utils.audio_utils import SAMPLE_RATE
+from utils.vad import split_on_silence
+from .base import BaseModel
+from .decoding import DecodeOptions
+
+_ITEM, _DONE, _ERROR = range(3)
+
+def accepts(audio_duration: float) -> bool:
+    config = server_metadata.long_audio
+    return config.enabled and audio_duration >= config.min_duration
+
+async def transcribe_chunked(model: BaseModel, audio: np.ndarray, executor: Executor, stream: bool = False,
+                             options: Optional[DecodeOptions] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Transcribe a long recording as chunks split at pauses, `server_metadata.long_audio.parallelism`
+    chunks at a time, and yield each chunk's results in order with timestamps relative to the
+    whole recording.
+
+    Results of the first unfinished chunk are passed on as they are decoded; later chunks are
+    held until every chunk before them is complete.
+    """
+    config = server_metadata.long_audio
+    loop = asyncio.get_running_loop()
+    bounds = await loop.run_in_executor(executor, split_on_silence, audio, SAMPLE_RATE, config.chunk_duration)
+    semaphore = asyncio.Semaphore(config.parallelism)
+    outputs = [asyncio.Queue() for _ in bounds]
+
+    async def run_chunk(output: asyncio.Queue, start: int, end: int):
+        offset = start / SAMPLE_RATE
+        try:
+            async with semaphore:
+                async for item in model.transcribe(audio[start:end], stream=stream, executor=executor, options=options):
+                    output.put_nowait((_ITEM, _shift(item, offset)))
+            output.put_nowait((_DONE, None))
+        except Exception as e:
+            output.put_nowait((_ERROR, e))
+
+    # Chunks queue on the semaphore in creation order, so the earliest ones are decoded first.
+    tasks = [asyncio.create_task(run_chunk(output, start, end)) for output, (start, end) in zip(outputs, bounds)]
+    try:
+        for output in outputs:
+            while True:
+                kind, payload = await output.get()
+                if kind == _DONE:
+                    break
+                if kind == _ERROR:
+                    raise payload
+                yield payload
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def transcribe_stream(model: BaseModel, chunks: AsyncIterator[np.ndarray], executor: Executor,
+                            options: Optional[DecodeOptions] = None,
+                            admit: Optional[Callable[[float], Awaitable[AsyncContextManager]]] = None
+                            ) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Transcribe a recording that is still arriving, as float32 16 kHz samples from `chunks`, and
+    yield its words in order with timestamps relative to the whole recording.
+
+    Audio is cut at pauses into windows of at most `server_metadata.long_audio.chunk_duration`
+    seconds as soon as enough of it has arrived to place the cut, and up to `parallelism`
+    windows are transcribed while the rest arrives. `chunks` isn't read further while that many
+    windows are unfinished, so memory stays bounded whatever the length of the recording.
+
+    :param admit: Called with each window's duration for a context manager held while it is
+        transcribed, such as an admission ticket
+    """
+    config = server_metadata.long_audio
+    loop = asyncio.get_running_loop()
+    window_size = int(config.chunk_duration * SAMPLE_RATE)
+    # One output queue per window, in order; then None at the end of the audio, or the error reading it
+    outputs: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(config.parallelism)
+    tasks = []
+
+    async def run_window(output: asyncio.Queue, window: np.ndarray, offset: float):
+        try:
+            async with await admit(len(window) / SAMPLE_RATE) if admit is not None else contextlib.nullcontext():
+                async for item in model.transcribe(window, stream=True, executor=executor, options=options):
+                    output.put_nowait((_ITEM, _shift(item, offset)))
+            output.put_nowait((_DONE, None))
+        except Exception as e:
+            output.put_nowait((_ERROR, e))
+
+    async def start_windows(audio: np.ndarray, bounds: List[Tuple[int, int]], offset: int):
+        for start, end in bounds:
+            await slots.acquire()
+            output = asyncio.Queue()
+            tasks.append(asyncio.create_task(run_window(output, audio[start:end], (offset + start) / SAMPLE_RATE)))
+            outputs.put_nowait(output)
+
+    async def read():
+        pending, pending_size, offset = [], 0, 0
+        try:
+            async for chunk in chunks:
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size <= window_size:
+                    continue
+                audio = np.concatenate(pending)
+                bounds = await loop.run_in_executor(executor, split_on_silence, audio, SAMPLE_RATE, config.chunk_duration)
+                # Every cut but the last is final; the last window can still grow
+                await start_windows(audio, bounds[:-1], offset)
+                last = bounds[-1][0]
+                pending, pending_size, offset = [audio[last:].copy()], len(audio) - last, offset + last
+            audio = np.concatenate(pending) if pending else np.zeros(0, dtype=np.float32)
+            if len(audio):
+                bounds = await loop.run_in_executor(executor, split_on_silence, audio, SAMPLE_RATE, config.chunk_duration)
+                await start_windows(audio, bounds, offset)
+            outputs.put_nowait(None)
+        except Exception as e:
+            outputs.put_nowait(e)
+
+    reader = asyncio.create_task(read())
+    try:
+        while True:
+            output = await outputs.get()
+            if output is None:
+                break
+            if isinstance(output, Exception):
+                raise output
+            while True:
+                kind, payload = await output.get()
+                if kind == _DONE:
+                    break
+                if kind == _ERROR:
+                    raise payload
+                yield payload
+            slots.release()
+    finally:
+        for task in [reader, *tasks]:
+            task.cancel()
+        await asyncio.gather(reader, *tasks, return_exceptions=True)
+
+async def transcribe_long(model: BaseModel, audio: np.ndarray, executor: Executor,
+                          options: Optional[DecodeOptions] = None) -> Dict[str, Any]:
+    """Non-streaming transcription of a long recording, stitched from its chunks."""
+    results = [result async for result in transcribe_chunked(model, audio, executor, options=options)]
+    return merge_results(results)
+
+def merge_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    languages = Counter(result["language"] for result in results if result.get("language"))
+    language = languages.most_common(1)[0][0] if languages else None
+    merged = {
+        "transcription": " ".join(
+            result["transcription"].strip() for result in results if result["transcription"].strip()
+        ),
+        "language": language,
+        "chunks": len(results)
+    }
+    probabilities = [result["language_probability"] for result in results
+                     if result.get("language") == language and "language_probability" in result]
+    if probabilities:
+        merged["language_probability"] = float(np.mean(probabilities))
+    if any("words" in result for result in results):
+        merged["words"] = [word for result in results for word in result.get("words", [])]
+    if any("segments" in result for result in results):
+        merged["segments"] = [segment for result in results for segment in result.get("segments", [])]
+    return merged
+
+def _shift(item: Dict[str, Any], offset: float) -> Dict[str, Any]:
+    """Move the timestamps of a word, segment or result from chunk time to recording time."""
+    shifted = dict(item)
+    for key in ("start", "end"):
+        if key in shifted:
+            shifted[key] = round(shifted[key] + offset, 3)
+    for key in ("words", "segments"):
+        if isinstance(shifted.get(key), list):
+            shifted[key] = [_shift(child, offset) for child in shifted[key]]
+    return shifted
@@ -1,43 +1,386 @@
-from server_metadata import server_metadata, Backend
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import partial
+import asyncio
+import importlib
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
+import numpy as np
+from server_metadata import server_metadata, Backend, Device, ModelSpec, Quantization
+from utils.audio_utils import decode_audio, SAMPLE_RATE
 from utils.logger import model_logger as logger
-from .faster_whisper_backend import FasterWhisperModel
-from .openai_whisper_backend import OpenAIWhisperModel
+from utils.metrics import resident_bytes
+from .base import BaseModel
+from .worker_pool import WorkerPoolModel
+
+# Backend classes by module, imported on first use so that only the selected backend's
+# libraries (CTranslate2, or torch and whisper) are loaded.
+BACKENDS: Dict[Backend, Tuple[str, str]] = {
+    Backend.FASTER_WHISPER: (".faster_whisper_backend", "FasterWhisperModel"),
+    Backend.OPENAI_WHISPER: (".openai_whisper_backend", "OpenAIWhisperModel"),
+}
+
+# Clip transcribed at startup to warm the model up
+WARMUP_AUDIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "audio.wav")
+
+def backend_class(backend: Backend) -> Type[BaseModel]:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unsupported backend: {backend}")
+    module, name = BACKENDS[backend]
+    return getattr(importlib.import_module(module, __package__), name)
+
+def create_model(backend: Backend, model_id: str, device: Device, quantization: Quantization,
+                 cpu_threads: int = 0, num_workers: int = 1) -> BaseModel:
+    model_class = backend_class(backend)
+    if backend == Backend.FASTER_WHISPER:
+        return model_class(model_id, device, quantization, cpu_threads=cpu_threads, num_workers=num_workers)
+    return model_class(model_id, device, cpu_threads=cpu_threads)
+
+class UnknownModel(ValueError):
+    """Raised when a request selects a model the server doesn't offer."""
+
+class SwapInProgress(RuntimeError):
+    """Raised when the default model is swapped while an earlier swap hasn't finished."""
+
+@dataclass
+class LoadedModel:
+    name: str
+    model_id: str
+    quantization: Quantization
+    model: BaseModel
+    # Memory the model took when it was loaded
+    memory_bytes: int = 0
+    load_seconds: float = 0.0
+    # Requests and sessions using the model; it isn't unloaded while they do
+    leases: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    # Replaced as the default model; unloaded once the last request using it is done
+    retired: bool = False
+
+class ModelLease:
+    """A request's hold on a loaded model, keeping it resident. Releasing it more than once is harmless."""
+
+    def __init__(self, manager: "ModelManager", entry: LoadedModel, default: bool):
+        self._manager = manager
+        self._entry = entry
+        self.default = default
+        self.released = False
+
+    @property
+    def model(self) -> BaseModel:
+        return self._entry.model
+
+    @property
+    def model_id(self) -> str:
+        return self._entry.model_id
+
+    @property
+    def cache_params(self) -> Dict[str, str]:
+        """The model's settings for the result cache key, which may differ from the server's default model."""
+        return {"model_id": self._entry.model_id, "quantization": self._entry.quantization.value}
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._entry.leases -= 1
+            self._entry.last_used = time.monotonic()
+            if self._entry.retired and not self._entry.leases:
+                self._manager._unload_retired(self._entry)
+
+    async def __aenter__(self) -> "ModelLease":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
 
 class ModelManager:
+    """
+    The default model, loaded at startup, and the models of `server_metadata.models.available`,
+    loaded when a request first selects them and shared by every request using them. Models
+    loaded on demand are unloaded least recently used first once they take more than
+    `memory_budget_mb`; the default model and models in use stay loaded.
+    """
+
     def __init__(self):
-        self.model = None
+        self._default: Optional[LoadedModel] = None
+        # Models loaded on demand, least recently used first
+        self._models: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        # Memory each model took when it was last loaded, to make room for it before loading it again
+        self._footprints: Dict[str, int] = {}
+        self._load_lock = asyncio.Lock()
+        self._swap_lock = asyncio.Lock()
+        # Former default models still finishing requests and live sessions
+        self._retired: List[LoadedModel] = []
         self.is_loaded = False
+        # Loaded and warmed up, so requests get the expected latency
+        self.is_ready = False
+        self.error: Optional[str] = None
+        # Seconds taken by each startup step
+        self.timings: Dict[str, float] = {}
 
     def load_model(self):
         try:
-            if server_metadata.backend == Backend.FASTER_WHISPER:
-                self.model = FasterWhisperModel(
-                    server_metadata.model_id,
-                    server_metadata.device,
-                    server_metadata.quantization
-                )
-            elif server_metadata.backend == Backend.OPENAI_WHISPER:
-                self.model = OpenAIWhisperModel(
-                    server_metadata.model_id,
-                    server_metadata.device
-                )
-            else:
-                raise ValueError(f"Unsupported backend: {server_metadata.backend}")
+            start = time.perf_counter()
+            backend_class(server_metadata.backend)
+            loaded = time.perf_counter()
+            self.timings["backend_import"] = loaded - start
+
+            before = resident_bytes()
+            self.model = self._create(server_metadata.model_id, server_metadata.quantization)
+            self.timings["load"] = time.perf_counter() - loaded
+            self._default.load_seconds = self.timings["load"]
+            self._default.memory_bytes = self._footprint(self.model, before)
 
             self.is_loaded = True
             server_metadata.is_loaded = True
             logger.info(f"Loaded {server_metadata.backend} model {server_metadata.model_id} "
-                        f"on {server_metadata.device} with {server_metadata.quantization}")
+                        f"on {server_metadata.device} with {server_metadata.quantization} "
+                        f"in {self.timings['load']:.2f}s ({self.timings['backend_import']:.2f}s importing the backend)")
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             self.is_loaded = False
             server_metadata.is_loaded = False
             raise
 
+    def prepare(self):
+        """
+        Load the model unless it already is, warm it up, and mark it ready. A failure is kept in
+        `error` for the health checks rather than raised.
+        """
+        try:
+            if not self.is_loaded:
+                logger.info("Loading model...")
+                self.load_model()
+            if server_metadata.startup.warmup:
+                self.warm_up()
+        except Exception as e:
+            logger.error(f"Failed to prepare the model: {str(e)}")
+            self.error = str(e)
+            return
+        self.is_ready = True
+
+    def warm_up(self):
+        """Transcribe the warm-up clip (`server_metadata.startup.warmup_audio`, or the bundled one)."""
+        start = time.perf_counter()
+        self.get_model().warm_up(self._warmup_audio())
+        self.timings["warmup"] = time.perf_counter() - start
+        logger.info(f"Warmed up in {self.timings['warmup']:.2f}s")
+
+    @staticmethod
+    def _warmup_audio() -> np.ndarray:
+        path = server_metadata.startup.warmup_audio or WARMUP_AUDIO
+        try:
+            with open(path, "rb") as f:
+                return decode_audio(f.read())
+        except OSError as e:
+            logger.warning(f"Warm-up clip {path} unavailable ({str(e)}), warming up on noise")
+            return np.random.default_rng(0).normal(0, 0.01, 5 * SAMPLE_RATE).astype(np.float32)
+
+    def unload_model(self):
+        if self.model is not None:
+            self.model.close()
+        self.model = None
+        for entry in [*self._models.values(), *self._retired]:
+            entry.model.close()
+        self._models.clear()
+        self._retired.clear()
+        self.is_loaded = False
+        self.is_ready = False
+        server_metadata.is_loaded = False
+
     def get_model(self):
         if not self.is_loaded or self.model is None:
             logger.error("Model not loaded. Please load a model first.")
             raise ValueError("Model not loaded. Please load a model first.")
         return self.model
 
-model_manager = ModelManager()
\ No newline at end of file
+    @property
+    def model(self) -> Optional[BaseModel]:
+        """The default model."""
+        return self._default.model if self._default is not None else None
+
+    @model.setter
+    def model(self, model: Optional[BaseModel]):
+        self._default = None if model is None else \
+            LoadedModel(server_metadata.model_id, server_metadata.model_id, server_metadata.quantization, model)
+
+    def spec(self, name: str) -> ModelSpec:
+        """The model requests select by `name`, or UnknownModel if the server doesn't offer it."""
+        if name == server_metadata.model_id:
+            return ModelSpec(model_id=server_metadata.model_id, quantization=server_metadata.quantization)
+        available = server_metadata.models.available
+        if name not in available:
+            offered = sorted({server_metadata.model_id, *available})
+            raise UnknownModel(f"Unknown model {name!r}, expected one of {offered}")
+        return available[name]
+
+    async def acquire(self, name: Optional[str] = None) -> ModelLease:
+        """
+        Lease the model selected by `name` (the default model if None), loading it first if it
+        isn't resident. Requests selecting a model while it loads wait for that same load.
+
+        :raises UnknownModel: If `name` is neither the default model nor an available one
+        """
+        if name is None or name == server_metadata.model_id:
+            self.get_model()
+            entry, default = self._default, True
+        else:
+            spec = self.spec(name)
+            # Another load may unload the model again before this request gets to it
+            while name not in self._models:
+                load = self._loading.get(name)
+                if load is None:
+                    load = self._loading[name] = asyncio.ensure_future(self._load(name, spec))
+                # A request going away doesn't cancel the load for the others waiting on it
+                await asyncio.shield(load)
+            entry, default = self._models[name], False
+            self._models.move_to_end(name)
+        entry.leases += 1
+        entry.last_used = time.monotonic()
+        return ModelLease(self, entry, default)
+
+    async def swap(self, model_id: str, quantization: Optional[Quantization] = None) -> LoadedModel:
+        """
+        Load `model_id` next to the default model, warm it up, and make it the default model for
+        requests and live sessions from then on. Those already using the old model finish on it;
+        it is unloaded after the last of them.
+
+        :raises SwapInProgress: If another swap hasn't finished
+        """
+        if self._swap_lock.locked():
+            raise SwapInProgress("A model swap is already in progress")
+        quantization = quantization or server_metadata.quantization
+        loop = asyncio.get_running_loop()
+        async with self._swap_lock, self._load_lock:
+            logger.info(f"Swapping the default model for {model_id} with {quantization}")
+            start = time.perf_counter()
+            before = resident_bytes()
+            model = await loop.run_in_executor(None, self._create, model_id, quantization)
+            entry = LoadedModel(model_id, model_id, quantization, model, load_seconds=time.perf_counter() - start)
+            try:
+                if server_metadata.startup.warmup:
+                    await loop.run_in_executor(None, model.warm_up, self._warmup_audio())
+            except Exception:
+                await loop.run_in_executor(None, model.close)
+                raise
+            entry.memory_bytes = self._footprint(model, before)
+
+        # Nothing else runs on the event loop in between, so every request sees one model or the other
+        old, self._default = self._default, entry
+        server_metadata.model_id, server_metadata.quantization = model_id, quantization
+        logger.info(f"Switched to {model_id} after {time.perf_counter() - start:.2f}s")
+        if old is not None:
+            old.retired = True
+            if old.leases:
+                logger.info(f"Draining {old.leases} requests and sessions on {old.model_id}")
+                self._retired.append(old)
+            else:
+                await loop.run_in_executor(None, old.model.close)
+        return entry
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Resident models and the memory they take."""
+        entries = ([self._default] if self._default is not None else []) + list(self._models.values()) + self._retired
+        now = time.monotonic()
+        return [
+            {
+                "name": entry.name,
+                "model_id": entry.model_id,
+                "quantization": entry.quantization.value,
+                "default": entry is self._default,
+                "memory_mb": round(entry.memory_bytes / 2**20, 1),
+                "load_seconds": round(entry.load_seconds, 3),
+                "in_use": entry.leases,
+                "draining": entry.retired,
+                "idle_seconds": 0.0 if entry.leases else round(now - entry.last_used, 1)
+            }
+            for entry in entries
+        ]
+
+    def _create(self, model_id: str, quantization: Quantization) -> BaseModel:
+        model_factory = partial(create_model, server_metadata.backend, model_id, server_metadata.device, quantization)
+        pool = server_metadata.worker_pool
+        if pool.enabled:
+            threads = pool.threads_per_worker or max(1, multiprocessing.cpu_count() // pool.workers)
+            return WorkerPoolModel(model_factory, pool.workers, threads)
+        inference = server_metadata.inference
+        num_workers = inference.num_workers or max(1, server_metadata.long_audio.parallelism)
+        cpu_threads = inference.cpu_threads
+        if not cpu_threads and num_workers > 1 and server_metadata.backend == Backend.FASTER_WHISPER:
+            # Each of the model's workers runs its own threads: split the cores between them
+            # rather than have each take its default and oversubscribe the CPU
+            cpu_threads = max(1, multiprocessing.cpu_count() // num_workers)
+        return model_factory(cpu_threads=cpu_threads, num_workers=num_workers)
+
+    @staticmethod
+    def _footprint(model: BaseModel, rss_before: Optional[int]) -> int:
+        # Loads are serialized, so the growth of the process is the model's unless it lives elsewhere
+        memory = model.memory_bytes()
+        if memory is None:
+            rss_after = resident_bytes()
+            memory = max(0, rss_after - rss_before) if rss_before is not None and rss_after is not None else 0
+        return memory
+
+    async def _load(self, name: str, spec: ModelSpec):
+        loop = asyncio.get_running_loop()
+        quantization = spec.quantization or server_metadata.quantization
+        try:
+            async with self._load_lock:
+                await self._evict(incoming=self._footprints.get(name, 0))
+                logger.info(f"Loading model {name} ({spec.model_id} with {quantization})")
+                start = time.perf_counter()
+                before = resident_bytes()
+                model = await loop.run_in_executor(None, self._create, spec.model_id, quantization)
+                entry = LoadedModel(name, spec.model_id, quantization, model,
+                                    memory_bytes=self._footprint(model, before),
+                                    load_seconds=time.perf_counter() - start)
+                self._footprints[name] = entry.memory_bytes
+                self._models[name] = entry
+                logger.info(f"Loaded model {name} in {entry.load_seconds:.2f}s, "
+                            f"taking {entry.memory_bytes / 2**20:.0f} MB")
+                await self._evict(keep=name)
+        except Exception as e:
+            logger.error(f"Error loading model {name}: {str(e)}")
+            raise
+        finally:
+            self._loading.pop(name, None)
+
+    def _unload_retired(self, entry: LoadedModel):
+        logger.info(f"Unloading {entry.model_id}, the last request using it is done")
+        self._retired.remove(entry)
+        try:
+            # Closing a worker pool waits for its processes; keep that off the event loop
+            asyncio.get_running_loop().run_in_executor(None, entry.model.close)
+        except RuntimeError:
+            entry.model.close()
+
+    async def _evict(self, incoming: int = 0, keep: Optional[str] = None):
+        """Unload idle models, least recently used first, until `incoming` more bytes fit the budget."""
+        budget = server_metadata.models.memory_budget_mb * 2**20
+        if budget <= 0:
+            return
+        resident = sum(entry.memory_bytes for entry in self._models.values())
+        for entry in list(self._models.values()):
+            if resident + incoming <= budget:
+                break
+            if entry.leases or entry.name == keep:
+                continue
+            del self._models[entry.name]
+            resident -= entry.memory_bytes
+            logger.info(f"Unloading model {entry.name}, idle for {time.monotonic() - entry.last_used:.0f}s")
+            await asyncio.get_running_loop().run_in_executor(None, entry.model.close)
+        if resident + incoming > budget:
+            logger.warning(f"Models in use take {resident / 2**20:.0f} MB, over the "
+                           f"{server_metadata.models.memory_budget_mb:.0f} MB budget")
+
+    def status(self) -> str:
+        if self.error is not None:
+            return "failed"
+        if self.is_ready:
+            return "ready"
+        return "warming_up" if self.is_loaded else "loading"
+
+model_manager = ModelManager()
@@ -1,18 +1,33 @@
 from .base import BaseModel
+from .decoding import DecodeOptions
 import whisper
-from typing import AsyncGenerator, Dict, Any, Union
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+from utils.metrics import stage, record_encoder, encoder_seconds
 import numpy as np
+import threading
+import time
+import torch
+
+_DECODER = stage("decoder")
 
 class OpenAIWhisperModel(BaseModel):
-    def __init__(self, model_id: str, device: str):
+    supports_batching = True
+
+    def __init__(self, model_id: str, device: str, cpu_threads: int = 0):
+        if cpu_threads > 0:
+            torch.set_num_threads(cpu_threads)
         self.model = whisper.load_model(model_id, device=device)
+        # Time encoder passes with hooks; the rest of a call (mel spectrogram and decoding) counts as decoder time
+        self._encoder_started = threading.local()
+        self.model.encoder.register_forward_pre_hook(self._encoder_start)
+        self.model.encoder.register_forward_hook(self._encoder_end)
 
-    async def transcribe(self, audio_file: Union[str, bytes], stream: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
-        result = self.model.transcribe(audio_file, word_timestamps=stream)
+    def transcribe_sync(self, audio_file: Union[str, np.ndarray], stream: bool = False,
+                        options: Optional[DecodeOptions] = None) -> Iterator[Dict[str, Any]]:
+        result = self._transcribe(audio_file, **self._decode_kwargs(options, word_timestamps=stream))
         segments = result["segments"]
         if stream:
-            async for word in self._stream_words(segments):
-                yield word
+            yield from self._stream_words(segments)
         else:
             yield {
                 "transcription": result["text"],
@@ -20,25 +35,98 @@ class OpenAIWhisperModel(BaseModel):
                 "segments": result["segments"]
             }
 
-    def live_transcribe(self, audio_chunk: bytes) -> Dict[str, Any]:
-        # Convert bytes to numpy array
-        audio_np = np.frombuffer(audio_chunk, dtype=np.int16).astype(np.float32) / 32768.0
-        
-        result = self.model.transcribe(audio_np, word_timestamps=True)
-        words = [{"word": word["word"], "start": word["start"], "end": word["end"]} 
-                for segment in result["segments"] for word in segment["words"]]
+    def transcribe_batch(self, audio_files: List[Union[str, np.ndarray]],
+                         options: Optional[DecodeOptions] = None) -> List[Dict[str, Any]]:
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(self._load_audio(audio_file)), n_mels=self.model.dims.n_mels)
+            for audio_file in audio_files
+        ]).to(self.model.device)
+        # One deterministic pass per clip: no temperature fallback, and no earlier text to condition on
+        decoding = {"language": options.language, "beam_size": options.beam_size if options.beam_size > 1 else None} \
+            if options is not None else {}
+        options = whisper.DecodingOptions(fp16=self.model.device.type == "cuda", without_timestamps=True, **decoding)
+        encoded = encoder_seconds()
+        start = time.perf_counter()
+        results = whisper.decode(self.model, mel, options)
+        _DECODER.observe(time.perf_counter() - start - (encoder_seconds() - encoded))
+        return [
+            {
+                "transcription": result.text,
+                "language": result.language
+            }
+            for result in results
+        ]
+
+    def live_transcribe(self, audio: np.ndarray, options: Optional[DecodeOptions] = None,
+                        prompt: Optional[str] = None, language: Optional[str] = None) -> Dict[str, Any]:
+        kwargs = self._decode_kwargs(options, word_timestamps=True)
+        language = language or kwargs.get("language")
+        probability = 1.0
+        if language is None:
+            # `transcribe` would detect the language too, but doesn't say how sure it is
+            language, probability = self._detect_language(audio)
+        result = self._transcribe(audio, **{**kwargs, "language": language, "initial_prompt": prompt})
+        words = list(self._stream_words(result["segments"]))
         
         return {
             "words": words,
-            "language": result["language"]
+            "language": result["language"],
+            "language_probability": probability
+        }
+
+    def _detect_language(self, audio: np.ndarray) -> Tuple[str, float]:
+        """The most likely language of the first 30 seconds of `audio`, and its probability."""
+        if not self.model.is_multilingual:
+            return "en", 1.0
+        mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=self.model.dims.n_mels).to(self.model.device)
+        if self.model.device.type == "cuda":
+            mel = mel.half()
+        _, probabilities = self.model.detect_language(mel)
+        language = max(probabilities, key=probabilities.get)
+        return language, probabilities[language]
+
+    def _transcribe(self, audio_file: Union[str, np.ndarray], **kwargs) -> Dict[str, Any]:
+        encoded = encoder_seconds()
+        start = time.perf_counter()
+        result = self.model.transcribe(audio_file, **kwargs)
+        _DECODER.observe(time.perf_counter() - start - (encoder_seconds() - encoded))
+        return result
+
+    def _encoder_start(self, module, inputs):
+        self._encoder_started.time = time.perf_counter()
+
+    def _encoder_end(self, module, inputs, output):
+        record_encoder(time.perf_counter() - self._encoder_started.time)
+
+    @staticmethod
+    def _decode_kwargs(options: Optional[DecodeOptions], word_timestamps: bool) -> Dict[str, Any]:
+        """`transcribe` arguments; without options, whisper's own defaults (greedy decoding) apply."""
+        if options is None:
+            return {"word_timestamps": word_timestamps}
+        kwargs = {
+            "temperature": options.temperature,
+            "language": options.language,
+            "condition_on_previous_text": options.condition_on_previous_text,
+            "word_timestamps": options.timestamps(default=word_timestamps)
         }
+        if options.beam_size > 1:
+            kwargs["beam_size"] = options.beam_size
+        return kwargs
 
     @staticmethod
-    async def _stream_words(segments) -> AsyncGenerator[Dict[str, Any], None]:
+    def _stream_words(segments) -> Iterator[Dict[str, Any]]:
         for segment in segments:
+                if "words" not in segment:
+                    # Without word alignment, each segment is passed on as a single unit
+                    yield {"word": segment["text"], "start": segment["start"], "end": segment["end"]}
+                    continue
                 for word in segment["words"]:
                     yield {
                         "word": word["word"],
                         "start": word["start"],
                         "end": word["end"]
-                    }
\ No newline at end of file
+                    }
+
+    @staticmethod
+    def _load_audio(audio_file: Union[str, np.ndarray]) -> np.ndarray:
+        return audio_file if isinstance(audio_file, np.ndarray) else whisper.load_audio(audio_file)
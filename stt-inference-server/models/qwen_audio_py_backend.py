@@ -1,7 +1,6 @@
 from .base import BaseModel
-from typing import AsyncGenerator, Dict, Any, Union
+from typing import Dict, Any, Iterator, Union
 from utils.audio_utils import get_audio_duration
-import asyncio
 import os
 from swift.llm import (
     get_model_tokenizer, get_template, inference, ModelType,
@@ -21,19 +20,18 @@ class QwenAudioBase(BaseModel):
         self.model.generation_config.max_new_tokens = 256
         self.template = get_template(self.template_type, self.tokenizer)
 
-    async def transcribe(self, audio_file: Union[str, bytes], prompt: str = None, stream: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+    def transcribe_sync(self, audio_file: Union[str, bytes], stream: bool = False, prompt: str = None) -> Iterator[Dict[str, Any]]:
         query = f"Audio 1:<audio>{audio_file}</audio>\n{prompt or 'What did this speech say'}"
         
         if stream:
-            gen = inference_stream(self.model, self.template, query)
-            async for response, _ in gen:
+            for response, _ in inference_stream(self.model, self.template, query):
                 yield {"word": response}
         else:
-            response, _ = await asyncio.to_thread(inference, self.model, self.template, query)
+            response, _ = inference(self.model, self.template, query)
             yield {"transcription": response}
 
-    async def live_transcribe(self, audio_chunk: bytes) -> Dict[str, Any]:
+    def live_transcribe(self, audio_chunk: bytes) -> Dict[str, Any]:
 
         query = f"Audio 1:<audio>{audio_chunk}</audio>\nWhat did this speech say"
-        response, _ = await asyncio.to_thread(inference, self.model, self.template, query)
+        response, _ = inference(self.model, self.template, query)
         return {"transcription": response}
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import numpy as np
+from server_metadata import server_metadata
+from utils.logger import model_logger as logger
+
+@dataclass
+class _Entry:
+    value: Any
+    size: int
+    expires_at: float
+
+class _DiskTier:
+    """SQLite table of serialized results, memory-mapped for reads; used from worker threads."""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA mmap_size=268435456")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str, ttl: float) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if ttl > 0 and time.time() - row[1] > ttl:
+                self._connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def put(self, key: str, payload: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)", (key, payload, time.time())
+            )
+
+    def prune(self, ttl: float) -> int:
+        if ttl <= 0:
+            return 0
+        with self._lock:
+            return self._connection.execute("DELETE FROM results WHERE created_at < ?", (time.time() - ttl,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class ResultCache:
+    """
+    Transcription results keyed by a hash of the decoded audio and everything else that
+    determines the output (model, backend, quantization and decode parameters).
+
+    Results are kept in memory in LRU order up to `server_metadata.cache.max_mb`, and optionally
+    in a SQLite file that survives restarts. Identical requests that miss at the same time share
+    one inference: the first one computes the result and the others wait for it.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._disk: Optional[_DiskTier] = None
+        self._executor: Optional[Executor] = None
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @property
+    def enabled(self) -> bool:
+        return server_metadata.cache.enabled
+
+    def start(self, executor: Executor):
+        self._executor = executor
+        config = server_metadata.cache
+        if config.path:
+            self._disk = _DiskTier(config.path)
+            pruned = self._disk.prune(config.ttl)
+            logger.info(f"Result cache on disk at {config.path} ({pruned} expired results pruned)")
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def key(self, audio: np.ndarray, params: Dict[str, Any]) -> str:
+        """Hash the audio and the settings that affect its transcription. Runs on a worker thread."""
+        digest = hashlib.blake2b(np.ascontiguousarray(audio, dtype=np.float32).data, digest_size=20)
+        settings = {
+            "model_id": server_metadata.model_id,
+            "backend": server_metadata.backend.value,
+            "quantization": server_metadata.quantization.value,
+            **params
+        }
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Look a result up in memory, then on disk. Counts a miss if neither has it."""
+        value = await self._lookup(key)
+        if value is None:
+            self.misses += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        payload = json.dumps(value)
+        self._put_memory(key, value, len(payload))
+        if self._disk is not None:
+            # Nobody waits on the write.
+            self._executor.submit(self._disk.put, key, payload)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Return the cached result for `key`, or compute and cache it.
+
+        The second value tells whether the result came from the cache or from another request's
+        inference rather than from `compute`. The computation runs in its own task so that
+        waiting requests still get the result if the one that started it disconnects.
+        """
+        value = await self._lookup(key)
+        if value is not None:
+            return value, True
+        if key in self._in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self._in_flight[key]), True
+
+        self.misses += 1
+        task = asyncio.ensure_future(self._compute(key, compute))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda task: self._computed(key, task))
+        return await asyncio.shield(task), False
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.coalesced + self.misses
+        return {
+            **server_metadata.cache.model_dump(),
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else 0
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    async def _lookup(self, key: str) -> Optional[Any]:
+        value = self._get_memory(key)
+        if value is None and self._disk is not None:
+            value = await self._get_disk(key)
+        return value
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = await compute()
+        self.put(key, value)
+        return value
+
+    def _computed(self, key: str, task: asyncio.Future):
+        self._in_flight.pop(key, None)
+        # Everyone waiting may have gone away; the error is theirs, not the cache's.
+        if not task.cancelled():
+            task.exception()
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    async def _get_disk(self, key: str) -> Optional[Any]:
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(self._executor, self._disk.get, key, server_metadata.cache.ttl)
+        if payload is None:
+            return None
+        self.disk_hits += 1
+        value = json.loads(payload)
+        self._put_memory(key, value, len(payload))
+        return value
+
+    def _put_memory(self, key: str, value: Any, size: int):
+        config = server_metadata.cache
+        max_bytes = config.max_mb * 2**20
+        if size > max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires_at = time.monotonic() + config.ttl if config.ttl > 0 else float("inf")
+        self._entries[key] = _Entry(value, size, expires_at)
+        self.bytes += size
+        while self.bytes > max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        self.bytes -= self._entries.pop(key).size
+
+result_cache = ResultCache()
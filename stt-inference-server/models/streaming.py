@@ -0,0 +1,187 @@
+import string
+from typing import Any, Dict, List, Optional
+import numpy as np
+from utils.audio_utils import AudioBuffer
+from .base import BaseModel, options_kwargs
+from .decoding import DecodeOptions
+
+def _normalize(word: str) -> str:
+    return word.strip().strip(string.punctuation).lower()
+
+class StreamingTranscriber:
+    """
+    Incremental transcription of a live session with a local-agreement policy.
+
+    Each decode only covers the audio after the last committed word. A word is committed once
+    two consecutive decodes agree on it and on every word before it; its audio is then trimmed
+    from the buffer, so the cost of a decode depends on the uncommitted tail rather than on how
+    long the session has been running.
+
+    The session carries context from one decode to the next: the last committed words are the
+    prompt for the pending audio, and once the language is detected confidently it is pinned,
+    so later decodes skip detection.
+    """
+
+    def __init__(self, model: BaseModel, sample_rate: int = 16000, max_uncommitted_duration: float = 10.0,
+                 silence_keep_duration: float = 1.0, options: Optional[DecodeOptions] = None,
+                 language_confidence: float = 0.8, language_recheck: float = 0.0, prompt_words: int = 50):
+        """
+        :param model: Backend used for decoding
+        :param sample_rate: Sample rate of the session audio
+        :param max_uncommitted_duration: Commit the current hypothesis once this much audio is pending
+        :param silence_keep_duration: Audio kept when a long pending tail decodes to no words
+        :param options: Decode settings, or None for the backend's defaults
+        :param language_confidence: Probability at which a detected language is pinned for the session
+        :param language_recheck: Seconds of audio after which a pinned language is detected again; 0 never does
+        :param prompt_words: Committed words passed as the prompt of each decode; 0 passes none
+        """
+        self.model = model
+        self.options = options
+        self.buffer = AudioBuffer(sample_rate=sample_rate)
+        self.max_uncommitted_duration = max_uncommitted_duration
+        self.silence_keep_duration = silence_keep_duration
+        self.language_confidence = language_confidence
+        self.language_recheck = language_recheck
+        self.prompt_words = prompt_words if options is None or options.condition_on_previous_text else 0
+        self.committed: List[Dict[str, Any]] = []
+        self.hypothesis: List[Dict[str, Any]] = []
+        self.language = options.language if options else None
+        # Language passed to the backend instead of detecting it, and the session time it was detected at
+        self.pinned_language = self.language
+        self.pinned_at = 0.0
+
+    @property
+    def committed_end(self) -> float:
+        return self.committed[-1]["end"] if self.committed else 0.0
+
+    @property
+    def transcript(self) -> str:
+        return "".join(word["word"] for word in self.committed).strip()
+
+    @property
+    def prompt(self) -> Optional[str]:
+        """The last `prompt_words` committed words, which precede the pending audio."""
+        words: List[str] = []
+        for word in reversed(self.committed):
+            if len(words) >= self.prompt_words:
+                break
+            words.extend(reversed(word["word"].split()))
+        return " ".join(reversed(words[:self.prompt_words])) or None
+
+    def add_audio(self, audio: np.ndarray):
+        self.buffer.add_audio(audio)
+
+    def process(self) -> Dict[str, Any]:
+        """
+        Decode the uncommitted audio and commit the words this decode agrees on.
+
+        Runs on a worker thread. Returns the newly committed words and the tentative tail.
+        """
+        words = self._decode()
+        agreed = 0
+        for previous, current in zip(self.hypothesis, words):
+            if _normalize(previous["word"]) != _normalize(current["word"]):
+                break
+            agreed += 1
+
+        committed, self.hypothesis = words[:agreed], words[agreed:]
+        if self.buffer.duration >= self.max_uncommitted_duration:
+            # No agreement for too long: take the current hypothesis as is rather than let the
+            # pending audio (and the decode cost) keep growing.
+            committed, self.hypothesis = words, []
+        self._commit(committed)
+        return {"committed": committed, "words": self.hypothesis, "language": self.language}
+
+    def finish(self) -> Dict[str, Any]:
+        """Decode and commit everything still pending, e.g. at the end of the stream."""
+        committed = self._decode() if self.buffer.length else []
+        self.hypothesis = []
+        self._commit(committed)
+        self.buffer.trim(self.buffer.end_time)
+        return {"committed": committed, "words": [], "language": self.language}
+
+    def skip(self) -> Dict[str, Any]:
+        """
+        Drop the pending audio without decoding it, for when decoding has fallen too far behind.
+        The current hypothesis is committed as it stands rather than lost with it.
+        """
+        committed, self.hypothesis = self.hypothesis, []
+        self.committed.extend(committed)
+        self.buffer.trim(self.buffer.end_time)
+        return {"committed": committed, "words": [], "language": self.language}
+
+    def close(self):
+        """Return the session's audio buffer to the pool once it has ended."""
+        self.buffer.close()
+
+    def discard(self, keep: float = 0.0):
+        """Drop pending audio that is known not to contain speech, keeping the last `keep` seconds."""
+        self.buffer.trim(self.buffer.end_time - keep)
+
+    def _decode(self, model: Optional[BaseModel] = None) -> List[Dict[str, Any]]:
+        kwargs = options_kwargs(self.options)
+        prompt = self.prompt
+        if prompt:
+            kwargs["prompt"] = prompt
+        pinned = self._pinned_language()
+        if pinned:
+            kwargs["language"] = pinned
+        result = (model or self.model).live_transcribe(self.buffer.audio, **kwargs)
+        self.language = result.get("language", self.language)
+        if not pinned:
+            self._pin_language(result)
+        offset = self.buffer.offset
+        words = []
+        for word in result["words"]:
+            start, end = round(word["start"] + offset, 3), round(word["end"] + offset, 3)
+            # Words that end inside already committed audio are leftovers of the last commit.
+            if end <= self.committed_end:
+                continue
+            words.append({"word": word["word"], "start": start, "end": end})
+        return words
+
+    def _pinned_language(self) -> Optional[str]:
+        if self.pinned_language is None or (self.options and self.options.language):
+            return self.pinned_language
+        if self.language_recheck and self.buffer.end_time - self.pinned_at >= self.language_recheck:
+            return None
+        return self.pinned_language
+
+    def _pin_language(self, result: Dict[str, Any]):
+        """Pin the language a decode detected if it is sure enough of it."""
+        probability = result.get("language_probability")
+        if result.get("language") and probability is not None and probability >= self.language_confidence:
+            self.pinned_language = result["language"]
+            self.pinned_at = self.buffer.end_time
+
+    def _commit(self, words: List[Dict[str, Any]]):
+        if words:
+            self.committed.extend(words)
+            self.buffer.trim(self.committed_end)
+        elif not self.hypothesis and self.buffer.duration >= self.max_uncommitted_duration:
+            self.buffer.trim(self.buffer.end_time - self.silence_keep_duration)
+
+class CascadeTranscriber(StreamingTranscriber):
+    """
+    Live transcription with two models. The draft model decodes the pending utterance on every
+    chunk for low-latency partial results; `model` decodes it once, when it is finished, and
+    its words are committed in place of the partials.
+
+    Utterances end with `finish`, called on VAD endpointing or a client flush, or once
+    `max_uncommitted_duration` seconds are pending.
+    """
+
+    def __init__(self, draft_model: BaseModel, model: BaseModel, **kwargs):
+        """
+        :param draft_model: Fast backend producing the partial results
+        :param model: Accurate backend producing the committed words
+        """
+        super().__init__(model, **kwargs)
+        self.draft_model = draft_model
+
+    def process(self) -> Dict[str, Any]:
+        if self.buffer.duration >= self.max_uncommitted_duration:
+            # A long stretch without a pause: finalize it rather than let the draft decodes grow
+            return self.finish()
+        self.hypothesis = self._decode(self.draft_model)
+        return {"committed": [], "words": self.hypothesis, "language": self.language}
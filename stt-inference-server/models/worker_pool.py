@@ -0,0 +1,424 @@
+import contextlib
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from dataclasses import dataclass, field
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+from utils.logger import model_logger as logger, forward_to, receive_from
+from utils.audio_utils import SAMPLE_RATE
+from utils.metrics import resident_bytes
+from .base import BaseModel, options_kwargs
+from .decoding import DecodeOptions
+
+_ITEM, _DONE, _ERROR, _READY = range(4)
+
+class SharedAudioRing:
+    """Fixed-size float32 audio slots in one shared-memory segment."""
+
+    def __init__(self, slots: int, slot_samples: int, name: Optional[str] = None):
+        self.slots = slots
+        self.slot_samples = slot_samples
+        self.owner = name is None
+        self.shm = SharedMemory(name=name, create=self.owner, size=slots * slot_samples * 4)
+        self.array = np.ndarray((slots, slot_samples), dtype=np.float32, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# A region locates one request's audio in shared memory: ("slot", slot index, samples)
+# in the worker's ring, or ("segment", segment name, samples) for audio too large for a slot.
+Region = Tuple[str, Union[int, str], int]
+
+def _wait_for_credit(credits, cancelled, request_id: int) -> bool:
+    """Wait until the server has taken another streamed result off the pipe, or the request is cancelled."""
+    while not credits.acquire(timeout=0.1):
+        if cancelled.value == request_id:
+            return False
+    return True
+
+@contextlib.contextmanager
+def _without_main_module():
+    """
+    Keep processes spawned meanwhile from importing the server's __main__ module (main.py), as
+    they would by default, with everything it sets up on import. Workers only need the modules
+    of what they are given to run.
+    """
+    main = sys.modules["__main__"]
+    spec, path = getattr(main, "__spec__", None), main.__dict__.pop("__file__", None)
+    main.__spec__ = None
+    try:
+        yield
+    finally:
+        main.__spec__ = spec
+        if path is not None:
+            main.__file__ = path
+
+def _worker_main(index: int, model_factory: Callable[..., BaseModel], threads: int, ring_name: str,
+                 slots: int, slot_samples: int, requests, responses, cancelled, credits, window: int, log_queue):
+    # The server process writes the log files
+    forward_to(log_queue)
+    # Pin intra-op parallelism before the inference libraries read these.
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    try:
+        model = model_factory(cpu_threads=threads)
+        ring = SharedAudioRing(slots, slot_samples, name=ring_name)
+    except Exception as e:
+        responses.put((None, _ERROR, f"Worker {index} failed to start: {type(e).__name__}: {e}"))
+        return
+    responses.put((None, _READY, (index, model.supports_batching)))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, method, regions, kwargs = request
+        segments = []
+        try:
+            audios = []
+            for kind, location, samples in regions:
+                if kind == "slot":
+                    audios.append(ring.array[location, :samples])
+                else:
+                    segment = SharedMemory(name=location)
+                    segments.append(segment)
+                    audios.append(np.ndarray((samples,), dtype=np.float32, buffer=segment.buf))
+
+            if method == "transcribe":
+                # Credits the server returned for a previous stream after it finished
+                while credits.acquire(block=False):
+                    pass
+                items = model.transcribe_sync(audios[0], **kwargs)
+                try:
+                    # At most `window` results are ahead of the consumer; each one it takes frees another
+                    for sent, item in enumerate(items):
+                        if cancelled.value == request_id:
+                            break
+                        if sent >= window and not _wait_for_credit(credits, cancelled, request_id):
+                            break
+                        responses.put((request_id, _ITEM, item))
+                finally:
+                    items.close()
+                result = None
+            elif method == "live_transcribe":
+                result = model.live_transcribe(audios[0], **kwargs)
+            elif method == "warm_up":
+                model.warm_up(audios[0])
+                result = None
+            else:
+                result = model.transcribe_batch(audios, **kwargs)
+            responses.put((request_id, _DONE, result))
+        except Exception as e:
+            responses.put((request_id, _ERROR, f"{type(e).__name__}: {e}"))
+        finally:
+            audios = None
+            for segment in segments:
+                try:
+                    segment.close()
+                except BufferError:
+                    # Still referenced by the backend; the mapping goes away with it.
+                    pass
+    ring.close()
+
+@dataclass
+class _Worker:
+    index: int
+    process: Any
+    requests: Any
+    cancelled: Any
+    credits: Any
+    ring: SharedAudioRing
+    free_slots: List[int]
+    outstanding: float = 0.0
+    in_flight: int = 0
+    # Whether its model has loaded; a worker that exits before then isn't restarted
+    ready: bool = False
+    exited: bool = False
+
+@dataclass
+class _Request:
+    worker: _Worker
+    seconds: float
+    handler: queue.Queue = field(default_factory=queue.Queue)
+    slots: List[int] = field(default_factory=list)
+    segments: List[SharedMemory] = field(default_factory=list)
+
+class WorkerPoolModel(BaseModel):
+    """
+    Backend that runs inference in `workers` processes, each with its own model instance and
+    `threads_per_worker` intra-op threads.
+
+    Audio is copied once into shared memory (a ring of fixed-size slots per worker, or a
+    dedicated segment for long audio) rather than pickled, and each request goes to the worker
+    with the least outstanding audio. Only results travel back through a pipe, along with the
+    workers' log records, which the server process writes.
+
+    Streamed results are flow-controlled: a worker runs at most `result_queue_size` results
+    ahead of the consumer. A worker that exits fails the requests it had, and is replaced by a
+    new one, whether or not it was busy.
+    """
+
+    def __init__(self, model_factory: Callable[..., BaseModel], workers: int, threads_per_worker: int,
+                 slots_per_worker: int = 4, slot_seconds: float = 60.0):
+        """
+        :param model_factory: Picklable callable creating the backend, given `cpu_threads`
+        :param workers: Number of worker processes
+        :param threads_per_worker: Intra-op threads of each worker's model
+        :param slots_per_worker: Shared-memory slots per worker
+        :param slot_seconds: Longest audio that fits in a slot
+        """
+        self._context = multiprocessing.get_context("spawn")
+        self._model_factory = model_factory
+        self.threads_per_worker = threads_per_worker
+        self.slots_per_worker = slots_per_worker
+        self.slot_samples = int(slot_seconds * SAMPLE_RATE)
+        self._responses = self._context.Queue()
+        self._log_queue = self._context.Queue()
+        self._log_listener = receive_from(self._log_queue)
+        self._requests: Dict[int, _Request] = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._workers = [self._start_worker(index) for index in range(workers)]
+        # Workers that exited, whose shared memory is freed on close
+        self._exited: List[_Worker] = []
+        self._closing = False
+
+        try:
+            self._wait_until_ready()
+        except Exception:
+            self.close()
+            raise
+        self._reader = threading.Thread(target=self._read_responses, name="inference-worker-results", daemon=True)
+        self._reader.start()
+        logger.info(f"Started {workers} inference workers with {threads_per_worker} threads each")
+
+    def transcribe_sync(self, audio_file: np.ndarray, stream: bool = False,
+                        options: Optional[DecodeOptions] = None) -> Iterator[Dict[str, Any]]:
+        request_id, request = self._submit("transcribe", [audio_file], {"stream": stream, **options_kwargs(options)})
+        finished = False
+        try:
+            for kind, payload in self._results(request):
+                if kind == _ITEM:
+                    yield payload
+            finished = True
+        finally:
+            if not finished:
+                # The consumer went away: stop the worker at its next result.
+                request.worker.cancelled.value = request_id
+
+    def live_transcribe(self, audio: np.ndarray, options: Optional[DecodeOptions] = None,
+                        prompt: Optional[str] = None, language: Optional[str] = None) -> Dict[str, Any]:
+        context = {name: value for name, value in (("prompt", prompt), ("language", language)) if value is not None}
+        _, request = self._submit("live_transcribe", [audio], {**options_kwargs(options), **context})
+        return self._final_result(request)
+
+    def transcribe_batch(self, audio_files: List[np.ndarray], options: Optional[DecodeOptions] = None) -> List[Dict[str, Any]]:
+        _, request = self._submit("transcribe_batch", audio_files, options_kwargs(options))
+        return self._final_result(request)
+
+    def warm_up(self, audio: np.ndarray):
+        # Each worker has its own model to warm up; they do it at the same time
+        requests = [self._submit("warm_up", [audio], {}, worker=worker)[1] for worker in self._workers]
+        for request in requests:
+            self._final_result(request)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "worker": worker.index,
+                    "pid": worker.process.pid,
+                    "alive": worker.process.is_alive(),
+                    "in_flight": worker.in_flight,
+                    "outstanding_audio_seconds": worker.outstanding
+                }
+                for worker in self._workers
+            ]
+
+    def memory_bytes(self) -> Optional[int]:
+        # Each worker holds its own copy of the model
+        return sum(resident_bytes(worker.process.pid) or 0 for worker in self._workers)
+
+    def close(self):
+        self._closing = True
+        for worker in self._workers:
+            if worker.process.is_alive():
+                worker.requests.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self._workers + self._exited:
+            worker.ring.close()
+        self._responses.put(None)
+        self._log_listener.stop()
+
+    def _start_worker(self, index: int) -> _Worker:
+        ring = SharedAudioRing(self.slots_per_worker, self.slot_samples)
+        requests = self._context.Queue()
+        cancelled = self._context.Value("q", -1, lock=False)
+        credits = self._context.Semaphore(0)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._model_factory, self.threads_per_worker, ring.name, self.slots_per_worker,
+                  self.slot_samples, requests, self._responses, cancelled, credits, self.result_queue_size,
+                  self._log_queue),
+            name=f"inference-worker-{index}",
+            daemon=True
+        )
+        with _without_main_module():
+            process.start()
+        return _Worker(index, process, requests, cancelled, credits, ring, list(range(self.slots_per_worker)))
+
+    def _reap_workers(self):
+        """Handle workers that exited without a request waiting on them to notice."""
+        with self._lock:
+            dead = [worker for worker in self._workers if not worker.exited and not worker.process.is_alive()]
+        for worker in dead:
+            self._worker_exited(worker)
+
+    def _worker_exited(self, worker: _Worker):
+        """Fail and release the requests of a worker that exited, and start another in its place."""
+        with self._lock:
+            if worker.exited:
+                # Already handled for another of its requests
+                return
+            worker.exited = True
+            lost = [request_id for request_id, request in self._requests.items() if request.worker is worker]
+            handlers = [self._requests[request_id].handler for request_id in lost]
+            restart = worker.ready and not self._closing
+            if restart:
+                self._workers[worker.index] = self._start_worker(worker.index)
+                self._exited.append(worker)
+        logger.error(f"Inference worker {worker.index} exited with code {worker.process.exitcode}, "
+                     f"failing {len(lost)} requests{'; restarting it' if restart else ''}")
+        for request_id, handler in zip(lost, handlers):
+            self._release(request_id)
+            handler.put((_ERROR, f"Inference worker {worker.index} exited"))
+
+    def _wait_until_ready(self):
+        ready = 0
+        while ready < len(self._workers):
+            try:
+                _, kind, payload = self._responses.get(timeout=1.0)
+            except queue.Empty:
+                dead = [worker.index for worker in self._workers if not worker.process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Inference workers {dead} exited during startup")
+                continue
+            if kind == _ERROR:
+                raise RuntimeError(payload)
+            index, self.supports_batching = payload
+            self._workers[index].ready = True
+            ready += 1
+
+    def _submit(self, method: str, audios: List[np.ndarray], kwargs: Dict[str, Any],
+                worker: Optional[_Worker] = None) -> Tuple[int, _Request]:
+        seconds = sum(len(audio) for audio in audios) / SAMPLE_RATE
+        self._reap_workers()
+        with self._lock:
+            if worker is None:
+                alive = [candidate for candidate in self._workers if candidate.process.is_alive()]
+                if not alive:
+                    raise RuntimeError("No inference workers are running")
+                worker = min(alive, key=lambda candidate: candidate.outstanding)
+            worker.outstanding += seconds
+            worker.in_flight += 1
+            request_id = next(self._request_ids)
+            request = _Request(worker, seconds)
+            self._requests[request_id] = request
+            for audio in audios:
+                if len(audio) <= self.slot_samples and worker.free_slots:
+                    request.slots.append(worker.free_slots.pop())
+
+        try:
+            regions = []
+            slots = iter(request.slots)
+            for audio in audios:
+                slot = next(slots, None) if len(audio) <= self.slot_samples else None
+                if slot is not None:
+                    worker.ring.array[slot, :len(audio)] = audio
+                    regions.append(("slot", slot, len(audio)))
+                else:
+                    segment = SharedMemory(create=True, size=max(audio.nbytes, 4))
+                    request.segments.append(segment)
+                    np.ndarray((len(audio),), dtype=np.float32, buffer=segment.buf)[:] = audio
+                    regions.append(("segment", segment.name, len(audio)))
+            worker.requests.put((request_id, method, regions, kwargs))
+        except Exception:
+            self._release(request_id)
+            raise
+        return request_id, request
+
+    def _results(self, request: _Request) -> Iterator[Tuple[int, Any]]:
+        while True:
+            try:
+                kind, payload = request.handler.get(timeout=1.0)
+            except queue.Empty:
+                if not request.worker.process.is_alive():
+                    # Fails this request along with the worker's others
+                    self._worker_exited(request.worker)
+                continue
+            if kind == _ERROR:
+                raise RuntimeError(payload)
+            if kind == _ITEM:
+                request.worker.credits.release()
+            yield kind, payload
+            if kind == _DONE:
+                return
+
+    def _final_result(self, request: _Request) -> Any:
+        for kind, payload in self._results(request):
+            if kind == _DONE:
+                return payload
+
+    def _read_responses(self):
+        while True:
+            try:
+                message = self._responses.get(timeout=1.0)
+            except queue.Empty:
+                if not self._closing:
+                    self._reap_workers()
+                continue
+            if message is None:
+                return
+            request_id, kind, payload = message
+            if request_id is None:
+                # A restarted worker reporting on its startup
+                if kind == _READY:
+                    with self._lock:
+                        self._workers[payload[0]].ready = True
+                else:
+                    logger.error(payload)
+                continue
+            request = self._requests.get(request_id)
+            if request is None:
+                continue
+            if kind in (_DONE, _ERROR):
+                # The worker is done with the request's shared memory.
+                self._release(request_id)
+            request.handler.put((kind, payload))
+
+    def _release(self, request_id: int):
+        with self._lock:
+            request = self._requests.pop(request_id, None)
+            if request is None:
+                return
+            request.worker.outstanding -= request.seconds
+            request.worker.in_flight -= 1
+            request.worker.free_slots.extend(request.slots)
+        for segment in request.segments:
+            segment.close()
+            segment.unlink()
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel, ConfigDict
+from models.model_manager import model_manager, SwapInProgress
+from server_metadata import server_metadata, Quantization
+from utils.logger import main_logger as logger
+from typing import Optional
+import secrets
+
+router = APIRouter()
+
+class ModelSwap(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_id: str
+    # Unset keeps the server's quantization
+    quantization: Optional[Quantization] = None
+
+def authorize(authorization: Optional[str]):
+    token = server_metadata.admin.token
+    if token is None:
+        return
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(credentials.encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+@router.post("/admin/model")
+async def swap_model(swap: ModelSwap, authorization: Optional[str] = Header(None)):
+    authorize(authorization)
+    if not model_manager.is_loaded:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    try:
+        # Requests keep being served by the current model until the new one is warmed up
+        await model_manager.swap(swap.model_id, swap.quantization)
+    except SwapInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error swapping the model for {swap.model_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"model_id": server_metadata.model_id, "resident_models": model_manager.stats()}
@@ -0,0 +1,76 @@
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse
+from models.job_queue import job_queue, JobFile
+from server_metadata import server_metadata
+from utils.logger import main_logger as logger
+from typing import List
+import glob
+import json
+import os
+
+router = APIRouter()
+
+def resolve_paths(patterns: List[str]) -> List[str]:
+    """Expand server-local paths and globs, which must stay inside the configured input directory."""
+    input_dir = server_metadata.jobs.input_dir
+    if not input_dir:
+        raise HTTPException(status_code=400, detail="Server-local paths are disabled; start the server with --jobs_input_dir")
+    root = os.path.realpath(input_dir)
+    paths = []
+    for pattern in patterns:
+        matches = sorted(
+            path for path in glob.glob(os.path.join(root, pattern), recursive=True) if os.path.isfile(path)
+        )
+        if not matches:
+            raise HTTPException(status_code=400, detail=f"No files match {pattern!r}")
+        for path in matches:
+            path = os.path.realpath(path)
+            if os.path.commonpath([root, path]) != root:
+                raise HTTPException(status_code=400, detail=f"{pattern!r} is outside the input directory")
+            paths.append(path)
+    return paths
+
+@router.post("/v1/jobs", status_code=202)
+async def create_job(
+    files: List[UploadFile] = File(default=[]),
+    paths: List[str] = Form(default=[])
+):
+    if job_queue.store is None:
+        raise HTTPException(status_code=503, detail="Job queue not running")
+    job_files = [JobFile(name=file.filename or f"file-{index}", content=await file.read())
+                 for index, file in enumerate(files)]
+    job_files += [JobFile(name=os.path.relpath(path, os.path.realpath(server_metadata.jobs.input_dir)), path=path)
+                  for path in resolve_paths(paths)] if paths else []
+    if not job_files:
+        raise HTTPException(status_code=400, detail="A job needs at least one file or path")
+
+    job_id = await job_queue.submit(job_files)
+    logger.info(f"Job {job_id} queued with {len(job_files)} files")
+    return JSONResponse({"id": job_id, "status": "queued", "files": len(job_files)}, status_code=202)
+
+@router.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    if job_queue.store is None:
+        raise HTTPException(status_code=503, detail="Job queue not running")
+    status = await job_queue.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return status
+
+@router.get("/v1/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    if job_queue.store is None:
+        raise HTTPException(status_code=503, detail="Job queue not running")
+    if await job_queue.status(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def generate_results():
+        try:
+            async for result in job_queue.results(job_id):
+                yield f"data: {json.dumps(result)}\n\n"
+            yield f"data: {json.dumps(await job_queue.status(job_id))}\n\n"
+        except Exception as e:
+            logger.error(f"Error in job results stream: {str(e)}")
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+    return StreamingResponse(generate_results(), media_type="text/event-stream")
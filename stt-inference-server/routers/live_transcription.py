@@ -1,59 +1,328 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from models.model_manager import model_manager
+from starlette.websockets import WebSocketState
+from models.model_manager import model_manager, ModelLease, UnknownModel
+from models.admission import admission, Overloaded
+from models.streaming import CascadeTranscriber, StreamingTranscriber
+from models.decoding import decode_options
 from server_metadata import server_metadata
 from utils.logger import main_logger as logger, transcription_logger
-from utils.audio_utils import get_audio_duration, audio_processor, AudioBuffer
+from utils.vad import EnergyVAD, SpeechGate, GateDecision
+from utils.audio_utils import AudioFormat, AudioFrontend, SAMPLE_RATE
+from utils.priority_executor import Priority, scheduling
+from utils.metrics import metrics
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional
+import numpy as np
 import time
+import json
+import asyncio
 
 
 router = APIRouter()
 
+# From receiving the oldest chunk a decode covers to sending its partial result
+chunk_latency = metrics.histogram("stt_live_chunk_latency_seconds", "Time from receiving a live chunk to sending its result")
+dropped_audio = metrics.counter("stt_live_dropped_audio_seconds_total", "Seconds of live audio skipped because decoding lagged")
+# Open sessions by id, for their stats
+sessions: Dict[int, "LiveSession"] = {}
+
+@dataclass
+class _Chunk:
+    # None for a client flush
+    audio: Optional[np.ndarray]
+    decision: GateDecision
+    received_at: float
+
+class LiveSession:
+    """
+    The decoding side of a live transcription session.
+
+    Chunks are queued as they are received, and each decode covers all the chunks queued since
+    the previous one, so a decode slower than real time delays the captions by one decode rather
+    than by every chunk that arrived meanwhile. The client is sent a `lag` message when decodes
+    start late. When they start more than `max_lag` seconds late, the late audio is skipped so
+    the captions catch up; the words last sent as partial results are committed instead of
+    being decoded again.
+    """
+
+    def __init__(self, websocket: WebSocket, transcriber: StreamingTranscriber, lease: ModelLease,
+                 draft_lease: Optional[ModelLease] = None):
+        self.websocket = websocket
+        self.transcriber = transcriber
+        self.lease = lease
+        self.draft_lease = draft_lease
+        self.chunks: Deque[_Chunk] = deque()
+        self.queued = asyncio.Event()
+        self.closed = False
+        self.send_lock = asyncio.Lock()
+        self.opened_at = time.monotonic()
+        self.received = 0
+        self.decodes = 0
+        self.pending_audio = 0.0
+        self.dropped_audio = 0.0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        sessions[id(self)] = self
+
+    def add(self, audio: Optional[np.ndarray], decision: GateDecision, received_at: float):
+        self.chunks.append(_Chunk(audio, decision, received_at))
+        self.received += 1
+        if audio is not None:
+            self.pending_audio += len(audio) / SAMPLE_RATE
+        self.queued.set()
+
+    def close(self):
+        self.closed = True
+        self.queued.set()
+        sessions.pop(id(self), None)
+
+    async def send(self, message: Dict[str, Any]):
+        async with self.send_lock:
+            await self.websocket.send_json(message)
+
+    async def send_error(self, error: Exception) -> bool:
+        """Report `error` to the client; False if the socket is already closed."""
+        try:
+            await self.send({"error": str(error)})
+            return True
+        except Exception:
+            return False
+
+    async def run(self):
+        while True:
+            await self.queued.wait()
+            self.queued.clear()
+            if self.closed:
+                return
+            chunks, self.chunks = list(self.chunks), deque()
+            self.pending_audio = 0.0
+            try:
+                await self._decode_chunks(chunks)
+            except WebSocketDisconnect:
+                return
+            except Exception as e:
+                logger.error(f"Error in live transcription: {str(e)}")
+                if not await self.send_error(e):
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.lease.model_id,
+            "draft_model": self.draft_lease.model_id if self.draft_lease is not None else None,
+            "duration": time.monotonic() - self.opened_at,
+            "chunks": self.received,
+            "decodes": self.decodes,
+            "pending_audio": self.pending_audio,
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "dropped_audio": self.dropped_audio
+        }
+
+    async def _decode_chunks(self, chunks: List[_Chunk]):
+        config = server_metadata.live
+        lag = time.monotonic() - chunks[0].received_at
+        late: List[_Chunk] = []
+        if config.max_lag and lag > config.max_lag:
+            # Too far behind to catch up: skip what is pending apart from the last max_lag seconds received
+            late = [chunk for chunk in chunks if time.monotonic() - chunk.received_at > config.max_lag]
+            chunks = chunks[len(late):]
+        dropped = sum(len(chunk.audio) / SAMPLE_RATE for chunk in late if chunk.audio is not None)
+        if late or (config.lag_warning and lag > config.lag_warning):
+            await self.send({"type": "lag", "lag": lag, "pending_audio": sum(
+                len(chunk.audio) / SAMPLE_RATE for chunk in chunks if chunk.audio is not None
+            ), "dropped_audio": dropped})
+        if late:
+            await self._skip(late, dropped)
+
+        # Everything pending is decoded once; an utterance that ended is finished on its own
+        since, process = None, False
+        for chunk in chunks:
+            since = since or chunk.received_at
+            if chunk.audio is not None:
+                self.transcriber.add_audio(chunk.audio)
+            if chunk.decision == GateDecision.SILENCE:
+                self.transcriber.discard(keep=server_metadata.vad.preroll)
+                since, process = None, False
+            elif chunk.decision == GateDecision.FINISH:
+                await self._decode(self.transcriber.finish, since)
+                since, process = None, False
+            elif chunk.decision == GateDecision.PROCESS:
+                process = True
+        if process:
+            await self._decode(self.transcriber.process, since)
+        elif chunks and chunks[-1].decision == GateDecision.SILENCE:
+            await self.send({"vad": "silence"})
+
+    async def _skip(self, late: List[_Chunk], dropped: float):
+        # The audio is added before it's dropped, so session times stay right
+        for chunk in late:
+            if chunk.audio is not None:
+                self.transcriber.add_audio(chunk.audio)
+        result = self.transcriber.skip()
+        self.dropped_audio += dropped
+        dropped_audio.inc(dropped)
+        # A flush among the late chunks still gets its result, as does the hypothesis just committed
+        if result["committed"] or any(chunk.decision == GateDecision.FINISH for chunk in late):
+            await self._send_result(result, 0.0, 0.0)
+
+    async def _decode(self, process: Callable[[], Dict[str, Any]], since: float):
+        """Run `process` on the transcriber and send its results; `since` is when the oldest chunk it covers arrived."""
+        start_time = time.time()
+        audio_duration = self.transcriber.buffer.duration
+        loop = asyncio.get_running_loop()
+        # Live decodes go ahead of uploads, most urgent chunk first
+        with scheduling(Priority.REALTIME, deadline=since + server_metadata.vad.max_latency):
+            result = await loop.run_in_executor(self.websocket.app.state.thread_pool, process)
+        end_time = time.time()
+        self.decodes += 1
+
+        inference_time = end_time - start_time
+        decoded_by = self.draft_lease if self.draft_lease is not None and not result["committed"] else self.lease
+        server_metadata.update_stats(audio_duration, inference_time, decoded_by.model_id)
+        await self._send_result(result, inference_time, audio_duration)
+        self.lag = time.monotonic() - since
+        self.max_lag = max(self.max_lag, self.lag)
+        chunk_latency.observe(self.lag)
+
+    async def _send_result(self, result: Dict[str, Any], inference_time: float, audio_duration: float):
+        if result["committed"]:
+            await self.send({
+                "type": "final",
+                "words": result["committed"],
+                "text": "".join(word["word"] for word in result["committed"]).strip(),
+                "language": result["language"]
+            })
+        response = {
+            "type": "partial",
+            "words": result["words"],
+            "text": "".join(word["word"] for word in result["words"]).strip(),
+            "language": result["language"],
+            "inference_time": inference_time,
+            "audio_duration": audio_duration
+        }
+        transcription_logger.info(response)
+        await self.send(response)
+
+def session_stats() -> List[Dict[str, Any]]:
+    return [session.stats() for session in list(sessions.values())]
+
 @router.websocket("/v1/live_transcription")
-async def live_transcription(websocket: WebSocket):
+async def live_transcription(websocket: WebSocket, sample_rate: int = 16000, channels: int = 1,
+                             encoding: str = "pcm_s16le", model: Optional[str] = None,
+                             draft_model: Optional[str] = None, profile: Optional[str] = None,
+                             beam_size: Optional[int] = None, temperature: Optional[str] = None,
+                             word_timestamps: Optional[bool] = None, language: Optional[str] = None,
+                             condition_on_previous_text: Optional[bool] = None):
+    session_opened = False
+    lease = None
+    draft_lease = None
     try:
         await websocket.accept()
         logger.info("WebSocket connection accepted")
-        audio_buffer = AudioBuffer()
-        
+
+        try:
+            frontend = AudioFrontend(AudioFormat(sample_rate=sample_rate, channels=channels, encoding=encoding))
+        except ValueError as e:
+            logger.error(f"Invalid audio format: {str(e)}")
+            await websocket.close(code=1003, reason=str(e))
+            return
+        try:
+            options = decode_options(profile, beam_size=beam_size, temperature=temperature,
+                                     word_timestamps=word_timestamps, language=language,
+                                     condition_on_previous_text=condition_on_previous_text)
+        except ValueError as e:
+            await websocket.close(code=1003, reason=str(e))
+            return
+
         if not model_manager.is_loaded:
             logger.error("Model not loaded")
             await websocket.close(code=1011, reason="Model not loaded")
             return
-        
-        model = model_manager.get_model()
-        while True:
+        draft_model = draft_model or server_metadata.models.live_draft
+        try:
+            for name in (model, draft_model):
+                if name is not None:
+                    model_manager.spec(name)
+        except UnknownModel as e:
+            await websocket.close(code=1008, reason=str(e))
+            return
+
+        try:
+            admission.open_session()
+        except Overloaded as e:
+            await websocket.close(code=1013, reason=e.detail)
+            return
+        session_opened = True
+
+        # The session keeps its models loaded until it ends
+        try:
+            lease = await model_manager.acquire(model)
+            if draft_model is not None:
+                draft_lease = await model_manager.acquire(draft_model)
+        except Exception as e:
+            logger.error(f"Error loading model {draft_model if lease else model}: {str(e)}")
+            await websocket.close(code=1011, reason="Model could not be loaded")
+            return
+        live_config = server_metadata.live
+        context = {
+            "options": options,
+            "language_confidence": live_config.language_confidence,
+            "language_recheck": live_config.language_recheck,
+            "prompt_words": live_config.prompt_words
+        }
+        if draft_lease is not None:
+            # The draft model answers every chunk; the session's model only decodes finished utterances
+            transcriber = CascadeTranscriber(draft_lease.model, lease.model, **context)
+        else:
+            transcriber = StreamingTranscriber(lease.model, **context)
+        vad_config = server_metadata.vad
+        gate = SpeechGate(EnergyVAD(), max_latency=vad_config.max_latency, hangover=vad_config.hangover) \
+            if vad_config.enabled else None
+        # Receiving and decoding run side by side: chunks that arrive during a decode are
+        # queued for the next one instead of backing up in the socket
+        session = LiveSession(websocket, transcriber, lease, draft_lease)
+        decoding = asyncio.create_task(session.run())
+        try:
+            while True:
+                try:
+                    message = await websocket.receive()
+                    received_at = time.monotonic()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", 1000))
+
+                    if message.get("bytes"):
+                        # Queue the chunk for the next decode, with what the VAD says it needs
+                        audio = frontend.process(message["bytes"])
+                        decision = gate.update(audio) if gate else GateDecision.PROCESS
+                        server_metadata.update_vad_stats(skipped=decision in (GateDecision.SILENCE, GateDecision.WAIT))
+                        session.add(audio, decision, received_at)
+                    elif message.get("text") and json.loads(message["text"]).get("event") == "flush":
+                        # The client finished an utterance (or the stream): commit everything pending
+                        session.add(None, GateDecision.FINISH, received_at)
+                except WebSocketDisconnect:
+                    logger.info("WebSocket disconnected")
+                    break
+                except Exception as e:
+                    logger.error(f"Error in live transcription: {str(e)}")
+                    if not await session.send_error(e):
+                        break
+        finally:
+            # Let a decode in progress finish before the session's models and buffer are released
+            session.close()
             try:
-                audio_chunk = await websocket.receive_bytes()
-                start_time = time.time()
-                
-                # Add the new chunk to the buffer and get the entire buffer
-                buffer_data = audio_buffer.add_audio(audio_chunk)
-                
-                # Process the audio buffer
-                processed_audio = audio_processor(buffer_data.tobytes(), is_file=False, sample_rate=16000)
-                
-                # Transcribe the processed audio
-                result = model.live_transcribe(processed_audio)
-                end_time = time.time()
-
-                inference_time = end_time - start_time
-                audio_duration = get_audio_duration(processed_audio)
-                server_metadata.update_stats(audio_duration, inference_time)
-                response = {
-                    **result,
-                    "inference_time": inference_time,
-                    "audio_duration": audio_duration
-                }
-                transcription_logger.info(response)
-                await websocket.send_json(response)
-            except WebSocketDisconnect:
-                logger.info("WebSocket disconnected")
-                break
-            except Exception as e:
-                logger.error(f"Error in live transcription: {str(e)}")
-                await websocket.send_json({"error": str(e)})
+                await decoding
+            finally:
+                transcriber.close()
     except Exception as e:
         logger.error(f"Unexpected error in live transcription: {str(e)}")
     finally:
-        await websocket.close()
-        logger.info("WebSocket connection closed")
\ No newline at end of file
+        for held in (lease, draft_lease):
+            if held is not None:
+                held.release()
+        if session_opened:
+            admission.close_session()
+        # Nothing to close once either side has
+        if WebSocketState.DISCONNECTED not in (websocket.application_state, websocket.client_state):
+            await websocket.close()
+        logger.info("WebSocket connection closed")
@@ -1,78 +1,317 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse, JSONResponse
-from models.model_manager import model_manager
+from starlette.background import BackgroundTasks
+from models.model_manager import model_manager, UnknownModel
+from models.admission import admission, Overloaded
+from models.result_cache import result_cache
+from models.inference import cache_key, transcribe_audio
+from models.decoding import DEFAULT_PROFILE, choose_profile, decode_options, measured_profile
+from models import long_audio
 from server_metadata import server_metadata
 from utils.logger import main_logger as logger
-from utils.audio_utils import process_audio_file, get_audio_duration
+from utils.audio_utils import process_audio_file, AudioFormat, StreamDecoder, SAMPLE_RATE
+from utils.priority_executor import Priority, set_scheduling
+from utils.metrics import stage, track_compute_time
+from typing import Optional
+import asyncio
 import time
 import json
-import asyncio
 
 router = APIRouter()
 
+PRIORITIES = {"interactive": Priority.INTERACTIVE, "bulk": Priority.BULK}
+
+_SERIALIZATION = stage("serialization")
+
+class _UploadStreamResponse(StreamingResponse):
+    """
+    A streamed response produced while its request body is still being read. Starlette listens
+    for the client disconnecting from the start of the response, which would take the body's
+    messages, so here it only listens once the whole body has been read.
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def listen_for_disconnect(self, receive) -> None:
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
+
 @router.post("/v1/transcribe")
 async def transcribe(
     request: Request,
     file: UploadFile = File(...),
-    stream: bool = Form(False)
+    stream: bool = Form(False),
+    encoding: Optional[str] = Form(None),
+    sample_rate: int = Form(SAMPLE_RATE),
+    channels: int = Form(1),
+    priority: str = Form("interactive"),
+    model: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    beam_size: Optional[int] = Form(None),
+    temperature: Optional[str] = Form(None),
+    word_timestamps: Optional[bool] = Form(None),
+    language: Optional[str] = Form(None),
+    condition_on_previous_text: Optional[bool] = Form(None),
+    latency_budget: Optional[float] = Form(None)
 ):
     start_time = time.time()
     try:
-        temp_audio_path, audio_content = await process_audio_file(file)
-        audio_duration = get_audio_duration(audio_content)
-        model = model_manager.get_model()
+        # Raw PCM uploads declare their layout; audio files describe themselves.
+        audio_format = AudioFormat(sample_rate=sample_rate, channels=channels, encoding=encoding) if encoding else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unsupported priority {priority!r}, expected one of {sorted(PRIORITIES)}")
+    if model is not None:
+        try:
+            model_manager.spec(model)
+        except UnknownModel as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    overrides = {
+        "beam_size": beam_size,
+        "temperature": temperature,
+        "word_timestamps": word_timestamps,
+        "language": language,
+        "condition_on_previous_text": condition_on_previous_text
+    }
+    try:
+        options = decode_options(profile, **overrides)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if latency_budget is not None and latency_budget <= 0:
+        raise HTTPException(status_code=400, detail="latency_budget must be positive")
+    # Everything this request runs on the thread pool, including the response stream, uses its class
+    set_scheduling(PRIORITIES[priority])
+    try:
+        # Shed load before spending time and memory on decoding the upload
+        admission.check()
+        audio = await process_audio_file(file, request.app.state.thread_pool, audio_format)
+        audio_duration = len(audio) / SAMPLE_RATE
+        # Loads the model if this is the first request to select it since it was last unloaded
+        lease = await model_manager.acquire(model)
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+    except Exception as e:
+        logger.error(f"Error in transcribe endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if latency_budget is not None:
+        # The budget picks the profile; the request's overrides still apply on top of it
+        options = decode_options(choose_profile(lease.model_id, audio_duration, latency_budget), **overrides)
 
+    ticket = None
+    try:
+        ticket = await admission.acquire(audio_duration)
+        # Stats count the time from here: the decode of the upload, the wait for a slot and a model
+        # load would otherwise inflate the real-time factor that admission and profiles rely on
+        admitted_time = time.time()
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+    except Exception as e:
+        logger.error(f"Error in transcribe endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if ticket is None:
+            lease.release()
+
+    try:
         if stream:
             logger.info("Invoke transcribe streaming")
 
+            # The slot and the model are held until the stream ends, or the client goes away
+            release = BackgroundTasks()
+            release.add_task(ticket.release)
+            release.add_task(lease.release)
             return StreamingResponse(
-                generate_stream(request, model, temp_audio_path, start_time, audio_duration),
-                media_type="text/event-stream"
+                generate_stream(request, lease, options, audio, start_time, admitted_time, audio_duration, ticket),
+                media_type="text/event-stream",
+                background=release
             )
         else:
             logger.info("Invoke transcribe")
 
-            return await generate_response(request, model, temp_audio_path, start_time, audio_duration)
+            async with lease, ticket:
+                return await generate_response(request, lease, options, audio, start_time, admitted_time, audio_duration)
+    except HTTPException:
+        raise
     except Exception as e:
+        ticket.release()
+        lease.release()
         logger.error(f"Error in transcribe endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
-async def generate_stream(request, asr_model, audio_path, start_time, audio_duration):
-    loop = asyncio.get_event_loop()
+@router.post("/v1/transcribe/stream")
+async def transcribe_upload_stream(
+    request: Request,
+    encoding: Optional[str] = Query(None),
+    sample_rate: int = Query(SAMPLE_RATE),
+    channels: int = Query(1),
+    priority: str = Query("interactive"),
+    model: Optional[str] = Query(None),
+    profile: Optional[str] = Query(None),
+    beam_size: Optional[int] = Query(None),
+    temperature: Optional[str] = Query(None),
+    word_timestamps: Optional[bool] = Query(None),
+    language: Optional[str] = Query(None),
+    condition_on_previous_text: Optional[bool] = Query(None)
+):
+    """
+    Transcribe audio sent as the raw request body, typically with chunked transfer encoding,
+    while it is still being received. Words are sent as Server-Sent Events.
+    """
+    start_time = time.time()
+    try:
+        audio_format = AudioFormat(sample_rate=sample_rate, channels=channels, encoding=encoding) if encoding else None
+        options = decode_options(profile, beam_size=beam_size, temperature=temperature,
+                                 word_timestamps=word_timestamps, language=language,
+                                 condition_on_previous_text=condition_on_previous_text)
+        if model is not None:
+            model_manager.spec(model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unsupported priority {priority!r}, expected one of {sorted(PRIORITIES)}")
+    set_scheduling(PRIORITIES[priority])
     try:
-        transcribe_generator = await loop.run_in_executor(
-            request.app.state.thread_pool,
-            lambda: asr_model.transcribe(audio_path, stream=True)
-        )
-        
-        async for word in transcribe_generator:
+        # The length isn't known up front, so each window is admitted once it has arrived; this
+        # only turns the request away early when nothing more can be queued
+        admission.check()
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+    try:
+        lease = await model_manager.acquire(model)
+    except Exception as e:
+        logger.error(f"Error in transcribe stream endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    logger.info("Invoke transcribe upload stream")
+    release = BackgroundTasks()
+    release.add_task(lease.release)
+    body_read = asyncio.Event()
+    return _UploadStreamResponse(
+        generate_upload_stream(request, lease, options, StreamDecoder(audio_format), body_read, start_time),
+        body_read,
+        media_type="text/event-stream",
+        background=release
+    )
+
+async def generate_upload_stream(request, lease, options, decoder, body_read, start_time):
+    loop = asyncio.get_running_loop()
+    executor = request.app.state.thread_pool
+    received = 0
+    first_word_time = None
+    # Only the windows' transcription counts towards the stats: the rest of the time is spent
+    # waiting on the network
+    compute_time = track_compute_time()
+
+    async def decoded_audio():
+        nonlocal received
+        async for data in request.stream():
+            audio = await loop.run_in_executor(executor, decoder.process, data)
+            received += len(audio)
+            if len(audio):
+                yield audio
+        body_read.set()
+        audio = await loop.run_in_executor(executor, decoder.flush)
+        received += len(audio)
+        if len(audio):
+            yield audio
+
+    try:
+        async for word in long_audio.transcribe_stream(lease.model, decoded_audio(), executor, options,
+                                                       admit=admission.acquire):
+            if first_word_time is None:
+                first_word_time = time.time() - start_time
             yield f"data: {json.dumps(word)}\n\n"
-        
+
+        inference_time = time.time() - start_time
+        audio_duration = received / SAMPLE_RATE
+        server_metadata.update_stats(audio_duration, compute_time.seconds, lease.model_id, measured_profile(options),
+                                     compute_time.seconds)
+        yield f"data: {json.dumps({'inference_time': inference_time, 'audio_duration': audio_duration, 'cached': False, 'profile': options.profile if options else DEFAULT_PROFILE, 'first_word_time': first_word_time})}\n\n"
+    except Exception as e:
+        logger.error(f"Error in upload stream: {str(e)}")
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        decoder.close()
+        lease.release()
+
+async def generate_stream(request, lease, options, audio, start_time, admitted_time, audio_duration, ticket):
+    serialization_time = 0.0
+
+    def event(data) -> str:
+        nonlocal serialization_time
+        start = time.perf_counter()
+        encoded = f"data: {json.dumps(data)}\n\n"
+        serialization_time += time.perf_counter() - start
+        return encoded
+
+    compute_time = track_compute_time()
+    try:
+        key = await cache_key(audio, request.app.state.thread_pool, stream=True, params=lease.cache_params,
+                              options=options)
+        words = await result_cache.get(key) if key else None
+        cached = words is not None
+        if cached:
+            # Replay the words of an earlier identical request
+            for word in words:
+                yield event(word)
+        else:
+            # Words are produced on the thread pool and handed over as they are decoded; if the
+            # client reads slowly, the bounded result queue pauses the decode. Long recordings are
+            # decoded as parallel chunks whose words are passed on in order.
+            if long_audio.accepts(audio_duration):
+                transcribe_generator = long_audio.transcribe_chunked(
+                    lease.model, audio, request.app.state.thread_pool, stream=True, options=options
+                )
+            else:
+                transcribe_generator = lease.model.transcribe(
+                    audio, stream=True, executor=request.app.state.thread_pool, options=options
+                )
+            words = []
+            async for word in transcribe_generator:
+                words.append(word)
+                yield event(word)
+            if key:
+                result_cache.put(key, words)
+
         end_time = time.time()
         inference_time = end_time - start_time
-        server_metadata.update_stats(audio_duration, inference_time)
-        yield f"data: {{\"inference_time\": {inference_time}, \"audio_duration\": {audio_duration}}}\n\n"
+        profile = options.profile if options else DEFAULT_PROFILE
+        if not cached:
+            server_metadata.update_stats(audio_duration, end_time - admitted_time, lease.model_id, measured_profile(options),
+                                         compute_time.seconds)
+        final = event({'inference_time': inference_time, 'audio_duration': audio_duration, 'cached': cached,
+                       'profile': profile})
+        _SERIALIZATION.observe(serialization_time)
+        yield final
     except Exception as e:
         logger.error(f"Error in stream generation: {str(e)}")
-        yield f"data: {{\"error\": \"{str(e)}\"}}\n\n"
+        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        ticket.release()
+        lease.release()
 
-async def generate_response(request, asr_model, audio_path, start_time, audio_duration):
-    loop = asyncio.get_event_loop()
+async def generate_response(request, lease, options, audio, start_time, admitted_time, audio_duration):
+    compute_time = track_compute_time()
     try:
-        transcribe_generator = await loop.run_in_executor(
-            request.app.state.thread_pool,
-            lambda: asr_model.transcribe(audio_path, stream=False)
-        )
-        result = await anext(transcribe_generator)
+        result, cached = await transcribe_audio(lease.model, audio, request.app.state.thread_pool, audio_duration,
+                                                params=lease.cache_params, options=options)
         end_time = time.time()
         inference_time = end_time - start_time
-        server_metadata.update_stats(audio_duration, inference_time)
-        return JSONResponse({
-            **result,
-            "inference_time": inference_time,
-            "audio_duration": audio_duration
-        })    
+        profile = options.profile if options else DEFAULT_PROFILE
+        if not cached:
+            server_metadata.update_stats(audio_duration, end_time - admitted_time, lease.model_id, measured_profile(options),
+                                         compute_time.seconds)
+        with _SERIALIZATION.time():
+            return JSONResponse({
+                **result,
+                "inference_time": inference_time,
+                "audio_duration": audio_duration,
+                "cached": cached,
+                "profile": profile
+            })
     except Exception as e:
         logger.error(f"Error in response generation: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-    
\ No newline at end of file
@@ -1,5 +1,12 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 from enum import Enum
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import threading
+from utils.metrics import Counter, RollingRatio, metrics
+
+# Most recent transcriptions of a model with a decode profile that latency budgets are resolved against
+PROFILE_WINDOW = 50
 
 class Backend(str, Enum):
     FASTER_WHISPER = "faster_whisper"
@@ -14,11 +21,19 @@ class Quantization(str, Enum):
     FLOAT32 = "float32"
     FLOAT16 = "float16"
     INT8 = "int8"
+    # int8 weights with float32 activations (CTranslate2 only)
+    INT8_FLOAT32 = "int8_float32"
 
 class Stats(BaseModel):
     total_requests: int = 0
     total_audio_duration: float = 0
     total_inference_time: float = 0
+    live_chunks: int = 0
+    skipped_live_chunks: int = 0
+    # Latency of the first transcription after startup, in seconds
+    first_inference_time: Optional[float] = None
+    # Seconds taken to import the server's modules
+    import_time: Optional[float] = None
 
     @property
     def average_inference_time(self):
@@ -28,6 +43,156 @@ class Stats(BaseModel):
     def real_time_factor(self):
         return self.total_inference_time / self.total_audio_duration if self.total_audio_duration > 0 else 0
 
+    @property
+    def vad_skip_ratio(self):
+        return self.skipped_live_chunks / self.live_chunks if self.live_chunks > 0 else 0
+
+class BatchingConfig(BaseModel):
+    max_batch_size: int = 1
+    max_wait_ms: float = 10.0
+
+    @property
+    def enabled(self):
+        return self.max_batch_size > 1
+
+class VADConfig(BaseModel):
+    enabled: bool = True
+    # Longest stretch of ongoing speech buffered before it is decoded, in seconds
+    max_latency: float = 1.0
+    # Silence after speech that ends an utterance, in seconds
+    hangover: float = 0.5
+    # Audio kept before a speech onset so the first word isn't clipped, in seconds
+    preroll: float = 0.3
+
+class LiveConfig(BaseModel):
+    # Probability at which a live session pins the language it detected
+    language_confidence: float = 0.8
+    # Seconds of session audio after which a pinned language is detected again; 0 keeps it
+    language_recheck: float = 0.0
+    # Committed words passed as the prompt of each live decode; 0 passes none
+    prompt_words: int = 50
+    # Seconds a live decode can start after its oldest chunk arrived before the client is told it lags; 0 never tells
+    lag_warning: float = 1.0
+    # Seconds of lag beyond which queued live audio is skipped to catch up; 0 never skips
+    max_lag: float = 5.0
+
+class InferenceConfig(BaseModel):
+    # Intra-op threads of each in-process model (CTranslate2 cpu_threads, torch threads); 0 lets the backend choose
+    cpu_threads: int = 0
+    # Calls an in-process CTranslate2 model runs at once; 0 matches the long audio parallelism
+    num_workers: int = 0
+
+class AutotuneConfig(BaseModel):
+    # Pick the quantization and thread split by timing them at startup
+    enabled: bool = False
+    # "throughput" at `concurrency` calls at once, or "latency" of a single call
+    target: str = "throughput"
+    # Calls at once the throughput target is measured with; 0 uses the admission limit
+    concurrency: int = 0
+    # JSON file keeping tuned settings by CPU model and model, reused on later starts
+    path: str = "autotune.json"
+
+class WorkerPoolConfig(BaseModel):
+    # Number of inference worker processes; 0 runs the model in the server process
+    workers: int = 0
+    # Intra-op threads per worker; 0 divides the CPU cores evenly between workers
+    threads_per_worker: int = 0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+class CacheConfig(BaseModel):
+    # Memory for cached transcription results, in MB; 0 disables the cache
+    max_mb: float = 64.0
+    # Seconds a result stays valid; 0 keeps it until evicted
+    ttl: float = 86400.0
+    # SQLite file that keeps results across restarts
+    path: Optional[str] = None
+
+    @property
+    def enabled(self):
+        return self.max_mb > 0
+
+class LongAudioConfig(BaseModel):
+    # Uploads at least this long are split and transcribed in parallel, in seconds; 0 disables
+    min_duration: float = 120.0
+    # Longest chunk, in seconds
+    chunk_duration: float = 30.0
+    # Chunks transcribed at the same time
+    parallelism: int = 4
+
+    @property
+    def enabled(self):
+        return self.min_duration > 0
+
+class AdmissionConfig(BaseModel):
+    # Requests running inference at once; 0 is unlimited
+    max_in_flight: int = 8
+    # Seconds of audio allowed to wait for a slot before requests are rejected with 429; 0 is unlimited
+    max_queued_audio: float = 3600.0
+    # Estimated wait, in seconds, beyond which requests are rejected with 503; 0 disables the check
+    max_queue_wait: float = 60.0
+    # Concurrent live transcription sessions; 0 is unlimited
+    max_live_sessions: int = 64
+
+class SchedulerConfig(BaseModel):
+    # Threads running inference and audio work; 0 uses twice the CPU cores plus one, and at least
+    # the realtime reserve, the job concurrency and the long audio parallelism together
+    workers: int = 0
+    # Threads kept free for each priority class when it isn't using them
+    realtime_reserved: int = 1
+    interactive_reserved: int = 0
+    bulk_reserved: int = 0
+
+class JobsConfig(BaseModel):
+    # SQLite file holding the job queue
+    path: str = "jobs.db"
+    # Files transcribed at the same time; 0 matches the batch size (at least 2)
+    concurrency: int = 0
+    # Directory that server-local job paths and globs are resolved in; unset disables them
+    input_dir: Optional[str] = None
+
+class LoggingConfig(BaseModel):
+    # "text" lines or one "json" object per line
+    format: str = "text"
+    # Include transcribed text in the per-chunk transcription log
+    transcripts: bool = True
+    # Share of per-chunk transcription records written
+    transcript_sample_rate: float = 1.0
+    # Most per-chunk transcription records written per second; 0 is unlimited
+    transcript_max_per_second: float = 50.0
+
+class StartupConfig(BaseModel):
+    # Transcribe a clip after loading the model, before reporting ready
+    warmup: bool = True
+    # Warm-up clip; unset uses the bundled data/audio.wav
+    warmup_audio: Optional[str] = None
+
+class AdminConfig(BaseModel):
+    # Bearer token the admin endpoints require; unset leaves them open. Kept out of /metadata
+    token: Optional[str] = Field(default=None, exclude=True)
+
+class ShutdownConfig(BaseModel):
+    # Seconds requests and live sessions get to finish after SIGTERM before the server stops anyway
+    drain_timeout: float = 30.0
+
+class ModelSpec(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_id: str
+    # Unset uses the server's quantization
+    quantization: Optional[Quantization] = None
+
+class ModelsConfig(BaseModel):
+    # Models requests can select by name besides the default one, loaded on first use
+    available: Dict[str, ModelSpec] = {}
+    # Memory for models loaded on demand, in MB; least recently used ones are unloaded beyond it. 0 is unlimited
+    memory_budget_mb: float = 0.0
+    # Model decoding every live chunk for partial results, with the session's model only decoding
+    # finished utterances; unset decodes both with the session's model
+    live_draft: Optional[str] = None
+
 class ServerMetadata(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
     
@@ -36,7 +201,25 @@ class ServerMetadata(BaseModel):
     device: Device = Device.CPU
     quantization: Quantization = Quantization.INT8
     is_loaded: bool = False
+    batching: BatchingConfig = BatchingConfig()
+    vad: VADConfig = VADConfig()
+    live: LiveConfig = LiveConfig()
+    inference: InferenceConfig = InferenceConfig()
+    autotune: AutotuneConfig = AutotuneConfig()
+    worker_pool: WorkerPoolConfig = WorkerPoolConfig()
+    cache: CacheConfig = CacheConfig()
+    long_audio: LongAudioConfig = LongAudioConfig()
+    admission: AdmissionConfig = AdmissionConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
+    jobs: JobsConfig = JobsConfig()
+    logging: LoggingConfig = LoggingConfig()
+    startup: StartupConfig = StartupConfig()
+    models: ModelsConfig = ModelsConfig()
+    admin: AdminConfig = AdminConfig()
+    shutdown: ShutdownConfig = ShutdownConfig()
     stats: Stats = Stats()
+    # Stats are updated from request handlers and worker threads alike
+    _stats_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
 
     def update(self, model_id: str, backend: Backend, device: Device, quantization: Quantization):
         self.model_id = model_id
@@ -44,9 +227,100 @@ class ServerMetadata(BaseModel):
         self.device = device
         self.quantization = quantization
 
-    def update_stats(self, audio_duration: float, inference_time: float):
-        self.stats.total_requests += 1
-        self.stats.total_audio_duration += audio_duration
-        self.stats.total_inference_time += inference_time
+    def update_stats(self, audio_duration: float, inference_time: float, model_id: Optional[str] = None,
+                     profile: Optional[str] = None, compute_time: Optional[float] = None):
+        """
+        Record a transcription. The decode `profile`'s stats are kept from `compute_time`, the
+        time the model itself took, where it is given.
+        """
+        with self._stats_lock:
+            self.stats.total_requests += 1
+            self.stats.total_audio_duration += audio_duration
+            self.stats.total_inference_time += inference_time
+            if self.stats.first_inference_time is None:
+                self.stats.first_inference_time = inference_time
+        audio_seconds, inference_seconds = _model_counters(model_id or self.model_id)
+        audio_seconds.inc(audio_duration)
+        inference_seconds.inc(inference_time)
+        if profile is not None:
+            compute_time = inference_time if compute_time is None else compute_time
+            audio_seconds, inference_seconds = _profile_counters(model_id or self.model_id, profile)
+            audio_seconds.inc(audio_duration)
+            inference_seconds.inc(compute_time)
+            _profile_window(model_id or self.model_id, profile).observe(compute_time, audio_duration)
+
+    def update_vad_stats(self, skipped: bool):
+        with self._stats_lock:
+            self.stats.live_chunks += 1
+            self.stats.skipped_live_chunks += skipped
+
+@lru_cache(maxsize=None)
+def _model_counters(model_id: str) -> Tuple[Counter, Counter]:
+    """Audio and inference seconds of one model, with its real-time factor exported alongside."""
+    audio_seconds = metrics.counter("stt_audio_seconds_total", "Seconds of audio transcribed", model=model_id)
+    inference_seconds = metrics.counter("stt_inference_seconds_total", "Seconds spent transcribing", model=model_id)
+    metrics.gauge(
+        "stt_real_time_factor", "Seconds spent transcribing per second of audio",
+        lambda: inference_seconds.value() / audio_seconds.value() if audio_seconds.value() else 0.0,
+        model=model_id
+    )
+    return audio_seconds, inference_seconds
+
+@lru_cache(maxsize=None)
+def _profile_counters(model_id: str, profile: str) -> Tuple[Counter, Counter]:
+    """Audio and inference seconds of one model with one decode profile."""
+    return (
+        metrics.counter("stt_profile_audio_seconds_total", "Seconds of audio transcribed, by decode profile",
+                        model=model_id, profile=profile),
+        metrics.counter("stt_profile_inference_seconds_total", "Seconds spent transcribing, by decode profile",
+                        model=model_id, profile=profile)
+    )
+
+@lru_cache(maxsize=None)
+def _profile_window(model_id: str, profile: str) -> RollingRatio:
+    """Inference seconds per audio second of one model's latest transcriptions with one decode profile."""
+    return RollingRatio(PROFILE_WINDOW)
+
+def profile_stats() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Audio, inference time and real-time factor of each model by the decode profiles it has used,
+    with the real-time factor of their latest transcriptions.
+    """
+    inference = {
+        (labels["model"], labels["profile"]): counter.value()
+        for labels, counter in metrics.children("stt_profile_inference_seconds_total")
+    }
+    stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for labels, counter in metrics.children("stt_profile_audio_seconds_total"):
+        audio_duration = counter.value()
+        inference_time = inference.get((labels["model"], labels["profile"]), 0.0)
+        stats.setdefault(labels["model"], {})[labels["profile"]] = {
+            "audio_duration": audio_duration,
+            "inference_time": inference_time,
+            "real_time_factor": inference_time / audio_duration if audio_duration else 0.0,
+            "recent_real_time_factor": _profile_window(labels["model"], labels["profile"]).value() or 0.0
+        }
+    return stats
+
+def profile_real_time_factor(model_id: str, profile: str) -> Optional[float]:
+    """
+    Real-time factor of a model's latest transcriptions with a decode profile, or None if it
+    hasn't been used.
+    """
+    return _profile_window(model_id, profile).value()
+
+def model_stats() -> Dict[str, Dict[str, float]]:
+    """Audio, inference time and real-time factor of each model that has transcribed anything."""
+    inference = {labels["model"]: counter.value() for labels, counter in metrics.children("stt_inference_seconds_total")}
+    stats = {}
+    for labels, counter in metrics.children("stt_audio_seconds_total"):
+        model_id = labels["model"]
+        audio_duration, inference_time = counter.value(), inference.get(model_id, 0.0)
+        stats[model_id] = {
+            "audio_duration": audio_duration,
+            "inference_time": inference_time,
+            "real_time_factor": inference_time / audio_duration if audio_duration else 0.0
+        }
+    return stats
 
 server_metadata = ServerMetadata()
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Compare the per-request cost of the former temp-file upload path with in-memory decoding.
+
+Each variant runs in a fresh subprocess so that its peak RSS is its own. Read/write syscalls
+come from /proc/self/io, so this only runs on Linux.
+
+    cd stt-inference-server
+    python testing/benchmark_audio_ingestion.py --minutes 10
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.audio_utils import decode_audio, SAMPLE_RATE
+
+SAMPLE_AUDIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "audio.wav")
+
+def upload_content(minutes: float) -> bytes:
+    clip, sample_rate = sf.read(SAMPLE_AUDIO, dtype="int16")
+    audio = np.resize(clip, int(minutes * 60 * sample_rate))
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+def temp_file_ingestion(content: bytes) -> float:
+    # The pipeline this replaced: spill the upload to disk, parse it again for the duration,
+    # then let the backend decode the file from disk.
+    from faster_whisper import decode_audio as decode_from_disk
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
+        temp_audio.write(content)
+    with sf.SoundFile(io.BytesIO(content)) as audio_file:
+        duration = len(audio_file) / audio_file.samplerate
+    decode_from_disk(temp_audio.name)
+    os.remove(temp_audio.name)
+    return duration
+
+def in_memory_ingestion(content: bytes) -> float:
+    return len(decode_audio(content)) / SAMPLE_RATE
+
+VARIANTS = {"temp_file": temp_file_ingestion, "in_memory": in_memory_ingestion}
+
+def io_counters() -> dict:
+    with open("/proc/self/io") as f:
+        return {key: int(value) for key, value in (line.split(": ") for line in f)}
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def run_variant(name: str, minutes: float) -> dict:
+    content = upload_content(minutes)
+    rss_before = current_rss_mb()
+    io_before = io_counters()
+    start = time.perf_counter()
+    VARIANTS[name](content)
+    elapsed = time.perf_counter() - start
+    io_after = io_counters()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        "variant": name,
+        "seconds": round(elapsed, 3),
+        "read_syscalls": io_after["syscr"] - io_before["syscr"],
+        "write_syscalls": io_after["syscw"] - io_before["syscw"],
+        "bytes_written": io_after["wchar"] - io_before["wchar"],
+        "peak_rss_increase_mb": round(peak_rss - rss_before, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=10, help="Length of the uploaded audio")
+    parser.add_argument("--variant", choices=sorted(VARIANTS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.minutes)))
+        return
+
+    for name in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--variant", name, "--minutes", str(args.minutes)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        print(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Memory allocated by the live audio path, with the former per-session buffers and with pooled ones.
+
+Opens `--sessions` sessions, sends each `--seconds` of 16-bit PCM in quarter-second chunks
+through the audio frontend into its buffer, and trims the buffer once a second to its last
+two seconds, as commits do. The sessions are then closed and a second set is opened and fed
+the same way while tracemalloc traces allocations.
+
+    cd stt-inference-server
+    python testing/benchmark_live_buffers.py --sessions 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.audio_utils import AudioBuffer, AudioFormat, AudioFrontend, BufferPool, SAMPLE_RATE
+
+CHUNK_SAMPLES = SAMPLE_RATE // 4
+
+class CopyingAudioBuffer(AudioBuffer):
+    """The buffer this replaced: allocated per session, and moved to the front on every trim."""
+
+    def __init__(self, buffer_duration: float = 30.0, sample_rate: int = SAMPLE_RATE):
+        self.buffer_duration = buffer_duration
+        self.sample_rate = sample_rate
+        self.buffer_size = int(buffer_duration * sample_rate)
+        self.buffer = np.zeros(self.buffer_size, dtype=np.float32)
+        self.start = 0
+        self.length = 0
+        self.start_sample = 0
+
+    def close(self):
+        self.buffer = None
+
+    def _drop(self, samples: int):
+        samples = min(max(samples, 0), self.length)
+        if samples == 0:
+            return
+        remaining = self.length - samples
+        self.buffer[:remaining] = self.buffer[samples:self.length]
+        self.length = remaining
+        self.start_sample += samples
+
+def copying_buffer() -> AudioBuffer:
+    return CopyingAudioBuffer()
+
+def pooled_buffer(pool: BufferPool) -> AudioBuffer:
+    return AudioBuffer(pool=pool)
+
+def stream(buffers, chunks: int, pcm: bytes):
+    frontends = [AudioFrontend(AudioFormat()) for _ in buffers]
+    for index in range(chunks):
+        for frontend, buffer in zip(frontends, buffers):
+            buffer.add_audio(frontend.process(pcm))
+            if index % 4 == 3:
+                buffer.trim(buffer.end_time - 2.0)
+
+def run_variant(name: str, sessions: int, seconds: float) -> dict:
+    pool = BufferPool(max_idle=sessions)
+    open_buffer = copying_buffer if name == "copying" else lambda: pooled_buffer(pool)
+    chunks = int(seconds * 4)
+    pcm = (np.random.default_rng(0).normal(0, 3000, CHUNK_SAMPLES)).astype(np.int16).tobytes()
+
+    # A first set of sessions, closed before measuring, as on a server that has been running
+    buffers = [open_buffer() for _ in range(sessions)]
+    stream(buffers, chunks, pcm)
+    for buffer in buffers:
+        buffer.close()
+    del buffers
+
+    tracemalloc.start()
+    buffers = [open_buffer() for _ in range(sessions)]
+    opened, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    stream(buffers, chunks, pcm)
+    elapsed = time.perf_counter() - start
+    streamed, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "variant": name,
+        "sessions": sessions,
+        "allocated_per_session_kb": round(opened / sessions / 1024, 1),
+        "retained_per_chunk_bytes": round((streamed - opened) / (sessions * chunks), 1),
+        "peak_transient_kb": round((peak - streamed) / 1024, 1),
+        "chunk_us": round(elapsed / (sessions * chunks) * 1e6, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=500, help="Concurrent live sessions")
+    parser.add_argument("--seconds", type=float, default=20, help="Audio sent per session")
+    args = parser.parse_args()
+
+    for name in ("copying", "pooled"):
+        print(json.dumps(run_variant(name, args.sessions, args.seconds)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Throughput and latency of the server under concurrent load, without a GPU or network.
+
+Starts the server in a subprocess with a stand-in model whose decodes take `--cost` seconds per
+second of audio and return the same words every time, or with the faster-whisper `tiny` model
+(`--backend tiny`) if it has been downloaded. `--concurrency` clients then replay
+data/audio.wav at once: as uploads to /v1/transcribe, and as live sessions streaming it over the
+WebSocket at real-time pace. For each, the JSON report has the throughput, p50/p99 latency,
+real-time factor, the server's event loop lag and its peak RSS.
+
+The report is compared with the run stored for the same backend, stub cost and concurrency in
+`--baseline`, and the exit status is 1 when a metric is more than `--tolerance` worse.
+`--save_baseline` stores this run there instead.
+
+    cd stt-inference-server
+    python testing/benchmark_load.py --concurrency 8
+    python testing/benchmark_load.py --backend tiny --concurrency 4 --save_baseline
+
+Result caching is disabled on the server, since every client sends the same clip. An upload's
+latency is the time to its response; a live session's is the time from flushing the end of
+the stream to its last result.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from models.base import BaseModel
+from utils.audio_utils import decode_audio, SAMPLE_RATE
+from utils.metrics import Histogram, resident_bytes
+
+SAMPLE_AUDIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "audio.wav")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Metrics compared with the baseline: whether a larger value is better, and the change in
+# either direction that is run-to-run noise however large it is relative to the baseline
+COMPARED = {
+    "throughput": (True, 0.0),
+    "latency_p50": (False, 0.02),
+    "latency_p99": (False, 0.02),
+    "real_time_factor": (False, 0.01),
+    "loop_lag_p99_ms": (False, 5.0),
+    "peak_rss_mb": (False, 5.0)
+}
+
+class StubModel(BaseModel):
+    """
+    Stands in for Whisper: sleeps `cost` seconds per second of audio, releasing the GIL as
+    the native backends do, and returns one word per second of audio.
+    """
+
+    def __init__(self, cost: float):
+        self.cost = cost
+
+    def _decode(self, audio: np.ndarray) -> List[Dict[str, Any]]:
+        duration = len(audio) / SAMPLE_RATE
+        time.sleep(self.cost * duration)
+        return [{"word": f" w{second}", "start": float(second), "end": float(second + 1)}
+                for second in range(int(duration))]
+
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        words = self._decode(audio_file)
+        if stream:
+            yield from words
+        else:
+            yield {"transcription": "".join(word["word"] for word in words).strip(),
+                   "language": "en", "language_probability": 1.0}
+
+    def live_transcribe(self, audio, options=None, prompt=None, language=None):
+        return {"words": self._decode(audio), "language": "en", "language_probability": 1.0}
+
+class LoopLagMonitor:
+    """How late the server's event loop wakes up from a short sleep, i.e. how long it was blocked."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lag = Histogram()
+        self.task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(0.0, time.perf_counter() - start - self.interval))
+
+    async def take(self) -> Dict[str, float]:
+        """The lag since the last call, in milliseconds, starting the monitor on the first."""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        summary, self.lag = self.lag.summary(scale=1000), Histogram()
+        return summary
+
+def tiny_model_path() -> Optional[str]:
+    """The faster-whisper `tiny` model if it has been downloaded, without downloading it."""
+    from faster_whisper.utils import download_model
+    try:
+        return download_model("tiny", local_files_only=True)
+    except Exception:
+        return None
+
+def serve(args):
+    """Run the server with the benchmarked model, plus a route reporting its event loop lag."""
+    import uvicorn
+    from main import app
+    from models.model_manager import model_manager
+    from server_metadata import server_metadata, CacheConfig, JobsConfig, StartupConfig, Backend, Device, Quantization
+
+    server_metadata.cache = CacheConfig(max_mb=0)
+    server_metadata.jobs = JobsConfig(path=os.path.join(tempfile.mkdtemp(), "jobs.db"))
+    if args.backend == "stub":
+        server_metadata.model_id = "stub"
+        server_metadata.startup = StartupConfig(warmup=False)
+        model_manager.model, model_manager.is_loaded = StubModel(args.cost), True
+    else:
+        server_metadata.update(model_id=args.model_path, backend=Backend.FASTER_WHISPER, device=Device.CPU,
+                               quantization=Quantization(args.dtype))
+
+    monitor = LoopLagMonitor()
+    app.add_api_route("/benchmark/loop_lag", monitor.take, methods=["GET"])
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+def start_server(args) -> subprocess.Popen:
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--backend", args.backend,
+               "--cost", str(args.cost), "--port", str(args.port), "--dtype", args.dtype]
+    if args.model_path:
+        command += ["--model_path", args.model_path]
+    server = subprocess.Popen(command, cwd=tempfile.mkdtemp())
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/health/ready").status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"Server not ready after {args.startup_timeout}s")
+
+class RSSSampler:
+    """Peak resident memory of a process, sampled every `interval` seconds while running."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+
+    async def __aenter__(self):
+        self.peak = resident_bytes(self.pid) or 0
+        self.task = asyncio.ensure_future(self._sample())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.task.cancel()
+        self._record()
+
+    async def _sample(self):
+        while True:
+            self._record()
+            await asyncio.sleep(self.interval)
+
+    def _record(self):
+        self.peak = max(self.peak, resident_bytes(self.pid) or 0)
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {"latency_p50": None, "latency_p99": None}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {"latency_p50": round(float(p50), 4), "latency_p99": round(float(p99), 4)}
+
+async def run_uploads(base_url: str, content: bytes, concurrency: int, requests: int) -> Dict[str, Any]:
+    latencies, real_time_factors, errors = [], [], 0
+    remaining = iter(range(requests))
+
+    async def client(http: httpx.AsyncClient):
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await http.post(f"{base_url}/v1/transcribe", files={"file": ("audio.wav", content)})
+            if response.status_code != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            result = response.json()
+            real_time_factors.append(result["inference_time"] / result["audio_duration"])
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=None, limits=httpx.Limits(max_connections=concurrency)) as http:
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": errors,
+        # Uploads answered per second
+        "throughput": round(len(latencies) / elapsed, 3),
+        **latency_summary(latencies),
+        "real_time_factor": round(float(np.mean(real_time_factors)), 4) if real_time_factors else None
+    }
+
+async def run_live(base_url: str, pcm: bytes, concurrency: int, chunk_seconds: float) -> Dict[str, Any]:
+    import websockets
+
+    url = base_url.replace("http://", "ws://") + "/v1/live_transcription"
+    chunk_size = int(chunk_seconds * SAMPLE_RATE) * 2
+    latencies, real_time_factors, errors = [], [], 0
+
+    async def session():
+        nonlocal errors
+        try:
+            async with websockets.connect(url, max_size=None) as websocket:
+                flushed = asyncio.Event()
+                flushed_at = None
+
+                async def receive():
+                    async for message in websocket:
+                        result = json.loads(message)
+                        if "error" in result:
+                            raise RuntimeError(result["error"])
+                        if result.get("type") == "partial" and result["audio_duration"] > 0:
+                            real_time_factors.append(result["inference_time"] / result["audio_duration"])
+                        # The decode that finishes the stream ends with a partial result without words
+                        if flushed.is_set() and result.get("type") == "partial" and not result["words"]:
+                            latencies.append(time.perf_counter() - flushed_at)
+                            return
+
+                receiving = asyncio.ensure_future(receive())
+                start = time.perf_counter()
+                for index, offset in enumerate(range(0, len(pcm), chunk_size)):
+                    # Real-time pace: each chunk is sent when its audio would have been captured
+                    await asyncio.sleep(max(0.0, start + (index + 1) * chunk_seconds - time.perf_counter()))
+                    await websocket.send(pcm[offset:offset + chunk_size])
+                flushed_at = time.perf_counter()
+                flushed.set()
+                await websocket.send(json.dumps({"event": "flush"}))
+                await receiving
+        except Exception:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": concurrency,
+        "errors": errors,
+        # Seconds of audio transcribed per second, at most the concurrency since audio is sent in real time
+        "throughput": round(len(latencies) * len(pcm) / 2 / SAMPLE_RATE / elapsed, 3),
+        **latency_summary(latencies),
+        "real_time_factor": round(float(np.mean(real_time_factors)), 4) if real_time_factors else None
+    }
+
+async def run_scenarios(args, server: subprocess.Popen) -> Dict[str, Any]:
+    base_url = f"http://127.0.0.1:{args.port}"
+    with open(SAMPLE_AUDIO, "rb") as f:
+        content = f.read()
+    clip = decode_audio(content)
+    audio = np.resize(clip, int(args.live_seconds * SAMPLE_RATE))
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+    scenarios = {
+        "upload": lambda: run_uploads(base_url, content, args.concurrency, args.requests or args.concurrency * 4),
+        "live": lambda: run_live(base_url, pcm, args.concurrency, args.chunk_seconds)
+    }
+    results = {}
+    async with httpx.AsyncClient(timeout=None) as http:
+        for name in args.scenarios:
+            await http.get(f"{base_url}/benchmark/loop_lag")  # starts the monitor, and resets it
+            async with RSSSampler(server.pid) as rss:
+                results[name] = await scenarios[name]()
+            loop_lag = (await http.get(f"{base_url}/benchmark/loop_lag")).json()
+            results[name]["loop_lag_p99_ms"] = round(loop_lag.get("p99", 0.0), 3)
+            results[name]["loop_lag_max_ms"] = round(loop_lag.get("max", 0.0), 3)
+            results[name]["peak_rss_mb"] = round(rss.peak / 2**20, 1)
+    return results
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Each compared metric of each scenario with its change from the baseline, flagging regressions."""
+    comparison = []
+    for scenario, metrics in results.items():
+        for metric, (higher_is_better, noise) in COMPARED.items():
+            value, expected = metrics.get(metric), baseline.get(scenario, {}).get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            worse = expected - value if higher_is_better else value - expected
+            comparison.append({
+                "scenario": scenario,
+                "metric": metric,
+                "baseline": expected,
+                "value": value,
+                "change": round(change, 3),
+                "regression": worse > noise and worse / expected > tolerance
+            })
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["stub", "tiny"], default="stub", help="Model the server runs")
+    parser.add_argument("--cost", type=float, default=0.05, help="Seconds the stub model takes per second of audio")
+    parser.add_argument("--model_path", type=str, default=None, help="faster-whisper model for --backend tiny (defaults to the downloaded tiny model)")
+    parser.add_argument("--dtype", type=str, default="int8", help="Quantization of the tiny model")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clients sending requests at once")
+    parser.add_argument("--requests", type=int, default=0, help="Uploads sent in total (0 is four per client)")
+    parser.add_argument("--live_seconds", type=float, default=20.0, help="Audio streamed by each live session")
+    parser.add_argument("--chunk_seconds", type=float, default=0.25, help="Audio per live WebSocket message")
+    parser.add_argument("--scenarios", nargs="+", choices=["upload", "live"], default=["upload", "live"])
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="JSON file of stored runs")
+    parser.add_argument("--save_baseline", action="store_true", help="Store this run in --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change of a metric counted as a regression")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup_timeout", type=float, default=300.0)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    if args.backend == "tiny" and not args.model_path:
+        args.model_path = tiny_model_path()
+        if args.model_path is None:
+            print(json.dumps({"backend": "tiny", "skipped": "faster-whisper tiny model not downloaded"}))
+            return
+
+    server = start_server(args)
+    try:
+        results = asyncio.run(run_scenarios(args, server))
+    finally:
+        server.terminate()
+        server.wait()
+
+    key = f"{args.backend}/concurrency={args.concurrency}" + (f"/cost={args.cost}" if args.backend == "stub" else "")
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    report = {"run": key, "results": results}
+    regressions = []
+    if args.save_baseline:
+        stored[key] = results
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif key in stored:
+        report["comparison"] = compare(results, stored[key], args.tolerance)
+        regressions = [entry for entry in report["comparison"] if entry["regression"]]
+    print(json.dumps(report, indent=2))
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Event-loop stalls caused by logging live transcription results.
+
+Runs `--sessions` simulated live sessions on one event loop, each logging a partial result
+every `--chunk_ms` the way the live endpoint does, while a probe task measures how late the
+loop wakes it up. Compares writing records to the file on the loop (the old synchronous
+handlers) with handing them to the background writer, with and without the transcript rate
+limit.
+
+    cd stt-inference-server
+    python testing/benchmark_logging.py --sessions 200 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from server_metadata import server_metadata, LoggingConfig
+from utils.logger import LogFormatter, TranscriptFilter, setup_logger
+
+def partial_result(index: int) -> dict:
+    words = [{"word": f" word{n}", "start": n * 0.3, "end": n * 0.3 + 0.25} for n in range(12)]
+    return {
+        "type": "partial",
+        "words": words,
+        "text": "".join(word["word"] for word in words).strip(),
+        "language": "en",
+        "inference_time": 0.21,
+        "audio_duration": 3.6,
+        "chunk": index
+    }
+
+async def run(logger: logging.Logger, sessions: int, seconds: float, chunk_ms: float) -> dict:
+    lateness = []
+    stop = time.perf_counter() + seconds
+
+    async def probe():
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lateness.append(time.perf_counter() - start - 0.005)
+
+    async def session(offset: float):
+        await asyncio.sleep(offset)
+        index = 0
+        while time.perf_counter() < stop:
+            logger.info(partial_result(index))
+            index += 1
+            await asyncio.sleep(chunk_ms / 1000)
+
+    offsets = np.random.default_rng(0).uniform(0, chunk_ms / 1000, sessions)
+    await asyncio.gather(probe(), *(session(offset) for offset in offsets))
+    lateness_ms = np.array(lateness) * 1000
+    return {
+        "stall_p50_ms": round(float(np.percentile(lateness_ms, 50)), 3),
+        "stall_p99_ms": round(float(np.percentile(lateness_ms, 99)), 3),
+        "stall_max_ms": round(float(lateness_ms.max()), 3),
+        "stalled_ms_total": round(float(lateness_ms.sum()), 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200, help="Concurrent live sessions")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each run")
+    parser.add_argument("--chunk_ms", type=float, default=250.0, help="Interval between a session's results")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    synchronous = logging.getLogger("benchmark_synchronous")
+    synchronous.setLevel(logging.INFO)
+    synchronous.propagate = False
+    handler = RotatingFileHandler(os.path.join(directory, "synchronous.log"), maxBytes=10*1024*1024, backupCount=5)
+    handler.setFormatter(LogFormatter())
+    synchronous.addHandler(handler)
+
+    queued = setup_logger("benchmark_queued", os.path.join(directory, "queued.log"))
+    queued.propagate = False
+    limited = setup_logger("benchmark_limited", os.path.join(directory, "limited.log"))
+    limited.propagate = False
+    limited.addFilter(TranscriptFilter())
+
+    original = server_metadata.logging
+    for mode, logger, config in [
+        ("synchronous", synchronous, LoggingConfig()),
+        ("queued", queued, LoggingConfig()),
+        ("queued_json_rate_limited", limited, LoggingConfig(format="json")),
+    ]:
+        server_metadata.logging = config
+        result = asyncio.run(run(logger, args.sessions, args.seconds, args.chunk_ms))
+        print(json.dumps({"mode": mode, "sessions": args.sessions, **result}))
+    server_metadata.logging = original
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Overhead of the metrics subsystem.
+
+Reports the cost of recording one histogram value and one timed block, on one thread and on
+several at once, then sends uploads through the app with a stand-in model that takes
+`--inference_ms` per request, counts the values recorded per request, and reports their
+cost as a share of the request time. Whisper itself takes far longer than the default, so
+the share on a real model is smaller still.
+
+    cd stt-inference-server
+    python testing/benchmark_metrics.py --requests 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import app, create_thread_pool, register_metrics
+from models.base import BaseModel
+from models.model_manager import model_manager
+from utils.metrics import Histogram, metrics
+
+def observe_cost(threads: int, count: int) -> float:
+    """Seconds per `observe` with `threads` threads recording into the same histogram."""
+    histogram = Histogram()
+
+    def work():
+        for _ in range(count):
+            histogram.observe(0.01)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (threads * count)
+
+def timer_cost(count: int) -> float:
+    histogram = Histogram()
+    start = time.perf_counter()
+    for _ in range(count):
+        with histogram.time():
+            pass
+    return (time.perf_counter() - start) / count
+
+def recorded() -> int:
+    """Values recorded so far across every histogram."""
+    return sum(
+        histogram.snapshot()[1]
+        for name in ("stt_stage_seconds", "stt_queue_wait_seconds", "stt_live_chunk_latency_seconds")
+        for _, histogram in metrics.children(name)
+    )
+
+def request_overhead(requests: int, inference_ms: float, cost: float) -> dict:
+    class StandInModel(BaseModel):
+        def transcribe_sync(self, audio_file, stream=False):
+            time.sleep(inference_ms / 1000)
+            yield {"transcription": "hello", "language": "en", "language_probability": 1.0}
+
+        def live_transcribe(self, audio):
+            return {"words": []}
+
+    model_manager.model = StandInModel()
+    model_manager.is_loaded = True
+    app.state.thread_pool = create_thread_pool()
+    register_metrics(app)
+
+    def upload(index: int) -> bytes:
+        # Vary the audio so the result cache doesn't answer
+        audio = np.zeros(16000, dtype=np.int16)
+        audio[:2] = divmod(index, 30000)
+        buffer = io.BytesIO()
+        sf.write(buffer, audio, 16000, format="WAV", subtype="PCM_16")
+        return buffer.getvalue()
+
+    async def run() -> float:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            for index in range(requests):
+                response = await client.post("/v1/transcribe", files={"file": ("a.wav", upload(index), "audio/wav")})
+                response.raise_for_status()
+            return (time.perf_counter() - start) / requests
+
+    before = recorded()
+    try:
+        request_time = asyncio.run(run())
+    finally:
+        app.state.thread_pool.shutdown()
+    per_request = (recorded() - before) / requests
+    return {
+        "inference_ms": inference_ms,
+        "request_ms": round(request_time * 1000, 2),
+        "values_per_request": round(per_request, 1),
+        "overhead_us_per_request": round(per_request * cost * 1e6, 2),
+        "overhead_percent": round(per_request * cost / request_time * 100, 4)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Uploads sent through the app")
+    parser.add_argument("--inference_ms", type=float, default=50.0, help="Time the stand-in model takes per request")
+    parser.add_argument("--count", type=int, default=200000, help="Values recorded per micro-benchmark thread")
+    args = parser.parse_args()
+
+    for threads in (1, 4):
+        print(json.dumps({"benchmark": "observe", "threads": threads,
+                          "ns": round(observe_cost(threads, args.count) * 1e9, 1)}))
+    cost = timer_cost(args.count)
+    print(json.dumps({"benchmark": "timed_block", "ns": round(cost * 1e9, 1)}))
+    print(json.dumps({"benchmark": "request", **request_overhead(args.requests, args.inference_ms, cost)}))
+
+if __name__ == "__main__":
+    main()
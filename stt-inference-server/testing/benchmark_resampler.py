@@ -0,0 +1,74 @@
+"""
+Micro-benchmarks for the audio front end at common client sample rates.
+
+For each rate this reports the cost of building the polyphase filter bank (paid once per
+rate pair and cached), one-shot resampling of an upload, and streaming conversion of
+20 ms s16le chunks the way a WebSocket session feeds them.
+
+    cd stt-inference-server
+    python testing/benchmark_resampler.py --seconds 60
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.audio_utils import polyphase_filter_bank, resample, AudioFormat, AudioFrontend, Resampler, SAMPLE_RATE
+
+RATES = [8000, 44100, 48000]
+
+def best_of(repeats: int, fn) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def benchmark_rate(sample_rate: int, channels: int, seconds: float, chunk_ms: float) -> dict:
+    rng = np.random.default_rng(0)
+    audio = rng.uniform(-0.5, 0.5, int(sample_rate * seconds)).astype(np.float32)
+    pcm = (rng.uniform(-0.5, 0.5, (int(sample_rate * seconds), channels)) * 32767).astype("<i2").tobytes()
+    audio_format = AudioFormat(sample_rate=sample_rate, channels=channels)
+    chunk_bytes = int(sample_rate * chunk_ms / 1000) * audio_format.frame_size
+
+    polyphase_filter_bank.cache_clear()
+    bank_build = best_of(1, lambda: Resampler(sample_rate))
+    one_shot = best_of(3, lambda: resample(audio, sample_rate))
+
+    def stream():
+        frontend = AudioFrontend(audio_format)
+        for offset in range(0, len(pcm), chunk_bytes):
+            frontend.process(pcm[offset:offset + chunk_bytes])
+        frontend.flush()
+
+    streaming = best_of(3, stream)
+    chunks = -(-len(pcm) // chunk_bytes)
+    return {
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "filter_taps_per_phase": Resampler(sample_rate).taps if sample_rate != SAMPLE_RATE else None,
+        "bank_build_ms": round(bank_build * 1000, 2),
+        "one_shot_x_realtime": round(seconds / one_shot, 1),
+        "stream_us_per_chunk": round(streaming / chunks * 1e6, 1),
+        "stream_x_realtime": round(seconds / streaming, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=60, help="Length of the audio to convert")
+    parser.add_argument("--chunk_ms", type=float, default=20, help="Streaming chunk length")
+    args = parser.parse_args()
+
+    for sample_rate in RATES:
+        for channels in (1, 2):
+            print(json.dumps(benchmark_rate(sample_rate, channels, args.seconds, args.chunk_ms)))
+    print(json.dumps(benchmark_rate(SAMPLE_RATE, 1, args.seconds, args.chunk_ms)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import pytest
+
+from models.base import BaseModel
+from models.model_manager import model_manager
+
+class StubModel(BaseModel):
+    """Backend stand-in that returns the same transcription for any audio and hears no live words."""
+
+    def __init__(self, transcription: str = "ok"):
+        self.transcription = transcription
+
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        yield {"transcription": self.transcription, "language": "en", "language_probability": 1.0}
+
+    def live_transcribe(self, audio, options=None, prompt=None, language=None):
+        return {"words": []}
+
+@pytest.fixture
+def serve_model(monkeypatch):
+    """
+    Make a model the server's default one for the test, a StubModel unless one is given. The
+    model the server had before, and whether it was loaded, are restored when the test ends.
+    """
+    def serve(model=None):
+        monkeypatch.setattr(model_manager, "_default", model_manager._default)
+        monkeypatch.setattr(model_manager, "is_loaded", True)
+        model_manager.model = model if model is not None else StubModel()
+        return model_manager.model
+    return serve
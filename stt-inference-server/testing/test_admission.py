@@ -0,0 +1,123 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from conftest import StubModel
+from main import app
+from models.admission import AdmissionController, Overloaded, admission
+from server_metadata import server_metadata, AdmissionConfig, Stats
+
+class SlowModel(StubModel):
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        time.sleep(0.3)
+        yield from super().transcribe_sync(audio_file, stream)
+
+def wav(seconds: float, seed: int) -> bytes:
+    audio = np.random.default_rng(seed).integers(-1000, 1000, int(seconds * 16000)).astype(np.int16)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, 16000, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+@pytest.fixture
+def admission_config():
+    original = server_metadata.admission, server_metadata.stats
+    yield
+    server_metadata.admission, server_metadata.stats = original
+
+def test_requests_queue_for_a_slot_until_the_queue_is_full(admission_config):
+    server_metadata.admission = AdmissionConfig(max_in_flight=1, max_queued_audio=10.0, max_queue_wait=0)
+
+    async def run():
+        controller = AdmissionController()
+        first = await controller.acquire(5.0)
+        second = asyncio.create_task(controller.acquire(5.0))
+        await asyncio.sleep(0)
+        assert not second.done() and controller.queued_audio == 5.0
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(6.0)
+        assert rejected.value.status_code == 429
+
+        first.release()
+        first.release()  # releasing twice doesn't free a second slot
+        (await second).release()
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0 and stats["queued_audio"] == 0
+    assert stats["rejected"]["queue_full"] == 1 and stats["queue_wait_ms"]["count"] == 1
+
+def test_long_estimated_wait_is_rejected_with_retry_after(admission_config):
+    server_metadata.admission = AdmissionConfig(max_in_flight=2, max_queue_wait=10.0)
+    # Half a second of compute per second of audio
+    server_metadata.stats = Stats(total_requests=1, total_audio_duration=100.0, total_inference_time=50.0)
+
+    async def run():
+        controller = AdmissionController()
+        tickets = [await controller.acquire(30.0) for _ in range(2)]
+        assert controller.estimated_wait() == pytest.approx(15.0)
+        with pytest.raises(Overloaded) as rejected:
+            await controller.acquire(1.0)
+        for ticket in tickets:
+            ticket.release()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 503 and rejected.headers == {"Retry-After": "15"}
+
+async def _post_concurrently(count: int, first_seed: int = 0):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*[
+            client.post("/v1/transcribe", files={"file": ("audio.wav", wav(2.0, seed), "audio/wav")}, timeout=30)
+            for seed in range(first_seed, first_seed + count)
+        ])
+
+def test_overloaded_uploads_get_429(admission_config, serve_model):
+    server_metadata.admission = AdmissionConfig(max_in_flight=1, max_queued_audio=3.0)
+    serve_model(SlowModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        responses = asyncio.run(_post_concurrently(3))
+    finally:
+        app.state.thread_pool.shutdown()
+    codes = sorted(response.status_code for response in responses)
+    assert codes == [200, 200, 429]
+    rejected = next(response for response in responses if response.status_code == 429)
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert admission.in_flight == 0
+
+def test_queued_time_is_left_out_of_the_real_time_factor(admission_config, serve_model):
+    server_metadata.admission = AdmissionConfig(max_in_flight=1)
+    server_metadata.stats = Stats()
+    serve_model(SlowModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        # Audio the result cache hasn't seen, so both are transcribed
+        responses = asyncio.run(_post_concurrently(2, first_seed=100))
+    finally:
+        app.state.thread_pool.shutdown()
+    # The second upload waits for the first, which shows in its response but not in the stats
+    assert max(response.json()["inference_time"] for response in responses) >= 0.6
+    assert server_metadata.stats.total_requests == 2
+    assert server_metadata.stats.total_inference_time < 0.85
+
+def test_live_sessions_over_the_limit_are_closed_with_1013(admission_config, serve_model):
+    server_metadata.admission = AdmissionConfig(max_live_sessions=1)
+    serve_model(SlowModel())
+    admission.live_sessions += 1
+    try:
+        with TestClient(app).websocket_connect("/v1/live_transcription") as websocket:
+            with pytest.raises(WebSocketDisconnect) as closed:
+                websocket.receive_json()
+        assert closed.value.code == 1013
+    finally:
+        admission.live_sessions -= 1
+    assert admission.live_sessions == 0
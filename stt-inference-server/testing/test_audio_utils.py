@@ -0,0 +1,115 @@
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from utils import audio_utils
+from utils.audio_utils import decode_audio, resample, AudioBuffer, AudioFormat, AudioFrontend, BufferPool, \
+    StreamDecoder, SAMPLE_RATE
+
+def encode(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, format: str = "WAV", subtype: str = "PCM_16") -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format=format, subtype=subtype)
+    return buffer.getvalue()
+
+def test_decode_wav_to_float32_mono():
+    left = np.full(SAMPLE_RATE, 0.5, dtype=np.float32)
+    right = np.full(SAMPLE_RATE, -0.25, dtype=np.float32)
+    audio = decode_audio(encode(np.stack([left, right], axis=1)))
+    assert audio.dtype == np.float32
+    assert audio.shape == (SAMPLE_RATE,)
+    np.testing.assert_allclose(audio, 0.125, atol=1e-4)
+
+def test_decode_flac():
+    tone = np.sin(np.linspace(0, 100, SAMPLE_RATE // 2)).astype(np.float32) * 0.5
+    audio = decode_audio(encode(tone, format="FLAC"))
+    np.testing.assert_allclose(audio, tone, atol=1e-4)
+
+def sine(sample_rate: int, duration: float = 1.0, frequency: float = 440.0) -> np.ndarray:
+    return np.sin(2 * np.pi * frequency * np.arange(int(sample_rate * duration)) / sample_rate).astype(np.float32)
+
+@pytest.mark.parametrize("sample_rate", [8000, 22050, 44100, 48000])
+def test_resample_preserves_tone(sample_rate):
+    audio = resample(sine(sample_rate), sample_rate)
+    assert audio.dtype == np.float32
+    assert len(audio) == SAMPLE_RATE
+    np.testing.assert_allclose(audio[200:-200], sine(SAMPLE_RATE)[200:-200], atol=5e-3)
+
+def test_resample_removes_content_above_nyquist():
+    audio = resample(sine(48000, frequency=12000), 48000)
+    assert np.abs(audio[200:-200]).max() < 0.01
+
+def test_decode_resamples_44k_wav():
+    audio = decode_audio(encode(sine(44100), sample_rate=44100))
+    assert len(audio) == SAMPLE_RATE
+    np.testing.assert_allclose(audio[200:-200], sine(SAMPLE_RATE)[200:-200], atol=5e-3)
+
+def test_frontend_stream_matches_one_shot():
+    # Interleaved 48 kHz stereo s16le split at arbitrary byte boundaries, including mid-frame.
+    left, right = sine(48000), sine(48000, frequency=300)
+    pcm = (np.stack([left, right], axis=1) * 32767).astype("<i2").tobytes()
+    audio_format = AudioFormat(sample_rate=48000, channels=2, encoding="pcm_s16le")
+
+    expected = decode_audio(pcm, audio_format)
+    frontend = AudioFrontend(audio_format)
+    cuts = [0, 1, 999, 3333, 70001, 120002, len(pcm)]
+    streamed = np.concatenate([frontend.process(pcm[a:b]) for a, b in zip(cuts, cuts[1:])] + [frontend.flush()])
+
+    np.testing.assert_allclose(streamed, expected, atol=1e-6)
+    np.testing.assert_allclose(expected[200:-200], resample((left + right) / 2, 48000)[200:-200], atol=1e-3)
+
+def test_frontend_converts_full_scale_int16_without_overflow():
+    pcm = np.array([-32768, 32767, 0], dtype="<i2").tobytes()
+    audio = AudioFrontend(AudioFormat()).process(pcm)
+    np.testing.assert_allclose(audio, [-1.0, 32767 / 32768, 0.0])
+
+class RecordingFFmpeg:
+    """Stands in for the ffmpeg process, decoding what it was sent once it is closed."""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+        return np.zeros(0, dtype=np.float32)
+
+    def close(self):
+        return decode_audio(self.data)
+
+    def kill(self):
+        pass
+
+@pytest.mark.parametrize("subtype, piped", [("PCM_16", False), ("FLOAT", False), ("PCM_U8", True), ("PCM_24", True)])
+def test_stream_decoder_pipes_wav_encodings_it_cannot_decode_to_ffmpeg(monkeypatch, subtype, piped):
+    monkeypatch.setattr(audio_utils, "_FFmpegStream", RecordingFFmpeg)
+    data = encode(sine(SAMPLE_RATE), subtype=subtype)
+    decoder = StreamDecoder()
+    audio = np.concatenate([decoder.process(data[start:start + 1000]) for start in range(0, len(data), 1000)]
+                           + [decoder.flush()])
+    assert (decoder.ffmpeg is not None) == piped
+    assert len(audio) == SAMPLE_RATE
+    np.testing.assert_allclose(audio, sine(SAMPLE_RATE), atol=0.02)
+
+def test_audio_format_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        AudioFormat(encoding="mulaw")
+
+def test_audio_buffer_matches_the_appended_audio_and_reuses_its_storage():
+    rng = np.random.default_rng(0)
+    pool = BufferPool()
+    buffer = AudioBuffer(buffer_duration=1.0, sample_rate=1000, pool=pool)
+    expected = np.zeros(0, dtype=np.float32)
+    for _ in range(500):
+        chunk = rng.random(rng.integers(0, 300)).astype(np.float32)
+        buffer.add_audio(chunk)
+        expected = np.concatenate([expected, chunk])[-1000:]
+        if rng.random() < 0.3:
+            buffer.trim(buffer.end_time - rng.random())
+            expected = expected[len(expected) - buffer.length:]
+        np.testing.assert_array_equal(buffer.audio, expected)
+        assert buffer.audio.base is buffer.buffer
+    storage = buffer.buffer
+    buffer.close()
+    assert AudioBuffer(buffer_duration=1.0, sample_rate=1000, pool=pool).buffer is storage
+    assert (pool.stats()["allocated"], pool.stats()["reused"]) == (1, 1)
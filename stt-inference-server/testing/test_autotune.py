@@ -0,0 +1,84 @@
+import json
+import time
+
+import pytest
+
+from conftest import StubModel
+from main import thread_pool_workers
+from models import autotune as autotune_module
+from models.autotune import Candidate, autotune, candidates
+from server_metadata import server_metadata, AutotuneConfig, Backend, InferenceConfig, JobsConfig, Quantization
+
+class TimedModel(StubModel):
+    """Takes longer per call with more threads each, and runs calls one at a time with one worker."""
+
+    def __init__(self, quantization, cpu_threads, num_workers):
+        super().__init__(transcription="")
+        self.seconds = {Quantization.INT8: 0.01, Quantization.INT8_FLOAT32: 0.02, Quantization.FLOAT32: 0.03}[quantization]
+        self.seconds *= 1 + 0.5 * (cpu_threads > 1)
+        self.serial = num_workers == 1
+        self.closed = False
+
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        time.sleep(self.seconds * (4 if self.serial else 1))
+        yield from super().transcribe_sync(audio_file, stream)
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def timed(monkeypatch, tmp_path):
+    original = (server_metadata.model_id, server_metadata.backend, server_metadata.quantization,
+                server_metadata.inference, server_metadata.autotune)
+    created = []
+
+    def create(backend, model_id, device, quantization, cpu_threads=0, num_workers=1):
+        created.append(Candidate(quantization, cpu_threads, num_workers))
+        return TimedModel(quantization, cpu_threads, num_workers)
+
+    monkeypatch.setattr(autotune_module, "create_model", create)
+    monkeypatch.setattr(autotune_module.multiprocessing, "cpu_count", lambda: 4)
+    server_metadata.model_id, server_metadata.backend = "tuned", Backend.FASTER_WHISPER
+    server_metadata.autotune = AutotuneConfig(enabled=True, concurrency=4, path=str(tmp_path / "autotune.json"))
+    yield created
+    (server_metadata.model_id, server_metadata.backend, server_metadata.quantization,
+     server_metadata.inference, server_metadata.autotune) = original
+
+def test_candidates_split_the_cores():
+    splits = {(candidate.cpu_threads, candidate.num_workers) for candidate in candidates(Backend.FASTER_WHISPER, 8, 4)}
+    assert splits == {(8, 1), (4, 2), (2, 4)}
+    assert len(candidates(Backend.FASTER_WHISPER, 8, 4)) == 9
+    # openai-whisper has no compute types and doesn't take num_workers
+    assert candidates(Backend.OPENAI_WHISPER, 8, 4) == [Candidate(server_metadata.quantization, 8, 1)]
+
+def test_best_settings_are_applied_and_reused(timed):
+    entry = autotune()
+    assert (entry["quantization"], entry["cpu_threads"], entry["num_workers"]) == ("int8", 1, 4)
+    assert server_metadata.quantization == Quantization.INT8
+    assert server_metadata.inference == InferenceConfig(cpu_threads=1, num_workers=4)
+    assert len(timed) == 9
+
+    with open(server_metadata.autotune.path) as f:
+        stored = json.load(f)
+    assert [key.endswith("/faster_whisper/tuned") for key in stored] == [True]
+
+    # A later start reuses the file without timing anything
+    server_metadata.inference = InferenceConfig()
+    autotune()
+    assert len(timed) == 9 and server_metadata.inference.num_workers == 4
+
+    # Another target is tuned again: one call on every core
+    server_metadata.autotune = server_metadata.autotune.model_copy(update={"target": "latency"})
+    entry = autotune()
+    assert len(timed) == 9 + 3 and (entry["cpu_threads"], entry["num_workers"]) == (4, 1)
+
+def test_tuned_calls_leave_the_thread_pool_its_size(timed):
+    original = server_metadata.jobs
+    server_metadata.jobs = JobsConfig(concurrency=8)
+    try:
+        # The model limits its own calls; uploads still need threads beside the live and job work
+        server_metadata.inference = InferenceConfig(cpu_threads=4, num_workers=1)
+        needed = server_metadata.scheduler.realtime_reserved + 8 + server_metadata.long_audio.parallelism
+        assert thread_pool_workers() >= needed
+    finally:
+        server_metadata.jobs = original
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import StubModel
+from models.batch_scheduler import BatchScheduler
+from server_metadata import server_metadata, BatchingConfig
+
+class EchoBatchModel(StubModel):
+    """Returns each input back as its transcription and records the batches it saw."""
+    supports_batching = True
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def transcribe_batch(self, audio_files):
+        self.batches.append(list(audio_files))
+        time.sleep(0.05)
+        return [{"transcription": audio_file} for audio_file in audio_files]
+
+def test_requests_are_batched_and_routed_back(serve_model):
+    model = serve_model(EchoBatchModel())
+    server_metadata.batching = BatchingConfig(max_batch_size=4, max_wait_ms=50)
+    scheduler = BatchScheduler()
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            scheduler.start(executor)
+            try:
+                return await asyncio.gather(*(scheduler.submit(f"clip-{i}") for i in range(6)))
+            finally:
+                await scheduler.stop()
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        server_metadata.batching = BatchingConfig()
+
+    assert [result["transcription"] for result in results] == [f"clip-{i}" for i in range(6)]
+    assert [len(batch) for batch in model.batches] == [4, 2]
+    stats = scheduler.stats()
+    assert stats["batch_size"]["count"] == 2
+    assert stats["queue_wait_ms"]["count"] == 6
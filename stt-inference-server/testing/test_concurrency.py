@@ -0,0 +1,104 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+from conftest import StubModel
+from main import app
+from server_metadata import server_metadata, LongAudioConfig
+
+SAMPLE_RATE = 16000
+
+class SlowModel(StubModel):
+    """Backend stand-in that holds its worker thread the way a real decode does."""
+
+    def __init__(self, segments: int = 40, seconds_per_segment: float = 0.05):
+        super().__init__()
+        self.segments = segments
+        self.seconds_per_segment = seconds_per_segment
+        self.produced = 0
+
+    def transcribe_sync(self, audio_file, stream=False):
+        for i in range(self.segments):
+            time.sleep(self.seconds_per_segment)
+            self.produced += 1
+            if stream:
+                yield {"word": f" w{i}", "start": float(i), "end": float(i + 1)}
+        if not stream:
+            yield {"transcription": "done", "language": "en", "language_probability": 1.0}
+
+def ten_minute_wav() -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros(600 * SAMPLE_RATE, dtype=np.int16), SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+async def _transcribe_while_polling(stream: bool):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        upload = client.post(
+            "/v1/transcribe",
+            files={"file": ("audio.wav", ten_minute_wav(), "audio/wav")},
+            data={"stream": str(stream).lower()},
+            timeout=30,
+        )
+        transcription = asyncio.create_task(upload)
+        await asyncio.sleep(0.2)
+
+        latencies = []
+        for _ in range(5):
+            for path in ("/", "/stats"):
+                start = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+            assert not transcription.done()
+            await asyncio.sleep(0.05)
+
+        response = await transcription
+        return response, latencies
+
+def _run(stream: bool, serve_model):
+    serve_model(SlowModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    # One long decode on a worker thread, rather than parallel chunks
+    original = server_metadata.long_audio
+    server_metadata.long_audio = LongAudioConfig(min_duration=0)
+    try:
+        return asyncio.run(_transcribe_while_polling(stream))
+    finally:
+        server_metadata.long_audio = original
+        app.state.thread_pool.shutdown()
+
+def test_server_responsive_during_transcription(serve_model):
+    response, latencies = _run(stream=False, serve_model=serve_model)
+    assert response.status_code == 200
+    assert response.json()["transcription"] == "done"
+    assert max(latencies) < 0.2
+
+def test_server_responsive_during_streaming_transcription(serve_model):
+    response, latencies = _run(stream=True, serve_model=serve_model)
+    assert response.status_code == 200
+    assert response.text.count("data: ") == 41
+    assert max(latencies) < 0.2
+
+def test_stream_applies_backpressure():
+    model = SlowModel(segments=20, seconds_per_segment=0)
+    model.result_queue_size = 2
+
+    async def consume():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            words = model.transcribe(b"", stream=True, executor=executor)
+            first = await anext(words)
+            await asyncio.sleep(0.2)
+            produced = model.produced
+            await words.aclose()
+            return first, produced
+
+    first, produced = asyncio.run(consume())
+    assert first["word"] == " w0"
+    # One item handed to the consumer, a full queue, and one blocked in `put`.
+    assert produced <= model.result_queue_size + 2
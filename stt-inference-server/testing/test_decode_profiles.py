@@ -0,0 +1,87 @@
+import io
+import wave
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app
+from models.decoding import PROFILES, choose_profile, decode_options
+from server_metadata import server_metadata, profile_stats, PROFILE_WINDOW
+from utils.priority_executor import PriorityExecutor
+
+class OptionsModel(StubModel):
+    def __init__(self):
+        super().__init__()
+        self.options = []
+
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        self.options.append(options)
+        yield {"transcription": f"beam {options.beam_size if options else 'default'}", "language": "en"}
+
+def test_profiles_and_overrides():
+    # Only a request that sets nothing leaves the backend its own defaults
+    assert decode_options() is None and decode_options("accurate") == PROFILES["accurate"]
+    assert decode_options(language="en").profile == "accurate"
+    fast = decode_options("fast")
+    assert fast.beam_size == 1 and fast.temperature == (0.0,) and not fast.condition_on_previous_text
+
+    options = decode_options("fast", beam_size=3, temperature="0,0.4", word_timestamps=False, language="de")
+    assert (options.profile, options.beam_size, options.temperature) == ("fast", 3, (0.0, 0.4))
+    assert options.language == "de" and options.timestamps(default=True) is False
+    assert "profile" not in options.cache_params()
+    for invalid in [{"profile": "fastest"}, {"beam_size": 0}, {"temperature": "hot"}, {"temperature": "1.5"}]:
+        with pytest.raises(ValueError):
+            decode_options(**invalid)
+
+def test_latency_budget_picks_the_cheapest_measured_profile_that_fits():
+    model_id = "budget-test"
+    # Nothing measured yet: the fastest profile, whatever the budget
+    assert choose_profile(model_id, 10.0, 100.0) == "fast"
+    for profile, real_time_factor in [("balanced", 0.2), ("accurate", 0.5)]:
+        server_metadata.update_stats(10.0, 10.0 * real_time_factor, model_id, profile)
+    assert choose_profile(model_id, 10.0, 6.0) == "balanced"
+    assert choose_profile(model_id, 10.0, 1.0) == "fast"
+    server_metadata.update_stats(10.0, 10.0 * 0.05, model_id, "fast")
+    assert choose_profile(model_id, 10.0, 6.0) == "fast"
+    assert choose_profile(model_id, 10.0, 0.1) == "fast"
+    assert list(PROFILES) == ["fast", "balanced", "accurate"]
+
+def test_latency_budget_follows_the_latest_compute_times():
+    model_id = "budget-window-test"
+    # A slow start, such as a cold cache, and time spent queueing don't hold the profile back for good
+    for _ in range(PROFILE_WINDOW * 4):
+        server_metadata.update_stats(10.0, 30.0, model_id, "accurate", compute_time=10.0)
+    assert choose_profile(model_id, 10.0, 6.0) == "fast"
+    for _ in range(PROFILE_WINDOW):
+        server_metadata.update_stats(10.0, 30.0, model_id, "accurate", compute_time=4.0)
+    assert choose_profile(model_id, 10.0, 6.0) == "accurate"
+    stats = profile_stats()[model_id]["accurate"]
+    assert stats["recent_real_time_factor"] == pytest.approx(0.4)
+    assert stats["real_time_factor"] == pytest.approx(0.88)
+
+def test_requests_pass_their_options_to_the_backend(serve_model, monkeypatch):
+    # Keep this test's transcriptions out of the real default model's stats
+    monkeypatch.setattr(server_metadata, "model_id", "profiles-default")
+    model = serve_model(OptionsModel())
+    app.state.thread_pool = PriorityExecutor(max_workers=4)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(np.random.default_rng(1).normal(0, 1000, 16000).astype(np.int16).tobytes())
+    try:
+        client = TestClient(app)
+        default = client.post("/v1/transcribe", files={"file": ("a.wav", buffer.getvalue())}).json()
+        fast = client.post("/v1/transcribe", files={"file": ("a.wav", buffer.getvalue())}, data={"profile": "fast"}).json()
+        # Same audio, different settings: not served from the first request's cache entry
+        assert (default["transcription"], default["profile"]) == ("beam default", "accurate")
+        assert (fast["transcription"], fast["profile"], fast["cached"]) == ("beam 1", "fast", False)
+        assert model.options[0] is None and model.options[1] == PROFILES["fast"]
+
+        rejected = client.post("/v1/transcribe", files={"file": ("a.wav", buffer.getvalue())}, data={"beam_size": "0"})
+        assert rejected.status_code == 400
+    finally:
+        app.state.thread_pool.shutdown()
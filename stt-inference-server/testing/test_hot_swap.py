@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app, drain
+from models.admission import admission, Overloaded
+from models.model_manager import ModelManager, model_manager
+from server_metadata import server_metadata, AdminConfig
+
+class NamedModel(StubModel):
+    def __init__(self, model_id: str):
+        super().__init__(transcription=model_id)
+        self.model_id = model_id
+        self.warmed_up = False
+        self.closed = False
+
+    def warm_up(self, audio):
+        self.warmed_up = True
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def swappable(monkeypatch):
+    for name in ("model_id", "quantization", "admin"):
+        monkeypatch.setattr(server_metadata, name, getattr(server_metadata, name))
+    monkeypatch.setattr(ModelManager, "_create", lambda self, model_id, quantization: NamedModel(model_id))
+
+def test_old_model_serves_its_requests_until_they_finish(swappable):
+    manager = ModelManager()
+    manager.model, manager.is_loaded = NamedModel("base"), True
+
+    async def run():
+        old = await manager.acquire()
+        await manager.swap("small")
+        new = await manager.acquire()
+        assert new.model.model_id == "small" and new.model.warmed_up
+        assert old.model.model_id == "base" and not old.model.closed
+        assert [(entry["model_id"], entry["draining"]) for entry in manager.stats()] == [("small", False), ("base", True)]
+
+        old.release()
+        await asyncio.sleep(0.1)  # closed on a worker thread
+        return old.model
+
+    assert asyncio.run(run()).closed
+    assert [entry["model_id"] for entry in manager.stats()] == ["small"]
+    assert server_metadata.model_id == "small"
+
+def test_admin_endpoint_requires_the_token(swappable, serve_model):
+    server_metadata.admin = AdminConfig(token="secret")
+    serve_model(NamedModel(server_metadata.model_id))
+    client = TestClient(app)
+    assert client.post("/admin/model", json={"model_id": "small"}).status_code == 401
+    response = client.post("/admin/model", json={"model_id": "small", "quantization": "int8"},
+                           headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200 and response.json()["model_id"] == "small"
+    assert model_manager.model.model_id == "small"
+    assert "token" not in client.get("/metadata").json()["admin"]
+
+def test_drain_waits_for_admitted_requests():
+    async def run():
+        ticket = await admission.acquire(1.0)
+        draining = asyncio.ensure_future(drain(timeout=5.0))
+        await asyncio.sleep(0.05)
+        with pytest.raises(Overloaded) as rejected:
+            admission.check()
+        assert rejected.value.status_code == 503
+        assert TestClient(app).get("/health/ready").json()["status"] == "draining"
+
+        start = time.monotonic()
+        asyncio.get_running_loop().call_later(0.2, ticket.release)
+        assert await draining and time.monotonic() - start < 1.0
+
+        admission.in_flight += 1  # a request that never finishes
+        try:
+            assert not await drain(timeout=0.2)
+        finally:
+            admission.in_flight -= 1
+
+    try:
+        asyncio.run(run())
+    finally:
+        admission.draining = False
@@ -0,0 +1,157 @@
+import asyncio
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+from conftest import StubModel
+from main import app
+from models.admission import admission, Overloaded
+from models.job_queue import JobFile, JobStore, job_queue
+from server_metadata import server_metadata, JobsConfig
+
+class LengthModel(StubModel):
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        yield {"transcription": f"{len(audio_file) / 16000:.1f} seconds", "language": "en"}
+
+def wav(seconds: float) -> bytes:
+    buffer = io.BytesIO()
+    audio = np.random.default_rng(int(seconds * 10)).integers(-100, 100, int(seconds * 16000)).astype(np.int16)
+    sf.write(buffer, audio, 16000, format="WAV")
+    return buffer.getvalue()
+
+async def _run_job(tmp_path):
+    await job_queue.start(app.state.thread_pool)
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(
+                "/v1/jobs",
+                files=[("files", ("a.wav", wav(1.0), "audio/wav")), ("files", ("b.wav", wav(2.0), "audio/wav"))],
+                data={"paths": ["*.wav"]}
+            )
+            assert response.status_code == 202
+            job = response.json()
+            assert job["files"] == 4
+
+            stream = await client.get(f"/v1/jobs/{job['id']}/results", timeout=30)
+            events = [json.loads(line[6:]) for line in stream.text.split("\n\n") if line]
+            status = (await client.get(f"/v1/jobs/{job['id']}")).json()
+
+            outside = await client.post("/v1/jobs", data={"paths": ["../*.db"]})
+            missing = await client.get("/v1/jobs/unknown")
+        return job, events, status, outside, missing
+    finally:
+        await job_queue.stop()
+
+def test_job_files_are_transcribed_and_streamed(tmp_path, serve_model):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "c.wav").write_bytes(wav(3.0))
+    (tmp_path / "input" / "d.wav").write_bytes(wav(4.0))
+    original = server_metadata.jobs
+    server_metadata.jobs = JobsConfig(path=str(tmp_path / "jobs.db"), concurrency=2, input_dir=str(tmp_path / "input"))
+    serve_model(LengthModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        job, events, status, outside, missing = asyncio.run(_run_job(tmp_path))
+    finally:
+        server_metadata.jobs = original
+        app.state.thread_pool.shutdown()
+
+    files = sorted(events[:-1], key=lambda event: event["index"])
+    assert [(file["file"], file["transcription"]) for file in files] == [
+        ("a.wav", "1.0 seconds"), ("b.wav", "2.0 seconds"), ("c.wav", "3.0 seconds"), ("d.wav", "4.0 seconds")
+    ]
+    assert events[-1]["status"] == "completed"
+    assert status["done"] == 4 and status["progress"] == 1.0 and status["audio_duration"] == 10.0
+    assert outside.status_code == 400 and missing.status_code == 404
+
+def test_running_files_are_requeued_after_a_restart(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create([JobFile("a.wav", content=b"a"), JobFile("b.wav", content=b"b")])
+    assert store.claim()[1] == 0
+    store.close()
+
+    store = JobStore(str(tmp_path / "jobs.db"))
+    assert store.recover() == 1
+    claimed = store.claim()
+    assert claimed[:2] == (job_id, 0) and claimed[2].content == b"a"
+    store.finish(job_id, 0, 1.0, {"transcription": "a"})
+    assert store.counts() == {"queued": 1, "running": 0, "done": 1, "failed": 0}
+    store.close()
+
+def test_files_turned_away_by_admission_are_requeued(tmp_path, monkeypatch, serve_model):
+    acquire = admission.acquire
+    calls = []
+
+    async def overloaded_once(audio_duration):
+        calls.append(audio_duration)
+        if len(calls) == 1:
+            raise Overloaded(429, "Too many requests queued", retry_after=0.1)
+        return await acquire(audio_duration)
+    monkeypatch.setattr(admission, "acquire", overloaded_once)
+
+    async def run():
+        await job_queue.start(app.state.thread_pool)
+        try:
+            job_id = await job_queue.submit([JobFile("a.wav", content=wav(1.0))])
+            results = [result async for result in job_queue.results(job_id)]
+            return results, await job_queue.status(job_id)
+        finally:
+            await job_queue.stop()
+
+    original = server_metadata.jobs
+    server_metadata.jobs = JobsConfig(path=str(tmp_path / "jobs.db"), concurrency=1)
+    serve_model(LengthModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        results, status = asyncio.run(run())
+    finally:
+        server_metadata.jobs = original
+        app.state.thread_pool.shutdown()
+
+    assert calls == [1.0, 1.0]
+    assert [result["transcription"] for result in results] == ["1.0 seconds"]
+    assert status["done"] == 1 and status["failed"] == 0
+
+class GatedLengthModel(LengthModel):
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        self.gate.wait(timeout=5)
+        yield from super().transcribe_sync(audio_file, stream)
+
+def test_every_watcher_of_a_job_is_woken(tmp_path, serve_model):
+    model = serve_model(GatedLengthModel())
+
+    async def run():
+        await job_queue.start(app.state.thread_pool)
+        try:
+            job_id = await job_queue.submit([JobFile("a.wav", content=wav(1.0))])
+            first, second = job_queue.results(job_id), job_queue.results(job_id)
+            leaving = asyncio.create_task(anext(first))
+            staying = asyncio.create_task(anext(second))
+            await asyncio.sleep(0.2)
+            # One watcher going away doesn't leave the other waiting for its poll timeout
+            leaving.cancel()
+            await asyncio.gather(leaving, return_exceptions=True)
+            model.gate.set()
+            return await asyncio.wait_for(staying, timeout=0.5)
+        finally:
+            await job_queue.stop()
+
+    original = server_metadata.jobs
+    server_metadata.jobs = JobsConfig(path=str(tmp_path / "jobs.db"), concurrency=1)
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        result = asyncio.run(run())
+    finally:
+        server_metadata.jobs = original
+        app.state.thread_pool.shutdown()
+    assert result["transcription"] == "1.0 seconds"
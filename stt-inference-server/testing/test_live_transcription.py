@@ -40,6 +40,12 @@ def select_audio_device():
         except ValueError:
             print("Invalid input. Please enter a number.")
 
+async def print_responses(websocket):
+    # The server answers each chunk with a "partial" message, preceded by a "final" one
+    # whenever words get committed.
+    async for response in websocket:
+        print(json.loads(response))
+
 async def mic_to_websocket():
     uri = "ws://localhost:8000/v1/live_transcription"
     
@@ -58,6 +64,7 @@ async def mic_to_websocket():
         async with websockets.connect(uri) as websocket:
             logger.info("WebSocket connection established")
             print("* Recording started")
+            receiver = asyncio.create_task(print_responses(websocket))
             while True:
                 try:
                     # Record audio
@@ -71,10 +78,6 @@ async def mic_to_websocket():
                     
                     # Send to server
                     await websocket.send(byte_data)
-                    
-                    # Receive and print response
-                    response = await websocket.recv()
-                    print(json.loads(response))
                 except websockets.exceptions.ConnectionClosed:
                     logger.error("WebSocket connection closed unexpectedly")
                     break
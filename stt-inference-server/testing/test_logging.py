@@ -0,0 +1,48 @@
+import json
+import logging
+import time
+
+import pytest
+
+from server_metadata import server_metadata, LoggingConfig
+from utils.logger import LogFormatter, TranscriptFilter, setup_logger
+
+@pytest.fixture
+def logging_config():
+    original = server_metadata.logging
+    yield
+    server_metadata.logging = original
+
+def record(message) -> logging.LogRecord:
+    return logging.LogRecord("transcription_logger", logging.INFO, __file__, 1, message, None, None)
+
+def test_records_are_written_by_the_background_writer_as_json(tmp_path, logging_config):
+    server_metadata.logging = LoggingConfig(format="json")
+    logger = setup_logger("test_json_logger", str(tmp_path / "test.log"))
+    logger.info({"type": "partial", "text": "hello"})
+    logger.info("plain %s", "message")
+
+    path = tmp_path / "test.log"
+    deadline = time.monotonic() + 5
+    while len(path.read_text().splitlines()) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    first, second = [json.loads(line) for line in path.read_text().splitlines()]
+    assert first["logger"] == "test_json_logger" and first["type"] == "partial" and first["text"] == "hello"
+    assert second["message"] == "plain message" and second["level"] == "INFO"
+
+def test_transcripts_can_be_left_out(logging_config):
+    server_metadata.logging = LoggingConfig(transcripts=False, transcript_max_per_second=0)
+    entry = record({"type": "partial", "words": [{"word": "hi"}], "text": "hi", "language": "en"})
+    assert TranscriptFilter().filter(entry)
+    assert entry.msg == {"type": "partial", "language": "en"}
+    assert "hi" not in LogFormatter().format(entry)
+
+def test_transcript_records_are_sampled_and_rate_limited(logging_config):
+    server_metadata.logging = LoggingConfig(transcript_sample_rate=0.0, transcript_max_per_second=0)
+    assert not TranscriptFilter().filter(record({"text": "hi"}))
+
+    server_metadata.logging = LoggingConfig(transcript_max_per_second=5)
+    limiter = TranscriptFilter()
+    time.sleep(1.1)  # fill the bucket
+    written = sum(limiter.filter(record({"text": "hi"})) for _ in range(100))
+    assert written == 5
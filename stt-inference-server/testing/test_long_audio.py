@@ -0,0 +1,167 @@
+import asyncio
+import contextlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app
+from models.long_audio import transcribe_chunked, transcribe_long, transcribe_stream
+from server_metadata import server_metadata, model_stats, LongAudioConfig
+from utils.priority_executor import PriorityExecutor
+from utils.vad import split_on_silence
+
+SAMPLE_RATE = 16000
+
+def speech_with_pauses(bursts: int, burst_seconds: float = 2.0, pause_seconds: float = 0.5):
+    rng = np.random.default_rng(0)
+    parts, pauses, position = [], [], 0
+    for _ in range(bursts):
+        parts.append(rng.uniform(-0.3, 0.3, int(burst_seconds * SAMPLE_RATE)).astype(np.float32))
+        position += len(parts[-1])
+        parts.append(np.zeros(int(pause_seconds * SAMPLE_RATE), dtype=np.float32))
+        pauses.append((position, position + len(parts[-1])))
+        position += len(parts[-1])
+    return np.concatenate(parts), pauses
+
+class ChunkModel(StubModel):
+    """Reports each chunk's length as one word per second and tracks how many run at once."""
+
+    def __init__(self, seconds_per_chunk: float = 0.2):
+        super().__init__()
+        self.seconds_per_chunk = seconds_per_chunk
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def transcribe_sync(self, audio_file, stream=False):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # Later chunks finish first, so ordering has to come from the stitching
+        time.sleep(self.seconds_per_chunk * (1 if len(audio_file) > 20 * SAMPLE_RATE else 0.2))
+        with self.lock:
+            self.running -= 1
+        seconds = int(len(audio_file) / SAMPLE_RATE)
+        if stream:
+            for second in range(seconds):
+                yield {"word": f" s{second}", "start": float(second), "end": second + 1.0}
+        else:
+            yield {"transcription": f" {seconds} seconds", "language": "en", "language_probability": 0.9}
+
+def test_chunks_end_in_pauses_and_cover_the_audio():
+    audio, pauses = speech_with_pauses(60)
+    bounds = split_on_silence(audio, SAMPLE_RATE, max_duration=30.0)
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(audio)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(bounds, bounds[1:]))
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in bounds)
+    assert all(any(start <= end <= stop for start, stop in pauses) for _, end in bounds[:-1])
+
+def test_chunks_run_in_parallel_and_words_come_back_in_order():
+    audio, _ = speech_with_pauses(60)
+    original = server_metadata.long_audio
+    server_metadata.long_audio = LongAudioConfig(parallelism=3)
+    model = ChunkModel()
+
+    async def collect():
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return [word async for word in transcribe_chunked(model, audio, executor, stream=True)]
+
+    try:
+        words = asyncio.run(collect())
+    finally:
+        server_metadata.long_audio = original
+    starts = [word["start"] for word in words]
+    assert starts == sorted(starts)
+    assert starts[-1] > 140
+    assert model.max_running == 3
+
+def test_non_streaming_results_are_stitched():
+    audio, _ = speech_with_pauses(30)
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            return await transcribe_long(ChunkModel(0.01), audio, executor)
+
+    result = asyncio.run(run())
+    assert result["chunks"] == 3
+    assert result["transcription"].startswith("27 seconds 25 seconds")
+    assert result["language"] == "en" and result["language_probability"] == 0.9
+
+def test_streamed_audio_is_transcribed_while_it_arrives():
+    audio, _ = speech_with_pauses(60)
+    original = server_metadata.long_audio
+    server_metadata.long_audio = LongAudioConfig(parallelism=2)
+    model = ChunkModel(0.05)
+    received = []
+    admitted = []
+
+    async def admit(duration):
+        admitted.append(duration)
+        return contextlib.nullcontext()
+
+    async def chunks():
+        for start in range(0, len(audio), SAMPLE_RATE):
+            received.append(start)
+            yield audio[start:start + SAMPLE_RATE]
+            await asyncio.sleep(0)
+
+    async def collect():
+        words = []
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            async for word in transcribe_stream(model, chunks(), executor, admit=admit):
+                words.append((word, len(received)))
+        return words
+
+    try:
+        words = asyncio.run(collect())
+    finally:
+        server_metadata.long_audio = original
+    starts = [word["start"] for word, _ in words]
+    assert starts == sorted(starts) and starts[-1] > 140
+    # The audio is read at most the windows being transcribed and the one still filling ahead
+    # of the words passed on, not to the end before the first word
+    assert all(read - word["end"] <= 3 * 30 + 1 for word, read in words)
+    assert words[0][1] < len(received)
+    assert model.max_running <= 2
+    # Each window is admitted for its own length
+    assert sum(admitted) == pytest.approx(len(audio) / SAMPLE_RATE) and max(admitted) <= 30
+
+def test_stream_endpoint_reads_a_chunked_body(serve_model, monkeypatch):
+    audio, _ = speech_with_pauses(30)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    data = buffer.getvalue()
+    # Keep this test's transcriptions out of the real default model's stats
+    monkeypatch.setattr(server_metadata, "model_id", "stream-upload-default")
+    serve_model(ChunkModel(0.01))
+    app.state.thread_pool = PriorityExecutor(max_workers=4)
+
+    def body():
+        for start in range(0, len(data), 10000):
+            time.sleep(0.002)
+            yield data[start:start + 10000]
+
+    try:
+        client = TestClient(app)
+        response = client.post("/v1/transcribe/stream", content=body())
+        events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line]
+        assert [word["start"] for word in events[:-1]] == sorted(word["start"] for word in events[:-1])
+        assert events[-2]["start"] > 60
+        assert events[-1]["audio_duration"] == len(audio) / SAMPLE_RATE and events[-1]["first_word_time"] is not None
+        # The stats take the windows' transcription time, not the time spent receiving the body
+        stats = model_stats()["stream-upload-default"]
+        assert stats["audio_duration"] == events[-1]["audio_duration"]
+        assert stats["inference_time"] < events[-1]["inference_time"] - 0.3
+
+        rejected = client.post("/v1/transcribe/stream", params={"encoding": "mp3"}, content=data)
+        assert rejected.status_code == 400
+    finally:
+        app.state.thread_pool.shutdown()
@@ -0,0 +1,112 @@
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app, register_metrics
+from server_metadata import server_metadata, Stats, model_stats
+from utils.metrics import Histogram, MetricsRegistry, track_compute_time
+
+@pytest.fixture
+def stats():
+    original = server_metadata.stats
+    server_metadata.stats = Stats()
+    yield
+    server_metadata.stats = original
+
+def test_histogram_percentiles_are_within_bucket_precision():
+    histogram = Histogram()
+    values = np.random.default_rng(0).lognormal(-3, 1, 20000)
+    for value in values:
+        histogram.observe(float(value))
+    summary = histogram.summary()
+    assert summary["count"] == len(values)
+    assert summary["max"] == values.max()
+    for quantile, key in [(50, "p50"), (95, "p95"), (99, "p99")]:
+        assert summary[key] == pytest.approx(np.percentile(values, quantile), rel=0.02)
+
+def test_histogram_and_counter_add_up_threads():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("work_seconds", "Work", kind="test")
+    counter = registry.counter("work_total", "Work")
+
+    def work():
+        for _ in range(1000):
+            histogram.observe(0.01)
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.summary()["count"] == 4000 and counter.value() == 4000
+    assert registry.histogram("work_seconds", "Work", kind="test") is histogram
+
+    exported = registry.render()
+    assert '# TYPE work_seconds histogram' in exported
+    assert 'work_seconds_bucket{kind="test",le="0.005"} 0' in exported
+    assert 'work_seconds_bucket{kind="test",le="0.025"} 4000' in exported
+    assert 'work_seconds_count{kind="test"} 4000' in exported
+    assert 'work_total 4000.0' in exported
+
+def test_stats_updates_from_many_threads_are_not_lost(stats):
+    # Real-time factors are kept for the life of the process; other tests record the default model's
+    model_id = "threaded-stats"
+
+    def update():
+        for _ in range(2000):
+            server_metadata.update_stats(1.0, 0.5, model_id)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(update) for _ in range(4)]:
+            future.result()
+    assert server_metadata.stats.total_requests == 8000
+    assert server_metadata.stats.total_audio_duration == 8000.0
+    assert model_stats()[model_id]["real_time_factor"] == pytest.approx(0.5)
+
+class SteadyModel(StubModel):
+    def transcribe_sync(self, audio_file, stream=False, options=None):
+        for word in range(3):
+            time.sleep(0.05)
+            yield {"word": f" w{word}", "start": float(word), "end": word + 1.0}
+
+def test_compute_time_leaves_out_a_slow_reader():
+    async def run():
+        compute_time = track_compute_time()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            async for _ in SteadyModel().transcribe(np.zeros(16000, dtype=np.float32), stream=True, executor=executor):
+                await asyncio.sleep(0.2)
+        return compute_time.seconds
+
+    assert 0.15 <= asyncio.run(run()) < 0.3
+
+def test_requests_are_timed_by_stage_and_exported(stats, serve_model):
+    serve_model()
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=2)
+    register_metrics(app)
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros(16000, dtype=np.int16), 16000, format="WAV", subtype="PCM_16")
+    client = TestClient(app)
+    try:
+        response = client.post("/v1/transcribe", files={"file": ("a.wav", buffer.getvalue(), "audio/wav")})
+        assert response.status_code == 200
+
+        stages = client.get("/stats").json()["stages"]
+        for stage in ("upload_read", "decode", "serialization"):
+            assert stages[stage]["count"] >= 1
+
+        exported = client.get("/metrics")
+        assert exported.headers["content-type"].startswith("text/plain")
+        assert 'stt_stage_seconds_count{stage="decode"}' in exported.text
+        assert "stt_requests_total 1" in exported.text
+        assert "stt_in_flight_requests 0" in exported.text
+    finally:
+        app.state.thread_pool.shutdown()
@@ -0,0 +1,117 @@
+import asyncio
+import io
+import time
+import wave
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app
+from models.model_manager import ModelManager, UnknownModel, model_manager
+from server_metadata import server_metadata, InferenceConfig, LongAudioConfig, ModelSpec, ModelsConfig, Quantization
+from utils.priority_executor import PriorityExecutor
+
+class SizedModel(StubModel):
+    def __init__(self, model_id: str, megabytes: int):
+        super().__init__(transcription=model_id)
+        self.model_id = model_id
+        self.megabytes = megabytes
+        self.closed = False
+
+    def memory_bytes(self):
+        return self.megabytes * 2**20
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def registry(monkeypatch):
+    original = server_metadata.models
+    server_metadata.models = ModelsConfig(
+        available={name: ModelSpec(model_id=name) for name in ("tiny", "small", "medium")},
+        memory_budget_mb=300
+    )
+    loads = []
+
+    def create(self, model_id, quantization):
+        loads.append(model_id)
+        time.sleep(0.05)
+        return SizedModel(model_id, {"tiny": 100, "small": 150, "medium": 200}[model_id])
+
+    monkeypatch.setattr(ModelManager, "_create", create)
+    yield loads
+    server_metadata.models = original
+
+def test_concurrent_first_requests_share_one_load(registry):
+    manager = ModelManager()
+
+    async def run():
+        leases = await asyncio.gather(*(manager.acquire("tiny") for _ in range(8)))
+        assert len({id(lease.model) for lease in leases}) == 1
+        assert leases[0].cache_params == {"model_id": "tiny", "quantization": server_metadata.quantization.value}
+        for lease in leases:
+            lease.release()
+        with pytest.raises(UnknownModel):
+            await manager.acquire("large")
+
+    asyncio.run(run())
+    assert registry == ["tiny"]
+    assert manager.stats()[0]["memory_mb"] == 100 and manager.stats()[0]["in_use"] == 0
+
+def test_least_recently_used_idle_model_is_unloaded(registry):
+    manager = ModelManager()
+
+    async def run():
+        tiny = await manager.acquire("tiny")
+        small = await manager.acquire("small")
+        small.release()
+        tiny.release()  # tiny is now the most recently used
+        in_use = await manager.acquire("small")
+        await manager.acquire("medium")  # 450 MB: tiny is idle and goes, small is in use and stays
+        return tiny.model, in_use
+
+    tiny_model, in_use = asyncio.run(run())
+    assert tiny_model.closed and not in_use.model.closed
+    assert [entry["name"] for entry in manager.stats()] == ["small", "medium"]
+
+def test_requests_select_a_model(registry, serve_model, monkeypatch):
+    # Keep this test's transcriptions out of the real default model's stats
+    monkeypatch.setattr(server_metadata, "model_id", "registry-default")
+    serve_model(SizedModel(server_metadata.model_id, 0))
+    app.state.thread_pool = PriorityExecutor(max_workers=4)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes((np.random.default_rng(0).normal(0, 1000, 16000)).astype(np.int16).tobytes())
+    try:
+        client = TestClient(app)
+        for model, expected in [(None, server_metadata.model_id), ("small", "small"), ("small", "small")]:
+            data = {"model": model} if model else {}
+            response = client.post("/v1/transcribe", files={"file": ("a.wav", buffer.getvalue())}, data=data)
+            assert response.json()["transcription"] == expected
+        assert client.post("/v1/transcribe", files={"file": ("a.wav", buffer.getvalue())},
+                           data={"model": "large"}).status_code == 400
+
+        resident = {entry["name"]: entry for entry in client.get("/metadata").json()["resident_models"]}
+        assert resident["small"]["memory_mb"] == 150 and resident["small"]["in_use"] == 0
+        assert resident[server_metadata.model_id]["default"]
+        assert registry == ["small"]
+    finally:
+        app.state.thread_pool.shutdown()
+        model_manager.unload_model()
+
+def test_the_model_workers_split_the_cores(monkeypatch):
+    created = []
+    monkeypatch.setattr("models.model_manager.create_model",
+                        lambda *args, cpu_threads, num_workers: created.append((cpu_threads, num_workers)))
+    monkeypatch.setattr("models.model_manager.multiprocessing.cpu_count", lambda: 8)
+    monkeypatch.setattr(server_metadata, "inference", InferenceConfig())
+    monkeypatch.setattr(server_metadata, "long_audio", LongAudioConfig(parallelism=4))
+    ModelManager()._create("base", Quantization.INT8)
+    monkeypatch.setattr(server_metadata, "inference", InferenceConfig(num_workers=1))
+    ModelManager()._create("base", Quantization.INT8)
+    assert created == [(2, 4), (0, 1)]
@@ -0,0 +1,73 @@
+import asyncio
+import io
+import threading
+import time
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+from main import app
+from utils.priority_executor import Priority, PriorityExecutor, scheduling
+
+def test_work_runs_by_class_then_deadline():
+    executor = PriorityExecutor(max_workers=1)
+    gate = threading.Event()
+    order = []
+    executor.submit(gate.wait)
+    futures = []
+    for priority, deadline, name in [
+        (Priority.BULK, None, "bulk"),
+        (Priority.INTERACTIVE, None, "upload"),
+        (Priority.REALTIME, time.monotonic() + 2, "late chunk"),
+        (Priority.REALTIME, time.monotonic() + 1, "urgent chunk"),
+    ]:
+        with scheduling(priority, deadline):
+            futures.append(executor.submit(order.append, name))
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    executor.shutdown()
+    assert order == ["urgent chunk", "late chunk", "upload", "bulk"]
+
+def test_reserved_threads_stay_free_for_live_work():
+    executor = PriorityExecutor(max_workers=2, reserved={Priority.REALTIME: 1})
+    gate = threading.Event()
+    with scheduling(Priority.BULK):
+        bulk = [executor.submit(gate.wait) for _ in range(2)]
+    time.sleep(0.1)
+    classes = executor.stats()["classes"]
+    assert classes["bulk"]["running"] == 1 and classes["bulk"]["queued"] == 1
+
+    with scheduling(Priority.REALTIME, time.monotonic() + 1):
+        assert executor.submit(lambda: "live").result(timeout=1) == "live"
+    gate.set()
+    for future in bulk:
+        future.result(timeout=5)
+    stats = executor.stats()["classes"]
+    executor.shutdown()
+    assert stats["realtime"]["completed"] == 1 and stats["realtime"]["deadline_misses"] == 0
+    assert stats["bulk"]["wait_ms"]["count"] == 2
+
+def wav() -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, np.random.default_rng(7).integers(-100, 100, 16000).astype(np.int16), 16000, format="WAV")
+    return buffer.getvalue()
+
+async def _post(priority: str, stream: bool):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post("/v1/transcribe", files={"file": ("audio.wav", wav(), "audio/wav")},
+                                 data={"priority": priority, "stream": str(stream).lower()}, timeout=30)
+
+def test_upload_priority_reaches_the_thread_pool(serve_model):
+    serve_model()
+    app.state.thread_pool = PriorityExecutor(max_workers=2)
+    try:
+        assert asyncio.run(_post("bulk", stream=True)).status_code == 200
+        assert asyncio.run(_post("urgent", stream=False)).status_code == 400
+        classes = app.state.thread_pool.stats()["classes"]
+    finally:
+        app.state.thread_pool.shutdown()
+    assert classes["bulk"]["completed"] >= 2  # decoding and the streamed decode
+    assert classes["interactive"]["completed"] == 0
@@ -0,0 +1,150 @@
+import asyncio
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+from conftest import StubModel
+from main import app
+from models.batch_scheduler import batch_scheduler
+from models.inference import transcribe_audio
+from models.result_cache import ResultCache, result_cache
+from server_metadata import server_metadata, CacheConfig
+
+class CountingModel(StubModel):
+    """Counts decodes; each one takes long enough for identical requests to overlap."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def transcribe_sync(self, audio_file, stream=False):
+        self.calls += 1
+        time.sleep(0.2)
+        if stream:
+            yield {"word": " hello", "start": 0.0, "end": 0.5}
+            yield {"word": " world", "start": 0.5, "end": 1.0}
+        else:
+            yield {"transcription": "hello world", "language": "en", "language_probability": 1.0}
+
+def wav(seconds: float, seed: int) -> bytes:
+    audio = np.random.default_rng(seed).integers(-1000, 1000, int(seconds * 16000)).astype(np.int16)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, 16000, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+def test_lru_eviction_is_bounded_by_bytes():
+    original = server_metadata.cache
+    server_metadata.cache = CacheConfig(max_mb=130 / 2**20)
+    try:
+        cache = ResultCache()
+        for key in ("a", "b", "c"):
+            cache.put(key, {"transcription": "x" * 20})
+        assert asyncio.run(cache.get("a")) is not None  # "a" is now the most recent
+        cache.put("d", {"transcription": "x" * 20})
+        assert asyncio.run(cache.get("b")) is None
+        assert asyncio.run(cache.get("a")) is not None
+        stats = cache.stats()
+        assert stats["evictions"] == 1 and stats["bytes"] <= 130
+    finally:
+        server_metadata.cache = original
+
+def test_expired_results_are_dropped():
+    original = server_metadata.cache
+    server_metadata.cache = CacheConfig(ttl=0.05)
+    try:
+        cache = ResultCache()
+        cache.put("a", {"transcription": "x"})
+        time.sleep(0.1)
+        assert asyncio.run(cache.get("a")) is None
+        assert cache.stats()["expired"] == 1
+    finally:
+        server_metadata.cache = original
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    original = server_metadata.cache
+    server_metadata.cache = CacheConfig(path=str(tmp_path / "results.db"))
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        first = ResultCache()
+        first.start(executor)
+        first.put("a", [{"word": " hi"}])
+        executor.submit(lambda: None).result()  # let the write land
+        first.close()
+
+        second = ResultCache()
+        second.start(executor)
+        assert asyncio.run(second.get("a")) == [{"word": " hi"}]
+        assert second.stats()["disk_hits"] == 1
+        second.close()
+    finally:
+        server_metadata.cache = original
+        executor.shutdown()
+
+def test_keys_depend_on_audio_and_settings():
+    cache = ResultCache()
+    audio = np.zeros(16000, dtype=np.float32)
+    assert cache.key(audio, {"stream": False}) == cache.key(audio.copy(), {"stream": False})
+    assert cache.key(audio, {"stream": False}) != cache.key(audio, {"stream": True})
+    assert cache.key(audio, {"stream": False}) != cache.key(audio + 0.1, {"stream": False})
+
+def test_batched_results_are_cached_apart_from_single_ones(monkeypatch):
+    model = CountingModel()
+    audio = np.zeros(16000, dtype=np.float32)
+
+    async def submit(audio, model, options):
+        return {"transcription": "batched"}
+    monkeypatch.setattr(batch_scheduler, "submit", submit)
+
+    async def transcribe(batched: bool):
+        monkeypatch.setattr(batch_scheduler, "accepts", lambda *args, **kwargs: batched)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return await transcribe_audio(model, audio, executor, 1.0)
+
+    result_cache.clear()
+    try:
+        assert asyncio.run(transcribe(False)) == ({"transcription": "hello world", "language": "en",
+                                                   "language_probability": 1.0}, False)
+        assert asyncio.run(transcribe(True)) == ({"transcription": "batched"}, False)
+        assert asyncio.run(transcribe(False))[1] is True
+    finally:
+        result_cache.clear()
+
+async def _post_concurrently(content: bytes, stream: bool, count: int):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*[
+            client.post("/v1/transcribe", files={"file": ("audio.wav", content, "audio/wav")},
+                        data={"stream": str(stream).lower()}, timeout=30)
+            for _ in range(count)
+        ])
+
+def test_identical_requests_share_one_inference_and_replay_streams(serve_model):
+    model = serve_model(CountingModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=4)
+    result_cache.clear()
+    try:
+        content = wav(1.0, seed=1)
+        responses = asyncio.run(_post_concurrently(content, stream=False, count=3))
+        assert model.calls == 1
+        bodies = [response.json() for response in responses]
+        assert all(body["transcription"] == "hello world" for body in bodies)
+        assert sorted(body["cached"] for body in bodies) == [False, True, True]
+
+        first, = asyncio.run(_post_concurrently(content, stream=True, count=1))
+        second, = asyncio.run(_post_concurrently(content, stream=True, count=1))
+        assert model.calls == 2
+        events = [[json.loads(line[6:]) for line in response.text.split("\n\n") if line]
+                  for response in (first, second)]
+        assert events[0][:2] == events[1][:2] == [
+            {"word": " hello", "start": 0.0, "end": 0.5}, {"word": " world", "start": 0.5, "end": 1.0}
+        ]
+        assert events[0][-1]["cached"] is False and events[1][-1]["cached"] is True
+        assert result_cache.stats()["coalesced"] == 2
+    finally:
+        app.state.thread_pool.shutdown()
+        result_cache.clear()
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app
+from models.model_manager import model_manager
+from server_metadata import server_metadata, Backend
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+class WarmUpModel(StubModel):
+    def __init__(self):
+        super().__init__()
+        self.warmed_up_on = None
+
+    def warm_up(self, audio):
+        self.warmed_up_on = len(audio)
+
+@pytest.fixture
+def startup_state(monkeypatch):
+    """A server that hasn't loaded its model yet; how it was before is restored afterwards."""
+    for name, value in (("_default", None), ("is_loaded", False), ("is_ready", False), ("error", None)):
+        monkeypatch.setattr(model_manager, name, value)
+    monkeypatch.setattr(server_metadata, "backend", server_metadata.backend)
+
+def test_ready_only_after_warm_up(startup_state, serve_model):
+    model = serve_model(WarmUpModel())
+    client = TestClient(app)
+    assert client.get("/health/live").status_code == 200
+    response = client.get("/health/ready")
+    assert response.status_code == 503 and response.json()["status"] == "warming_up"
+
+    model_manager.prepare()
+    assert model.warmed_up_on == 104640  # the bundled 6.54 s clip
+    response = client.get("/health/ready")
+    assert response.status_code == 200 and response.json()["startup"]["warmup"] >= 0
+
+def test_failed_load_fails_the_liveness_check(startup_state):
+    server_metadata.backend = Backend.PYTORCH
+    model_manager.prepare()
+    client = TestClient(app)
+    response = client.get("/health/live")
+    assert response.status_code == 503 and "Unsupported backend" in response.json()["error"]
+    assert client.get("/health/ready").json()["status"] == "failed"
+
+def test_backends_are_imported_on_first_use():
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, main; print(sorted({'torch', 'whisper', 'faster_whisper'} & set(sys.modules)))"],
+        cwd=SERVER_DIR, capture_output=True, text=True, check=True
+    )
+    assert imported.stdout.strip() == "[]"
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app
+from models.decoding import decode_options
+from models.streaming import CascadeTranscriber, StreamingTranscriber
+from routers.live_transcription import LiveSession
+from server_metadata import server_metadata, LiveConfig, VADConfig
+from utils.vad import GateDecision
+
+SAMPLE_RATE = 16000
+WORD_SAMPLES = SAMPLE_RATE // 2
+
+def speech_pcm(first_word: int, count: int) -> bytes:
+    """Half a second of 16-bit PCM per word, every sample holding the word's number."""
+    return np.repeat(np.arange(first_word, first_word + count, dtype=np.int16), WORD_SAMPLES).tobytes()
+
+def speech(first_word: int, count: int) -> np.ndarray:
+    return np.frombuffer(speech_pcm(first_word, count), dtype=np.int16) / np.float32(32768)
+
+class BlockModel(StubModel):
+    """Decodes each complete half-second block into its word; an incomplete trailing block is noise."""
+
+    def __init__(self):
+        super().__init__()
+        self.decoded_durations = []
+
+    def live_transcribe(self, audio, options=None, prompt=None, language=None):
+        self.decoded_durations.append(len(audio) / SAMPLE_RATE)
+        words = []
+        for start in range(0, len(audio), WORD_SAMPLES):
+            block = audio[start:start + WORD_SAMPLES]
+            word = f" w{int(round(block[0] * 32768))}" if len(block) == WORD_SAMPLES else " ~"
+            words.append({"word": word, "start": start / SAMPLE_RATE, "end": (start + len(block)) / SAMPLE_RATE})
+        return {"words": words, "language": "en"}
+
+def test_words_commit_once_two_decodes_agree():
+    transcriber = StreamingTranscriber(BlockModel())
+
+    transcriber.add_audio(speech(1, 2))
+    first = transcriber.process()
+    assert first["committed"] == []
+    assert [word["word"] for word in first["words"]] == [" w1", " w2"]
+
+    transcriber.add_audio(speech(3, 2))
+    second = transcriber.process()
+    assert second["committed"] == [
+        {"word": " w1", "start": 0.0, "end": 0.5},
+        {"word": " w2", "start": 0.5, "end": 1.0}
+    ]
+    assert [word["word"] for word in second["words"]] == [" w3", " w4"]
+    assert transcriber.buffer.offset == 1.0
+
+    final = transcriber.finish()
+    assert [word["word"] for word in final["committed"]] == [" w3", " w4"]
+    assert transcriber.transcript == "w1 w2 w3 w4"
+
+def test_decoded_audio_stays_flat_over_long_session():
+    model = BlockModel()
+    transcriber = StreamingTranscriber(model)
+    for chunk in range(200):
+        transcriber.add_audio(speech(2 * chunk + 1, 2))
+        transcriber.process()
+
+    assert len(transcriber.committed) == 398
+    assert [word["start"] for word in transcriber.committed[-2:]] == [198.0, 198.5]
+    assert max(model.decoded_durations) <= 2.0
+
+def test_trailing_partial_word_is_not_committed():
+    transcriber = StreamingTranscriber(BlockModel())
+    transcriber.add_audio(speech(1, 2)[:-WORD_SAMPLES])
+    transcriber.process()
+    transcriber.add_audio(np.concatenate([speech(1, 2)[-WORD_SAMPLES:], speech(3, 1)]))
+    result = transcriber.process()
+    assert [word["word"] for word in result["committed"]] == [" w1"]
+
+class DetectingModel(BlockModel):
+    """Detects German, the more surely the more audio it hears; a given language is taken as is."""
+
+    def __init__(self):
+        super().__init__()
+        self.contexts = []
+
+    def live_transcribe(self, audio, options=None, prompt=None, language=None):
+        self.contexts.append((prompt, language))
+        probability = 1.0 if language else min(1.0, len(audio) / SAMPLE_RATE)
+        return {**super().live_transcribe(audio), "language": language or "de", "language_probability": probability}
+
+def test_session_pins_its_language_and_prompts_with_committed_words():
+    model = DetectingModel()
+    transcriber = StreamingTranscriber(model, language_recheck=3.0, prompt_words=2)
+    for first_word, count in [(1, 1), (2, 1), (3, 2), (5, 2), (7, 2), (9, 1)]:
+        transcriber.add_audio(speech(first_word, count))
+        transcriber.process()
+    assert model.contexts == [
+        (None, None),  # 0.5 s is too little to be sure of the language
+        (None, None),  # pinned from here on
+        ("w1", "de"),
+        ("w1 w2", "de"),
+        ("w3 w4", None),  # 3 seconds after pinning: detected again
+        ("w5 w6", "de")
+    ]
+
+    fixed = DetectingModel()
+    transcriber = StreamingTranscriber(fixed, options=decode_options("fast", language="en"))
+    for word in range(1, 5, 2):
+        transcriber.add_audio(speech(word, 2))
+        transcriber.process()
+    # The fast profile doesn't condition on earlier text
+    assert fixed.contexts == [(None, "en"), (None, "en")] and transcriber.language == "en"
+
+def test_cascade_commits_the_final_models_words_once_per_utterance():
+    draft, final = BlockModel(), BlockModel()
+    transcriber = CascadeTranscriber(draft, final)
+    for word in range(1, 5):
+        transcriber.add_audio(speech(word, 1))
+        result = transcriber.process()
+        assert result["committed"] == [] and len(result["words"]) == word
+
+    result = transcriber.finish()
+    assert [word["word"] for word in result["committed"]] == [" w1", " w2", " w3", " w4"]
+    assert result["words"] == [] and transcriber.buffer.duration == 0
+    assert draft.decoded_durations == [0.5, 1.0, 1.5, 2.0] and final.decoded_durations == [2.0]
+
+def test_websocket_sends_partial_and_final_messages(serve_model):
+    serve_model(BlockModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=2)
+    # The synthetic speech is far below any VAD threshold.
+    server_metadata.vad = VADConfig(enabled=False)
+    try:
+        with TestClient(app).websocket_connect("/v1/live_transcription") as websocket:
+            websocket.send_bytes(speech_pcm(1, 2))
+            assert websocket.receive_json()["type"] == "partial"
+
+            websocket.send_bytes(speech_pcm(3, 2))
+            final = websocket.receive_json()
+            assert final["type"] == "final"
+            assert final["text"] == "w1 w2"
+            assert websocket.receive_json()["text"] == "w3 w4"
+
+            websocket.send_text(json.dumps({"event": "flush"}))
+            final = websocket.receive_json()
+            assert final["type"] == "final"
+            assert final["text"] == "w3 w4"
+            assert websocket.receive_json()["words"] == []
+    finally:
+        server_metadata.vad = VADConfig()
+        app.state.thread_pool.shutdown()
+
+class ClosedWebSocket:
+    async def send_json(self, message):
+        raise RuntimeError('Cannot call "send" once a close message has been sent.')
+
+def test_decoding_stops_when_the_socket_closed_under_an_error():
+    session = LiveSession(ClosedWebSocket(), transcriber=None, lease=None)
+
+    async def fail(chunks):
+        raise ValueError("decode failed")
+    session._decode_chunks = fail
+
+    async def run():
+        decoding = asyncio.create_task(session.run())
+        session.add(None, GateDecision.FINISH, time.monotonic())
+        # Returns instead of dying on the error it could not send
+        await asyncio.wait_for(decoding, timeout=5)
+
+    try:
+        asyncio.run(run())
+    finally:
+        session.close()
+
+class GatedModel(BlockModel):
+    """A BlockModel whose decodes each wait for the test to let them finish."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Semaphore(0)
+        self.finish = threading.Semaphore(0)
+
+    def live_transcribe(self, audio, **kwargs):
+        self.started.release()
+        self.finish.acquire(timeout=5)
+        return super().live_transcribe(audio)
+
+@pytest.fixture
+def gated_model(serve_model):
+    model = serve_model(GatedModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=2)
+    server_metadata.vad = VADConfig(enabled=False)
+    yield model
+    server_metadata.vad, server_metadata.live = VADConfig(), LiveConfig()
+    app.state.thread_pool.shutdown()
+
+def fall_behind(websocket, model: GatedModel):
+    """Send four chunks while the first one is being decoded."""
+    websocket.send_bytes(speech_pcm(1, 1))
+    assert model.started.acquire(timeout=5)
+    for word in range(2, 6):
+        websocket.send_bytes(speech_pcm(word, 1))
+    time.sleep(0.3)
+    model.finish.release()
+    assert websocket.receive_json()["words"][0]["word"] == " w1"
+
+def test_chunks_received_during_a_decode_are_coalesced(gated_model):
+    server_metadata.live = LiveConfig(lag_warning=0.2, max_lag=0)
+    client = TestClient(app)
+    with client.websocket_connect("/v1/live_transcription") as websocket:
+        fall_behind(websocket, gated_model)
+        lag = websocket.receive_json()
+        assert lag["type"] == "lag" and lag["lag"] >= 0.3 and lag["pending_audio"] == 2.0 and lag["dropped_audio"] == 0
+        assert gated_model.started.acquire(timeout=5)
+        gated_model.finish.release()
+        assert websocket.receive_json()["text"] == "w1"
+        assert websocket.receive_json()["text"] == "w2 w3 w4 w5"
+        # One decode for the four chunks that arrived during the first one
+        assert gated_model.decoded_durations == [0.5, 2.5]
+        session = client.get("/stats").json()["live_sessions"][0]
+    assert (session["chunks"], session["decodes"], session["dropped_audio"]) == (5, 2, 0)
+    assert session["max_lag"] >= 0.3
+
+def test_audio_too_late_to_catch_up_is_skipped(gated_model):
+    server_metadata.live = LiveConfig(max_lag=0.2)
+    with TestClient(app).websocket_connect("/v1/live_transcription") as websocket:
+        fall_behind(websocket, gated_model)
+        lag = websocket.receive_json()
+        assert lag["type"] == "lag" and lag["dropped_audio"] == 2.0 and lag["pending_audio"] == 0
+        # The first word, shown as a partial result, is committed rather than skipped with them
+        final = websocket.receive_json()
+        assert (final["type"], final["text"]) == ("final", "w1")
+        assert websocket.receive_json()["words"] == []
+
+        websocket.send_bytes(speech_pcm(6, 1))
+        assert gated_model.started.acquire(timeout=5)
+        gated_model.finish.release()
+        assert websocket.receive_json()["words"] == [{"word": " w6", "start": 2.5, "end": 3.0}]
+        assert gated_model.decoded_durations == [0.5, 0.5]
+
+def test_a_late_flush_still_gets_its_result(gated_model):
+    server_metadata.live = LiveConfig(max_lag=0.2)
+    with TestClient(app).websocket_connect("/v1/live_transcription") as websocket:
+        websocket.send_bytes(speech_pcm(1, 1))
+        assert gated_model.started.acquire(timeout=5)
+        websocket.send_bytes(speech_pcm(2, 1))
+        websocket.send_text(json.dumps({"event": "flush"}))
+        time.sleep(0.3)
+        gated_model.finish.release()
+        assert websocket.receive_json()["words"][0]["word"] == " w1"
+        lag = websocket.receive_json()
+        assert lag["type"] == "lag" and lag["dropped_audio"] == 0.5
+        final = websocket.receive_json()
+        assert (final["type"], final["text"]) == ("final", "w1")
+        assert websocket.receive_json() == {"type": "partial", "words": [], "text": "", "language": "en",
+                                            "inference_time": 0.0, "audio_duration": 0.0}
+        assert gated_model.decoded_durations == [0.5]
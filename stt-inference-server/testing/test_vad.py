@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from conftest import StubModel
+from main import app
+from server_metadata import server_metadata
+from utils.vad import EnergyVAD, SpeechGate, GateDecision
+
+SAMPLE_RATE = 16000
+
+def tone(duration: float, amplitude: float = 0.3) -> np.ndarray:
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * 32767 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+
+def silence(duration: float) -> np.ndarray:
+    return np.zeros(int(duration * SAMPLE_RATE), dtype=np.int16)
+
+class CountingModel(StubModel):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def live_transcribe(self, audio, options=None, prompt=None, language=None):
+        self.calls += 1
+        return {"words": [], "language": "en"}
+
+def test_energy_vad_separates_tone_from_silence_and_noise():
+    vad = EnergyVAD()
+    assert vad.speech_frames(tone(0.3)).all()
+    assert not vad.speech_frames(silence(0.3)).any()
+
+    noise = np.random.default_rng(0).uniform(-0.5, 0.5, int(0.3 * SAMPLE_RATE)).astype(np.float32)
+    assert not vad.speech_frames(noise).any()
+
+def test_gate_triggers_on_onset_latency_and_offset():
+    gate = SpeechGate(EnergyVAD(), max_latency=1.0, hangover=0.5)
+    decisions = [gate.update(chunk) for chunk in [
+        silence(0.5), silence(0.5),
+        tone(0.25), tone(0.5), tone(0.5),
+        silence(0.25), silence(0.25),
+        silence(0.5)
+    ]]
+    assert decisions == [
+        GateDecision.SILENCE, GateDecision.SILENCE,
+        GateDecision.PROCESS, GateDecision.WAIT, GateDecision.PROCESS,
+        GateDecision.WAIT, GateDecision.FINISH,
+        GateDecision.SILENCE
+    ]
+
+def test_gate_carries_partial_frames_between_chunks():
+    gate = SpeechGate(EnergyVAD(), max_latency=1.0, hangover=0.5)
+    audio = np.concatenate([silence(0.5), tone(0.5), silence(1.0)])
+    chunk_size = int(0.02 * SAMPLE_RATE)  # shorter than a 30 ms VAD frame
+    decisions = [gate.update(audio[start:start + chunk_size]) for start in range(0, len(audio), chunk_size)]
+    assert decisions.count(GateDecision.PROCESS) == 1
+    assert decisions.count(GateDecision.FINISH) == 1
+    assert decisions.index(GateDecision.PROCESS) < decisions.index(GateDecision.FINISH)
+
+def test_silent_chunks_are_skipped_with_heartbeat(serve_model):
+    model = serve_model(CountingModel())
+    app.state.thread_pool = ThreadPoolExecutor(max_workers=2)
+    chunks_before = server_metadata.stats.live_chunks
+    try:
+        client = TestClient(app)
+        with client.websocket_connect("/v1/live_transcription") as websocket:
+            for _ in range(10):
+                websocket.send_bytes(silence(0.5).tobytes())
+                assert websocket.receive_json() == {"vad": "silence"}
+            websocket.send_bytes(tone(0.5).tobytes())
+            assert websocket.receive_json()["type"] == "partial"
+        stats = client.get("/stats").json()
+    finally:
+        app.state.thread_pool.shutdown()
+
+    assert model.calls == 1
+    assert stats["live_chunks"] - chunks_before == 11
+    assert stats["vad_skip_ratio"] > 0
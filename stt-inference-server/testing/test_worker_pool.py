@@ -0,0 +1,154 @@
+import logging
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from models.base import BaseModel
+from models.worker_pool import WorkerPoolModel
+from utils.logger import model_logger
+
+class SummingModel(BaseModel):
+    """Reports the process it ran in and a checksum of the audio it received."""
+    supports_batching = True
+
+    def __init__(self, cpu_threads=0):
+        self.cpu_threads = cpu_threads
+
+    def transcribe_sync(self, audio_file, stream=False):
+        if stream:
+            for index in range(3):
+                yield {"text": f"segment {index}", "pid": os.getpid()}
+        else:
+            yield {"transcription": float(audio_file.sum()), "samples": len(audio_file), "pid": os.getpid()}
+
+    def live_transcribe(self, audio):
+        if not len(audio):
+            raise ValueError("empty audio")
+        time.sleep(0.2)
+        return {"words": [], "sum": float(audio.sum()), "threads": self.cpu_threads, "pid": os.getpid()}
+
+    def transcribe_batch(self, audio_files):
+        return [{"transcription": float(audio.sum())} for audio in audio_files]
+
+class CountingStreamModel(SummingModel):
+    """Streams many results, each stamped with when it was produced."""
+
+    def transcribe_sync(self, audio_file, stream=False):
+        for index in range(20):
+            yield {"index": index, "produced_at": time.monotonic()}
+
+class LoggingModel(SummingModel):
+    def live_transcribe(self, audio):
+        model_logger.info(f"Decoding in {os.getpid()}")
+        return super().live_transcribe(audio)
+
+class SmallWindowPool(WorkerPoolModel):
+    result_queue_size = 2
+
+@pytest.fixture(scope="module")
+def pool():
+    model = WorkerPoolModel(SummingModel, workers=2, threads_per_worker=1, slots_per_worker=2, slot_seconds=1.0)
+    yield model
+    model.close()
+
+def test_results_come_back_through_the_pool(pool):
+    audio = np.full(16000, 0.25, dtype=np.float32)
+    result = next(pool.transcribe_sync(audio))
+    assert result["transcription"] == pytest.approx(4000.0)
+    assert result["pid"] != os.getpid()
+    assert pool.live_transcribe(audio)["threads"] == 1
+    sums = [result["transcription"] for result in pool.transcribe_batch([audio, audio[:8000]])]
+    assert sums == pytest.approx([4000.0, 2000.0])
+
+def test_streaming_and_audio_larger_than_a_slot(pool):
+    assert [item["text"] for item in pool.transcribe_sync(np.zeros(100, dtype=np.float32), stream=True)] == \
+        ["segment 0", "segment 1", "segment 2"]
+    # Longer than a slot: goes through a dedicated shared-memory segment
+    audio = np.ones(5 * 16000, dtype=np.float32)
+    result = next(pool.transcribe_sync(audio))
+    assert result["samples"] == len(audio) and result["transcription"] == pytest.approx(len(audio))
+
+def test_errors_are_raised_in_the_caller_and_state_is_released(pool):
+    with pytest.raises(RuntimeError, match="empty audio"):
+        pool.live_transcribe(np.zeros(0, dtype=np.float32))
+    assert all(worker["in_flight"] == 0 for worker in pool.stats())
+    assert pool.live_transcribe(np.ones(10, dtype=np.float32))["sum"] == pytest.approx(10.0)
+
+def test_concurrent_requests_are_spread_across_workers(pool):
+    audio = np.zeros(16000, dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(pool.live_transcribe, [audio, audio]))
+    assert results[0]["pid"] != results[1]["pid"]
+    assert all(worker["alive"] for worker in pool.stats())
+
+def test_a_worker_that_exits_fails_its_requests_and_is_replaced():
+    pool = WorkerPoolModel(SummingModel, workers=1, threads_per_worker=1, slots_per_worker=2, slot_seconds=1.0)
+    try:
+        pid = pool.stats()[0]["pid"]
+        # Longer than a slot, so the request holds a shared-memory segment
+        audio = np.ones(2 * 16000, dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(pool.live_transcribe, audio)
+            time.sleep(0.1)
+            segment = next(iter(pool._requests.values())).segments[0].name
+            os.kill(pid, signal.SIGKILL)
+            with pytest.raises(RuntimeError, match="exited"):
+                future.result(timeout=10)
+        assert not pool._requests
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=segment)
+
+        worker = pool.stats()[0]
+        assert worker["pid"] != pid and (worker["in_flight"], worker["outstanding_audio_seconds"]) == (0, 0)
+        result = pool.live_transcribe(audio)
+        assert result["pid"] == worker["pid"] and result["sum"] == pytest.approx(len(audio))
+    finally:
+        pool.close()
+
+def test_a_worker_that_exits_while_idle_is_replaced():
+    pool = WorkerPoolModel(SummingModel, workers=1, threads_per_worker=1, slots_per_worker=2, slot_seconds=1.0)
+    try:
+        pid = pool.stats()[0]["pid"]
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while pool.stats()[0]["pid"] == pid and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert pool.stats()[0]["pid"] != pid
+        assert pool.live_transcribe(np.ones(10, dtype=np.float32))["sum"] == pytest.approx(10.0)
+    finally:
+        pool.close()
+
+def test_streamed_results_wait_for_the_consumer():
+    pool = SmallWindowPool(CountingStreamModel, workers=1, threads_per_worker=1, slots_per_worker=2, slot_seconds=1.0)
+    try:
+        items = pool.transcribe_sync(np.zeros(100, dtype=np.float32), stream=True)
+        next(items)
+        time.sleep(0.5)
+        resumed_at = time.monotonic()
+        rest = list(items)
+        assert [item["index"] for item in rest] == list(range(1, 20))
+        # The first result, a full window, and at most one more freed by taking the first
+        assert sum(item["produced_at"] < resumed_at for item in rest) <= pool.result_queue_size + 1
+    finally:
+        pool.close()
+
+def test_workers_log_through_the_server_process():
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    model_logger.addHandler(handler)
+    pool = WorkerPoolModel(LoggingModel, workers=1, threads_per_worker=1, slots_per_worker=2, slot_seconds=1.0)
+    try:
+        pid = pool.live_transcribe(np.ones(10, dtype=np.float32))["pid"]
+        deadline = time.monotonic() + 5
+        while not any(record.process == pid for record in records) and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        pool.close()
+        model_logger.removeHandler(handler)
+    assert [record.getMessage() for record in records if record.process == pid] == [f"Decoding in {pid}"]
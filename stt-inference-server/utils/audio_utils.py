@@ -1,26 +1,102 @@
 import io
-import tempfile
+import asyncio
+import math
+import subprocess
+import threading
 import soundfile as sf
-from typing import Union, Tuple
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
 from fastapi import UploadFile
 import numpy as np
+from .metrics import stage
 
-async def process_audio_file(file: UploadFile) -> Tuple[str, bytes]:
+# Sample rate expected by the models
+SAMPLE_RATE = 16000
+
+_UPLOAD_READ = stage("upload_read")
+_DECODE = stage("decode")
+
+# Raw PCM encodings accepted from clients
+ENCODINGS = {
+    "pcm_s16le": np.dtype("<i2"),
+    "pcm_f32le": np.dtype("<f4")
+}
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """Layout of raw PCM audio declared by a client."""
+    sample_rate: int = SAMPLE_RATE
+    channels: int = 1
+    encoding: str = "pcm_s16le"
+
+    def __post_init__(self):
+        if self.encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding: {self.encoding} (expected one of {', '.join(ENCODINGS)})")
+        if self.sample_rate <= 0 or self.channels <= 0:
+            raise ValueError(f"Invalid sample rate {self.sample_rate} or channel count {self.channels}")
+
+    @property
+    def frame_size(self) -> int:
+        """Bytes per sample across all channels."""
+        return ENCODINGS[self.encoding].itemsize * self.channels
+
+async def process_audio_file(file: UploadFile, executor: Optional[Executor] = None,
+                             audio_format: Optional[AudioFormat] = None) -> np.ndarray:
     """
-    Process an uploaded audio file and return its path and content.
-    
+    Read an uploaded audio file and decode it in memory.
+
     :param file: UploadFile object containing the audio file
-    :return: Tuple containing the path to the temporary file and its content in bytes
+    :param executor: Executor to decode on (the loop's default executor if None)
+    :param audio_format: Layout of the upload if it is raw PCM rather than an audio file
+    :return: float32 16 kHz mono samples
     """
     try:
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
+        with _UPLOAD_READ.time():
             content = await file.read()
-            temp_audio.write(content)
-            temp_audio_path = temp_audio.name
-        return temp_audio_path, content
+        return await asyncio.get_running_loop().run_in_executor(executor, decode_audio, content, audio_format)
     except Exception as e:
         raise ValueError(f"Error processing audio file: {str(e)}")
 
+def decode_audio(content: bytes, audio_format: Optional[AudioFormat] = None) -> np.ndarray:
+    """
+    Decode audio to float32 16 kHz mono samples.
+
+    Raw PCM is converted according to `audio_format`. Audio files are decoded by libsndfile
+    (WAV/FLAC/OGG/MP3) when it can read them, and piped through ffmpeg otherwise.
+    """
+    with _DECODE.time():
+        return _decode(content, audio_format)
+
+def _decode(content: bytes, audio_format: Optional[AudioFormat]) -> np.ndarray:
+    if audio_format is not None:
+        frontend = AudioFrontend(audio_format)
+        return np.concatenate([frontend.process(content), frontend.flush()])
+
+    try:
+        with sf.SoundFile(io.BytesIO(content)) as audio_file:
+            audio = audio_file.read(dtype="float32", always_2d=True)
+            sample_rate = audio_file.samplerate
+    except sf.LibsndfileError:
+        return _decode_with_ffmpeg(content)
+
+    audio = audio[:, 0] if audio.shape[1] == 1 else audio.mean(axis=1, dtype=np.float32)
+    return resample(audio, sample_rate, SAMPLE_RATE)
+
+def _decode_with_ffmpeg(content: bytes) -> np.ndarray:
+    command = [
+        "ffmpeg", "-nostdin", "-threads", "0", "-i", "pipe:0",
+        "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"
+    ]
+    try:
+        result = subprocess.run(command, input=content, capture_output=True, check=True)
+    except FileNotFoundError:
+        raise ValueError("Unsupported audio format: ffmpeg is required to decode it")
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"Failed to decode audio: {e.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
 
 def get_audio_duration(audio_input: Union[str, bytes]) -> float:
     try:
@@ -35,68 +111,411 @@ def get_audio_duration(audio_input: Union[str, bytes]) -> float:
     except Exception as e:
         raise ValueError(f"Error processing audio: {str(e)}")
 
-def audio_processor(audio_data: Union[str, bytes], is_file: bool = False, sample_rate: int = 16000) -> bytes:
-    try:
-        if is_file:
-            if isinstance(audio_data, str):
-                with open(audio_data, 'rb') as f:
-                    audio_data = f.read()
-            elif not isinstance(audio_data, bytes):
-                raise ValueError("Invalid input for is_file=True. Expected string (filepath) or bytes.")
-        
-        # Convert to numpy array
-        audio = np.frombuffer(audio_data, dtype=np.int16)
-        
-        # Convert to mono if stereo
-        if len(audio.shape) > 1:
-            audio = np.mean(audio, axis=1)
-
-        # Resample to 16kHz if necessary
-        if sample_rate != 16000:
-            audio = sf.resample(audio, 16000, sample_rate)
-
-        # Ensure audio is in int16 format
-        audio = (audio * 32767).astype(np.int16)
-
-        # Write to bytes buffer
-        buffer = io.BytesIO()
-        sf.write(buffer, audio, 16000, format='WAV', subtype='PCM_16')
-        buffer.seek(0)
-        processed_audio = buffer.read()
-
-        return processed_audio
-    except Exception as e:
-        raise ValueError(f"Error processing audio: {str(e)}")
+@lru_cache(maxsize=None)
+def polyphase_filter_bank(up: int, down: int) -> Tuple[np.ndarray, int]:
+    """
+    Anti-aliasing low-pass filter for resampling by `up`/`down`, split into `up` phases.
+
+    Kaiser-windowed sinc with the cutoff at the lower of the two Nyquist frequencies, the same
+    design as scipy.signal.resample_poly. Row `p` holds the taps applied to an input window
+    for output phase `p`, already reversed so an output sample is `window @ bank[p]`.
+
+    :return: The (up, taps) filter bank and the filter delay in upsampled samples
+    """
+    max_rate = max(up, down)
+    half_length = 10 * max_rate
+    n = np.arange(2 * half_length + 1) - half_length
+    taps = np.sinc(n / max_rate) * np.kaiser(2 * half_length + 1, 5.0)
+    taps *= up / taps.sum()
+
+    taps_per_phase = math.ceil(len(taps) / up)
+    taps = np.pad(taps, (0, taps_per_phase * up - len(taps)))
+    bank = taps.reshape(taps_per_phase, up).T[:, ::-1]
+    return np.ascontiguousarray(bank, dtype=np.float32), half_length
+
+class Resampler:
+    """
+    Streaming polyphase resampler from `input_rate` to `output_rate`.
+
+    Input can arrive in chunks of any size; output sample n is produced as soon as every input
+    sample under its filter has arrived, so the output lags the input by half a filter length
+    until `flush` is called.
+    """
+
+    def __init__(self, input_rate: int, output_rate: int = SAMPLE_RATE):
+        gcd = math.gcd(input_rate, output_rate)
+        self.up = output_rate // gcd
+        self.down = input_rate // gcd
+        self.bank, self.delay = polyphase_filter_bank(self.up, self.down)
+        self.taps = self.bank.shape[1]
+        # Input history, starting at stream index `input_start`; the stream is zero before index 0.
+        self.input = np.zeros(self.taps, dtype=np.float32)
+        self.input_start = -self.taps
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def process(self, audio: np.ndarray) -> np.ndarray:
+        if self.up == self.down:
+            return audio
+        self.input = np.concatenate([self.input, audio.astype(np.float32, copy=False)])
+        self.samples_in += len(audio)
+        input_end = self.input_start + len(self.input)
+
+        # Output n needs input up to index (n * down + delay) // up.
+        first = self.samples_out
+        end = max(first, -(-(input_end * self.up - self.delay) // self.down))
+        output = np.empty(end - first, dtype=np.float32)
+        windows = np.lib.stride_tricks.sliding_window_view(self.input, self.taps)
+        if end - first < 4 * self.up:
+            # Few outputs per phase (small streaming chunks): gather every window at once.
+            t = np.arange(first, end) * self.down + self.delay
+            rows = windows[t // self.up - self.taps + 1 - self.input_start]
+            np.einsum("nk,nk->n", rows, self.bank[t % self.up], out=output)
+        else:
+            # Outputs of one phase share their taps and step through the input by `down`.
+            for phase_offset in range(self.up):
+                n = first + phase_offset
+                t = n * self.down + self.delay
+                start = t // self.up - self.taps + 1 - self.input_start
+                count = len(range(n, end, self.up))
+                rows = windows[start:start + (count - 1) * self.down + 1:self.down]
+                output[phase_offset::self.up] = rows @ self.bank[t % self.up]
+        self.samples_out = end
+
+        keep_from = (end * self.down + self.delay) // self.up - self.taps + 1
+        self.input = self.input[keep_from - self.input_start:]
+        self.input_start = keep_from
+        return output
+
+    def flush(self) -> np.ndarray:
+        """Emit the samples still held back by the filter delay."""
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        expected = -(-self.samples_in * self.up // self.down)
+        samples_in = self.samples_in
+        output = self.process(np.zeros(self.taps, dtype=np.float32))
+        self.samples_in = samples_in
+        return output[:max(expected - (self.samples_out - len(output)), 0)]
+
+def resample(audio: np.ndarray, input_rate: int, output_rate: int = SAMPLE_RATE) -> np.ndarray:
+    if input_rate == output_rate:
+        return audio
+    resampler = Resampler(input_rate, output_rate)
+    return np.concatenate([resampler.process(audio), resampler.flush()])
+
+class AudioFrontend:
+    """
+    Converts raw PCM in a client-declared format to float32 16 kHz mono, chunk by chunk.
+
+    Interleaved channels are averaged, and resampler state and incomplete frames carry over
+    between chunks, so a stream can be split at arbitrary byte boundaries.
+    """
+
+    def __init__(self, audio_format: AudioFormat):
+        self.format = audio_format
+        self.dtype = ENCODINGS[audio_format.encoding]
+        self.resampler = Resampler(audio_format.sample_rate) if audio_format.sample_rate != SAMPLE_RATE else None
+        self.remainder = b""
+
+    def process(self, data: bytes) -> np.ndarray:
+        if self.remainder:
+            data = self.remainder + data
+        usable = len(data) - len(data) % self.format.frame_size
+        self.remainder = data[usable:]
+
+        samples = np.frombuffer(data, dtype=self.dtype, count=usable // self.dtype.itemsize)
+        if self.dtype.kind == "i":
+            audio = np.multiply(samples, 1 / 32768.0, dtype=np.float32)
+        else:
+            audio = samples.astype(np.float32)
+        if self.format.channels > 1:
+            audio = audio.reshape(-1, self.format.channels).mean(axis=1, dtype=np.float32)
+        return self.resampler.process(audio) if self.resampler else audio
+
+    def flush(self) -> np.ndarray:
+        return self.resampler.flush() if self.resampler else np.zeros(0, dtype=np.float32)
+
+# WAV format tags and the PCM encodings they map to, by bits per sample
+_WAV_ENCODINGS = {(1, 16): "pcm_s16le", (3, 32): "pcm_f32le"}
+_WAV_FORMAT_EXTENSIBLE = 0xFFFE
+
+class StreamDecoder:
+    """
+    Decodes an upload to float32 16 kHz mono while its bytes are still arriving.
+
+    Raw PCM is decoded according to `audio_format`. Otherwise the format is told from the first
+    bytes: 16-bit and float WAV is decoded in-process once its header has arrived, and anything
+    else (other WAV encodings, FLAC, OGG, MP3, ...) is piped through ffmpeg as it arrives. `process` and `flush` may block on ffmpeg,
+    so they are meant to run on a worker thread.
+    """
+
+    def __init__(self, audio_format: Optional[AudioFormat] = None):
+        self.frontend = AudioFrontend(audio_format) if audio_format is not None else None
+        self.ffmpeg: Optional[_FFmpegStream] = None
+        self.header = b""
+        # Bytes of WAV sample data still expected; None when the header doesn't say
+        self.data_remaining: Optional[int] = None
+
+    def process(self, data: bytes) -> np.ndarray:
+        if self.frontend is None and self.ffmpeg is None:
+            self.header += data
+            data = self._open(final=False)
+        if self.ffmpeg is not None:
+            return self.ffmpeg.write(data)
+        if self.frontend is None:
+            return np.zeros(0, dtype=np.float32)
+        return self._decode_pcm(data)
+
+    def flush(self) -> np.ndarray:
+        """Decode what is still held back once the upload is complete."""
+        audio = np.zeros(0, dtype=np.float32)
+        if self.frontend is None and self.ffmpeg is None:
+            data = self._open(final=True)
+            audio = self.ffmpeg.write(data) if self.ffmpeg is not None else self._decode_pcm(data)
+        if self.ffmpeg is not None:
+            return np.concatenate([audio, self.ffmpeg.close()])
+        return np.concatenate([audio, self.frontend.flush()])
+
+    def _decode_pcm(self, data: bytes) -> np.ndarray:
+        if self.data_remaining is not None:
+            data = data[:self.data_remaining]
+            self.data_remaining -= len(data)
+        return self.frontend.process(data)
+
+    def close(self):
+        if self.ffmpeg is not None:
+            self.ffmpeg.kill()
+
+    def _open(self, final: bool) -> bytes:
+        """Pick the decoder from the header bytes received so far; returns the bytes it should decode."""
+        header = self.header
+        if len(header) < 12 and not final:
+            return b""
+        if not header:
+            raise ValueError("Empty upload")
+        if not (header[:4] == b"RIFF" and header[8:12] == b"WAVE"):
+            self.ffmpeg = _FFmpegStream()
+            return header
+
+        audio_format, position = None, 12
+        while position + 8 <= len(header):
+            chunk_id, size = header[position:position + 4], int.from_bytes(header[position + 4:position + 8], "little")
+            if chunk_id == b"data":
+                if audio_format is None:
+                    raise ValueError("WAV data before its fmt chunk")
+                self.frontend = AudioFrontend(audio_format)
+                # Streamed WAVs often leave the data size at 0 or the maximum
+                self.data_remaining = size if 0 < size < 0xFFFFFFFF else None
+                return header[position + 8:]
+            if position + 8 + size > len(header):
+                break
+            if chunk_id == b"fmt ":
+                audio_format = self._wav_format(header[position + 8:position + 8 + size])
+                if audio_format is None:
+                    self.ffmpeg = _FFmpegStream()
+                    return header
+            position += 8 + size + size % 2
+        if final:
+            raise ValueError("Incomplete WAV header")
+        return b""
+
+    @staticmethod
+    def _wav_format(fmt: bytes) -> Optional[AudioFormat]:
+        """The format of a WAV fmt chunk, or None if its encoding is left to ffmpeg."""
+        tag, channels, sample_rate = int.from_bytes(fmt[0:2], "little"), int.from_bytes(fmt[2:4], "little"), \
+            int.from_bytes(fmt[4:8], "little")
+        bits = int.from_bytes(fmt[14:16], "little")
+        if tag == _WAV_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = int.from_bytes(fmt[24:26], "little")
+        encoding = _WAV_ENCODINGS.get((tag, bits))
+        if encoding is None:
+            return None
+        return AudioFormat(sample_rate=sample_rate, channels=channels, encoding=encoding)
+
+class _FFmpegStream:
+    """An ffmpeg process decoding its stdin to float32 16 kHz mono, read back as it is produced."""
+
+    def __init__(self):
+        command = [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", "pipe:0",
+            "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"
+        ]
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise ValueError("Unsupported audio format: ffmpeg is required to decode it")
+        self.output = bytearray()
+        self.lock = threading.Lock()
+        # ffmpeg's output is drained as it comes, so writing its input never blocks for long
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def write(self, data: bytes) -> np.ndarray:
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            self._check()
+        return self._take()
+
+    def close(self) -> np.ndarray:
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.reader.join()
+        self.process.wait()
+        self._check()
+        return self._take()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def _check(self):
+        if self.process.poll() not in (None, 0):
+            error = self.process.stderr.read().decode(errors="replace").strip()
+            raise ValueError(f"Failed to decode audio: {error}")
+
+    def _read(self):
+        while True:
+            block = self.process.stdout.read1(65536)
+            if not block:
+                return
+            with self.lock:
+                self.output += block
+
+    def _take(self) -> np.ndarray:
+        with self.lock:
+            usable = len(self.output) - len(self.output) % 4
+            audio = np.frombuffer(bytes(self.output[:usable]), dtype=np.float32)
+            del self.output[:usable]
+        return audio
+
+class BufferPool:
+    """
+    Float32 sample buffers reused from one live session to the next, so that opening a session
+    doesn't allocate (and page in) a new buffer. At most `max_idle` released buffers of each
+    size are kept.
+    """
+
+    def __init__(self, max_idle: int = 64):
+        self.max_idle = max_idle
+        self.idle: Dict[int, List[np.ndarray]] = {}
+        self.allocated = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, size: int) -> np.ndarray:
+        with self.lock:
+            idle = self.idle.get(size)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.allocated += 1
+        return np.empty(size, dtype=np.float32)
+
+    def release(self, buffer: np.ndarray):
+        with self.lock:
+            idle = self.idle.setdefault(len(buffer), [])
+            if len(idle) < self.max_idle:
+                idle.append(buffer)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            idle = [buffer for buffers in self.idle.values() for buffer in buffers]
+            return {
+                "allocated": self.allocated,
+                "reused": self.reused,
+                "idle": len(idle),
+                "idle_mb": sum(buffer.nbytes for buffer in idle) / 2**20
+            }
+
+buffer_pool = BufferPool()
 
 class AudioBuffer:
-    def __init__(self, buffer_duration: float = 30.0, sample_rate: int = 16000):
+    """
+    Audio received on a live session that has not been trimmed away yet.
+
+    Samples are kept in arrival order as float32 in [-1, 1] in a buffer taken from `pool`;
+    `offset` is the session time in seconds of the first buffered sample. When more than
+    `buffer_duration` seconds arrive without being trimmed, the oldest samples are dropped.
+
+    Trimming only moves the start of the buffered audio forward. The audio is moved back to the
+    front of the buffer when a chunk no longer fits after it, so `audio` is always a
+    contiguous view and samples are moved about once per buffer's worth of audio received
+    rather than on every trim.
+    """
+
+    def __init__(self, buffer_duration: float = 30.0, sample_rate: int = 16000, pool: Optional[BufferPool] = None):
         self.buffer_duration = buffer_duration
         self.sample_rate = sample_rate
         self.buffer_size = int(buffer_duration * sample_rate)
-        self.buffer = np.zeros(self.buffer_size, dtype=np.int16)
-        self.write_pos = 0
+        self.pool = pool or buffer_pool
+        self.buffer = self.pool.acquire(self.buffer_size)
+        # Index of the first buffered sample in `buffer`, and the number of buffered samples
+        self.start = 0
+        self.length = 0
+        # Number of samples received on the session before buffer[start].
+        self.start_sample = 0
+
+    @property
+    def offset(self) -> float:
+        return self.start_sample / self.sample_rate
+
+    @property
+    def audio(self) -> np.ndarray:
+        return self.buffer[self.start:self.start + self.length]
+
+    @property
+    def duration(self) -> float:
+        return self.length / self.sample_rate
+
+    @property
+    def end_time(self) -> float:
+        return self.offset + self.duration
 
-    def add_audio(self, audio_chunk: bytes) -> np.ndarray:
-        chunk = np.frombuffer(audio_chunk, dtype=np.int16)
+    def add_audio(self, chunk: np.ndarray) -> np.ndarray:
+        """Append float32 samples at the buffer's sample rate."""
+        if len(chunk) > self.buffer_size:
+            self._drop(self.length)
+            self.start_sample += len(chunk) - self.buffer_size
+            chunk = chunk[-self.buffer_size:]
         chunk_size = len(chunk)
 
-        # If chunk is larger than buffer, only keep the latest buffer_size samples
-        if chunk_size >= self.buffer_size:
-            self.buffer = chunk[-self.buffer_size:]
-            self.write_pos = 0
-        else:
-            # Compute the number of samples to copy
-            samples_to_copy = min(chunk_size, self.buffer_size - self.write_pos)
-            
-            # Copy samples to buffer
-            self.buffer[self.write_pos:self.write_pos + samples_to_copy] = chunk[:samples_to_copy]
-            
-            # If there are remaining samples, copy them to the beginning of the buffer
-            if samples_to_copy < chunk_size:
-                remaining_samples = chunk_size - samples_to_copy
-                self.buffer[:remaining_samples] = chunk[samples_to_copy:]
-            
-            # Update write position
-            self.write_pos = (self.write_pos + chunk_size) % self.buffer_size
-
-        return self.buffer
\ No newline at end of file
+        overflow = self.length + chunk_size - self.buffer_size
+        if overflow > 0:
+            self._drop(overflow)
+        if self.start + self.length + chunk_size > self.buffer_size:
+            # Move the audio to the front in blocks that don't overlap their destination, which
+            # numpy would otherwise copy through a temporary array
+            for moved in range(0, self.length, self.start):
+                size = min(self.start, self.length - moved)
+                self.buffer[moved:moved + size] = self.buffer[self.start + moved:self.start + moved + size]
+            self.start = 0
+
+        end = self.start + self.length
+        self.buffer[end:end + chunk_size] = chunk
+        self.length += chunk_size
+        return self.audio
+
+    def trim(self, until: float):
+        """Drop the buffered audio before session time `until` (in seconds)."""
+        self._drop(int(round((until - self.offset) * self.sample_rate)))
+
+    def close(self):
+        """Return the buffer to the pool; the AudioBuffer can't be used afterwards."""
+        if self.buffer is not None:
+            self.pool.release(self.buffer)
+            self.buffer = None
+            self.length = 0
+
+    def _drop(self, samples: int):
+        samples = min(max(samples, 0), self.length)
+        self.start += samples
+        self.length -= samples
+        self.start_sample += samples
+        if self.length == 0:
+            self.start = 0
@@ -0,0 +1,5 @@
+# Imported by main before anything else, so the time from here to the end of main's imports is
+# what importing the server took
+import time
+
+started = time.perf_counter()
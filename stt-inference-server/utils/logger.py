@@ -1,16 +1,148 @@
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+import random
+import threading
+import time
+from server_metadata import server_metadata
+from utils.metrics import metrics
 
-def setup_logger(name, log_file, level=logging.INFO):
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+# Records waiting for the writer thread; beyond this many they are dropped rather than
+# holding up the event loop behind a slow disk
+QUEUE_SIZE = 10000
+
+# Keys of live results that carry transcribed text
+TRANSCRIPT_KEYS = ("words", "text", "transcription", "segments")
+
+_dropped = metrics.counter("stt_log_records_dropped_total", "Log records dropped because the writer fell behind")
+_suppressed = metrics.counter("stt_transcript_logs_suppressed_total", "Per-chunk transcription records sampled out or rate limited")
+
+class LogFormatter(logging.Formatter):
+    """
+    Formats records as text or, with `server_metadata.logging.format` "json", as one JSON
+    object per line. A dict logged as the message becomes fields of the JSON object.
+    """
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        if server_metadata.logging.format != "json":
+            return super().format(record)
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name}
+        if isinstance(record.msg, dict) and not record.args:
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _QueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread unformatted, so building the message (and any JSON)
+    happens there rather than on the caller's thread. Callers must not change objects they
+    have logged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped.inc()
+
+class TranscriptFilter(logging.Filter):
+    """
+    Samples and rate limits per-chunk transcription records as set in `server_metadata.logging`,
+    and strips their text when transcript logging is off.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._allowance = 0.0
+        self._updated_at = time.monotonic()
 
-    handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
-    handler.setFormatter(formatter)
+    def filter(self, record: logging.LogRecord) -> bool:
+        config = server_metadata.logging
+        if config.transcript_sample_rate < 1 and random.random() >= config.transcript_sample_rate:
+            _suppressed.inc()
+            return False
+        if config.transcript_max_per_second > 0 and not self._take(config.transcript_max_per_second):
+            _suppressed.inc()
+            return False
+        if not config.transcripts and isinstance(record.msg, dict):
+            record.msg = {key: value for key, value in record.msg.items() if key not in TRANSCRIPT_KEYS}
+        return True
+
+    def _take(self, rate: float) -> bool:
+        # Token bucket holding up to a second's worth of records
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(rate, self._allowance + (now - self._updated_at) * rate)
+            self._updated_at = now
+            if self._allowance < 1:
+                return False
+            self._allowance -= 1
+            return True
+
+class _ForwardingHandler(QueueHandler):
+    """Sends records to another process, with their message built but left unformatted."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        if not (isinstance(record.msg, dict) and not record.args):
+            record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class _Relay(logging.Handler):
+    """Passes records forwarded from another process to this process's logger of the same name."""
+
+    def emit(self, record: logging.LogRecord):
+        logging.getLogger(record.name).handle(record)
+
+_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+_queue_handler = _QueueHandler(_queue)
+# One background thread writes every log file
+_listener = QueueListener(_queue, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+def forward_to(log_queue):
+    """
+    Send this process's records to `log_queue` for the process that reads it to write, rather
+    than write the log files here. For worker processes, so only one process rotates the files.
+    """
+    _listener.handlers = (_ForwardingHandler(log_queue),)
+
+def receive_from(log_queue) -> QueueListener:
+    """Write the records other processes forward through `log_queue`. Stop the returned listener when done."""
+    listener = QueueListener(log_queue, _Relay())
+    listener.start()
+    return listener
+
+def setup_logger(name, log_file, level=logging.INFO):
+    # Opened on the first record, so processes that forward their records never open the files
+    handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5, delay=True)
+    handler.setFormatter(LogFormatter())
+    # The writer thread offers every record to every file; each keeps its own logger's
+    handler.addFilter(logging.Filter(name))
+    _listener.handlers = _listener.handlers + (handler,)
 
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    logger.addHandler(handler)
+    logger.addHandler(_queue_handler)
 
     return logger
 
@@ -20,4 +152,5 @@ os.makedirs('logs', exist_ok=True)
 # Create loggers
 main_logger = setup_logger('main_logger', 'logs/main.log')
 transcription_logger = setup_logger('transcription_logger', 'logs/transcription.log')
-model_logger = setup_logger('model_logger', 'logs/model.log')
\ No newline at end of file
+transcription_logger.addFilter(TranscriptFilter())
+model_logger = setup_logger('model_logger', 'logs/model.log')
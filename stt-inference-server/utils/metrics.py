@@ -0,0 +1,392 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
+
+class RollingRatio:
+    """Sum of one quantity over the sum of another across the last `window` observations."""
+
+    def __init__(self, window: int = 50):
+        self._pairs = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, numerator: float, denominator: float):
+        with self._lock:
+            self._pairs.append((numerator, denominator))
+
+    def value(self) -> Optional[float]:
+        """None until something has been observed."""
+        with self._lock:
+            numerator = sum(pair[0] for pair in self._pairs)
+            denominator = sum(pair[1] for pair in self._pairs)
+        return numerator / denominator if denominator else None
+
+class Distribution:
+    """
+    Rolling window of recent observations, summarised as percentiles.
+
+    Keeps the last `window` values so percentiles reflect current behaviour rather than the
+    whole lifetime of the server; count and mean cover every observation.
+    """
+
+    def __init__(self, window: int = 10000):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+            self.total += value
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            values = np.fromiter(self._values, dtype=np.float64, count=len(self._values))
+            count, total = self.count, self.total
+        if count == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            "count": count,
+            "mean": total / count,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(values.max())
+        }
+
+# Histogram buckets: 64 linear sub-buckets per power of two from 2^-20 (about a microsecond)
+# to 2^13, so any value in range is placed within 1.6% of its true value.
+_SUB_BUCKETS = 64
+_MIN_EXPONENT = -19
+_MAX_EXPONENT = 14
+_BUCKETS = (_MAX_EXPONENT - _MIN_EXPONENT) * _SUB_BUCKETS
+
+def _bucket(value: float) -> int:
+    if value <= 0:
+        return 0
+    mantissa, exponent = math.frexp(value)
+    if exponent < _MIN_EXPONENT:
+        return 0
+    index = (exponent - _MIN_EXPONENT) * _SUB_BUCKETS + int((mantissa * 2 - 1) * _SUB_BUCKETS)
+    return index if index < _BUCKETS else _BUCKETS - 1
+
+def _bucket_bounds(index: int) -> Tuple[float, float]:
+    exponent, sub_bucket = divmod(index, _SUB_BUCKETS)
+    scale = math.ldexp(1.0, exponent + _MIN_EXPONENT - 1)
+    return (1 + sub_bucket / _SUB_BUCKETS) * scale, (1 + (sub_bucket + 1) / _SUB_BUCKETS) * scale
+
+# Bucket boundaries of the Prometheus export, in seconds
+PROMETHEUS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class _HistogramShard:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+class Histogram:
+    """
+    HDR-style histogram of non-negative values over the server's lifetime.
+
+    Values are counted in log-linear buckets, so recording one is a few list operations and
+    percentiles stay within 1.6% however many values there are. Each thread records into its
+    own shard without locking; readers add the shards up, so a summary taken while values are
+    being recorded may miss the latest few.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[_HistogramShard] = []
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard.counts[_bucket(value)] += 1
+        shard.count += 1
+        shard.total += value
+        if value > shard.max:
+            shard.max = value
+
+    def time(self) -> "_Timer":
+        """Context manager that records the seconds its block takes."""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], int, float, float]:
+        """Bucket counts, count, sum and maximum across every thread."""
+        with self._lock:
+            shards = list(self._shards)
+        counts = [0] * _BUCKETS
+        count, total, maximum = 0, 0.0, 0.0
+        for shard in shards:
+            for index, bucket_count in enumerate(shard.counts):
+                if bucket_count:
+                    counts[index] += bucket_count
+            count += shard.count
+            total += shard.total
+            maximum = max(maximum, shard.max)
+        return counts, count, total, maximum
+
+    def percentiles(self, quantiles: Iterable[float]) -> List[float]:
+        counts, _, _, maximum = self.snapshot()
+        return _percentiles(counts, quantiles, maximum)
+
+    def summary(self, scale: float = 1.0) -> Dict[str, float]:
+        """Count, mean, p50/p95/p99 and maximum, with values multiplied by `scale` (e.g. 1000 for ms)."""
+        counts, count, total, maximum = self.snapshot()
+        if count == 0:
+            return {"count": 0}
+        p50, p95, p99 = _percentiles(counts, (0.5, 0.95, 0.99), maximum)
+        return {
+            "count": count,
+            "mean": total / count * scale,
+            "p50": p50 * scale,
+            "p95": p95 * scale,
+            "p99": p99 * scale,
+            "max": maximum * scale
+        }
+
+    def _new_shard(self) -> _HistogramShard:
+        shard = _HistogramShard()
+        with self._lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+def _percentiles(counts: List[int], quantiles: Iterable[float], maximum: float) -> List[float]:
+    total = sum(counts)
+    if total == 0:
+        return [0.0 for _ in quantiles]
+    results = []
+    for quantile in quantiles:
+        rank = max(1, math.ceil(quantile * total))
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                lower, upper = _bucket_bounds(index)
+                results.append(min((lower + upper) / 2, maximum))
+                break
+    return results
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+class Counter:
+    """Monotonic total, added to per thread without locking."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[List[float]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0.0]
+            with self._lock:
+                self._shards.append(shard)
+        shard[0] += amount
+
+    def value(self) -> float:
+        with self._lock:
+            shards = list(self._shards)
+        return sum(shard[0] for shard in shards)
+
+class _Gauge:
+    """A value read from the rest of the server when metrics are exported."""
+
+    def __init__(self, function: Callable[[], float]):
+        self.value = function
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class MetricsRegistry:
+    """
+    Named metric families, each with one metric per set of label values, exported in the
+    Prometheus text format.
+
+    Histograms and counters are created on first use and cached, so callers on hot paths
+    should look them up once and keep them. Gauges are functions evaluated on export.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help: str, **labels: str) -> Histogram:
+        return self._get_or_create(name, help, "histogram", Histogram, labels)
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        return self._get_or_create(name, help, "counter", Counter, labels)
+
+    def gauge(self, name: str, help: str, function: Callable[[], float], **labels: str):
+        """Export the value of `function`, replacing any gauge registered with the same labels."""
+        self.callback(name, help, "gauge", function, **labels)
+
+    def callback(self, name: str, help: str, kind: str, function: Callable[[], float], **labels: str):
+        """Export a gauge or counter kept elsewhere (e.g. in `server_metadata.stats`), read through `function`."""
+        self.register(name, help, kind, _Gauge(function), **labels)
+
+    def register(self, name: str, help: str, kind: str, metric: object, **labels: str):
+        """Export an existing histogram, counter or gauge, e.g. one owned by a component's instance."""
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help, {}))
+            family[2][_labels(labels)] = metric
+
+    def children(self, name: str) -> List[Tuple[Dict[str, str], object]]:
+        """The metrics of a family with their labels."""
+        with self._lock:
+            family = self._families.get(name)
+            items = list(family[2].items()) if family else []
+        return [(dict(labels), metric) for labels, metric in items]
+
+    def render(self) -> str:
+        with self._lock:
+            families = [(name, kind, help, list(children.items()))
+                        for name, (kind, help, children) in self._families.items()]
+        lines = []
+        for name, kind, help, children in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in children:
+                if kind == "histogram":
+                    lines.extend(_render_histogram(name, labels, metric))
+                else:
+                    try:
+                        value = metric.value()
+                    except Exception:
+                        continue
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _get_or_create(self, name: str, help: str, kind: str, factory: Callable[[], object],
+                       labels: Dict[str, str]):
+        key = _labels(labels)
+        family = self._families.get(name)
+        metric = family[2].get(key) if family else None
+        if metric is not None:
+            return metric
+        with self._lock:
+            kind_, _, children = self._families.setdefault(name, (kind, help, {}))
+            if kind_ != kind:
+                raise ValueError(f"Metric {name} is a {kind_}, not a {kind}")
+            return children.setdefault(key, factory())
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+def _render_histogram(name: str, labels: Labels, histogram: Histogram) -> List[str]:
+    counts, count, total, _ = histogram.snapshot()
+    lines = []
+    cumulative, index = 0, 0
+    for bound in PROMETHEUS_BUCKETS:
+        # Fine buckets lying below the boundary; they are narrow enough that the few that
+        # straddle it don't matter.
+        last = _bucket(bound)
+        cumulative += sum(counts[index:last])
+        index = last
+        lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}")
+    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return lines
+
+metrics = MetricsRegistry()
+
+def stage(name: str) -> Histogram:
+    """Seconds spent in one stage of the transcription pipeline."""
+    return metrics.histogram("stt_stage_seconds", "Time spent in each stage of the transcription pipeline", stage=name)
+
+def queue_wait(queue: str) -> Histogram:
+    """
+    A new histogram of seconds spent waiting in one of the server's queues, exported in place
+    of the previous owner's.
+    """
+    histogram = Histogram()
+    metrics.register("stt_queue_wait_seconds", "Time work waited in each queue before it started", "histogram",
+                     histogram, queue=queue)
+    return histogram
+
+_ENCODER = stage("encoder")
+_encoder_time = threading.local()
+
+def record_encoder(seconds: float):
+    """Record an encoder pass, and add it to the current thread's running encoder total."""
+    _ENCODER.observe(seconds)
+    _encoder_time.total = getattr(_encoder_time, "total", 0.0) + seconds
+
+def encoder_seconds() -> float:
+    """Seconds the current thread has spent in the encoder, for subtracting from a wider timing."""
+    return getattr(_encoder_time, "total", 0.0)
+
+class ComputeTime:
+    """Seconds the model spent on one request, summed across the threads its calls ran on."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.seconds += seconds
+
+_compute_time: ContextVar[Optional[ComputeTime]] = ContextVar("compute_time", default=None)
+
+def track_compute_time() -> ComputeTime:
+    """
+    Sum the time model calls made from the current task take, and from tasks it starts from now
+    on, leaving out the time they wait for a thread or for their results to be read.
+    """
+    tracker = ComputeTime()
+    _compute_time.set(tracker)
+    return tracker
+
+def current_compute_time() -> Optional[ComputeTime]:
+    return _compute_time.get()
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def resident_bytes(pid: Union[int, str] = "self") -> Optional[int]:
+    """Resident memory of a process, or None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
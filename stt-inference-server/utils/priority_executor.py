@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from .metrics import queue_wait
+
+class Priority(IntEnum):
+    REALTIME = 0      # live session chunks
+    INTERACTIVE = 1   # uploads a client is waiting on
+    BULK = 2          # background work
+
+# Class and deadline (time.monotonic) of work submitted from the current task
+_scheduling: ContextVar[Tuple[Priority, Optional[float]]] = ContextVar(
+    "scheduling", default=(Priority.INTERACTIVE, None)
+)
+
+@contextmanager
+def scheduling(priority: Priority, deadline: Optional[float] = None) -> Iterator[None]:
+    """Submit work started in this block with `priority`, ordered by `deadline` within its class."""
+    token = _scheduling.set((priority, deadline))
+    try:
+        yield
+    finally:
+        _scheduling.reset(token)
+
+def set_scheduling(priority: Priority, deadline: Optional[float] = None):
+    """Like `scheduling`, for the rest of the current task (e.g. a request and its response)."""
+    _scheduling.set((priority, deadline))
+
+@dataclass(order=True)
+class _WorkItem:
+    deadline: float
+    sequence: int
+    priority: Priority = field(compare=False)
+    future: Future = field(compare=False)
+    fn: Callable = field(compare=False)
+    args: tuple = field(compare=False)
+    kwargs: dict = field(compare=False)
+    has_deadline: bool = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+class PriorityExecutor(Executor):
+    """
+    Thread pool that runs work by priority class rather than in submission order.
+
+    The class and deadline of a submission come from the submitting task's context (see
+    `scheduling`), so `loop.run_in_executor` and the backends' `transcribe(executor=...)` need no
+    changes. A free thread takes the highest-priority class with queued work, earliest deadline
+    first within the class; work without a deadline is ordered by submission time. Each class can
+    reserve threads: work of other classes doesn't start if it would leave fewer free threads
+    than the reserving classes are still owed, so a burst of uploads can't take every thread
+    from live sessions.
+    """
+
+    def __init__(self, max_workers: int, reserved: Optional[Dict[Priority, int]] = None):
+        self.max_workers = max_workers
+        self.reserved = {priority: (reserved or {}).get(priority, 0) for priority in Priority}
+        if sum(self.reserved.values()) >= max_workers:
+            raise ValueError(f"Reserved threads {sum(self.reserved.values())} leave none of {max_workers} to share")
+        self._queues: Dict[Priority, List[_WorkItem]] = {priority: [] for priority in Priority}
+        self._running = {priority: 0 for priority in Priority}
+        self._completed = {priority: 0 for priority in Priority}
+        self._deadline_misses = {priority: 0 for priority in Priority}
+        self._wait = {priority: queue_wait(priority.name.lower()) for priority in Priority}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"inference-{index}", daemon=True)
+            for index in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        priority, deadline = _scheduling.get()
+        future = Future()
+        now = time.monotonic()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            heapq.heappush(self._queues[priority], _WorkItem(
+                deadline if deadline is not None else now, next(self._sequence), priority, future,
+                fn, args, kwargs, deadline is not None, now
+            ))
+            self._condition.notify()
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for queue in self._queues.values():
+                    for item in queue:
+                        item.future.cancel()
+                    queue.clear()
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def queued(self, priority: Priority) -> int:
+        return len(self._queues[priority])
+
+    def running(self, priority: Priority) -> int:
+        return self._running[priority]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            counts = {
+                priority: (len(self._queues[priority]), self._running[priority], self._completed[priority],
+                           self._deadline_misses[priority])
+                for priority in Priority
+            }
+        return {
+            "workers": self.max_workers,
+            "classes": {
+                priority.name.lower(): {
+                    "reserved": self.reserved[priority],
+                    "queued": queued,
+                    "running": running,
+                    "completed": completed,
+                    "deadline_misses": misses,
+                    "wait_ms": self._wait[priority].summary(scale=1000)
+                }
+                for priority, (queued, running, completed, misses) in counts.items()
+            }
+        }
+
+    def _next(self) -> Optional[_WorkItem]:
+        free = self.max_workers - sum(self._running.values())
+        for priority in Priority:
+            if not self._queues[priority]:
+                continue
+            owed = sum(max(0, self.reserved[other] - self._running[other]) for other in Priority if other != priority)
+            if free - 1 >= owed:
+                return heapq.heappop(self._queues[priority])
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    item = self._next()
+                    if item is not None:
+                        break
+                    if self._shutdown and not any(self._queues.values()):
+                        return
+                    self._condition.wait()
+                self._running[item.priority] += 1
+                started_at = time.monotonic()
+                if item.has_deadline and started_at > item.deadline and not item.future.cancelled():
+                    self._deadline_misses[item.priority] += 1
+
+            try:
+                if item.future.set_running_or_notify_cancel():
+                    self._wait[item.priority].observe(started_at - item.enqueued_at)
+                    try:
+                        item.future.set_result(item.fn(*item.args, **item.kwargs))
+                    except BaseException as e:
+                        item.future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running[item.priority] -= 1
+                    if not item.future.cancelled():
+                        self._completed[item.priority] += 1
+                    self._condition.notify_all()
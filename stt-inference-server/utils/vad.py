@@ -0,0 +1,147 @@
+from enum import Enum
+from typing import List, Tuple
+import numpy as np
+
+class EnergyVAD:
+    """
+    Frame-level voice activity detector based on short-term energy and zero-crossing rate.
+
+    A frame is speech when its energy is `snr_db` above the running noise floor (and above
+    `min_energy_db`), and its zero-crossing rate is below `max_zero_crossing_rate`, which rejects
+    loud broadband noise. The noise floor follows the energy of non-speech frames.
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_duration: float = 0.03, snr_db: float = 12.0,
+                 min_energy_db: float = -50.0, max_zero_crossing_rate: float = 0.4,
+                 noise_floor_db: float = -60.0, noise_adaptation: float = 0.05):
+        self.frame_size = int(sample_rate * frame_duration)
+        self.snr_db = snr_db
+        self.min_energy_db = min_energy_db
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.noise_floor_db = noise_floor_db
+        self.noise_adaptation = noise_adaptation
+
+    def speech_frames(self, audio: np.ndarray) -> np.ndarray:
+        """
+        Classify `audio` (int16 PCM or float32 in [-1, 1]) frame by frame.
+
+        :return: Boolean array with one entry per complete frame
+        """
+        frames = self._frames(audio)
+        if len(frames) == 0:
+            return np.zeros(0, dtype=bool)
+
+        energy_db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_size - 1)
+
+        threshold = max(self.noise_floor_db + self.snr_db, self.min_energy_db)
+        speech = (energy_db > threshold) & (zero_crossing_rate < self.max_zero_crossing_rate)
+
+        noise = energy_db[~speech]
+        if noise.size:
+            self.noise_floor_db += self.noise_adaptation * (float(np.mean(noise)) - self.noise_floor_db)
+        return speech
+
+    def frame_energy_db(self, audio: np.ndarray) -> np.ndarray:
+        """Energy of each complete frame of `audio`, in dB relative to full scale."""
+        frames = self._frames(audio)
+        return 10 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+
+    def _frames(self, audio: np.ndarray) -> np.ndarray:
+        n_frames = len(audio) // self.frame_size
+        frames = audio[:n_frames * self.frame_size].reshape(n_frames, self.frame_size).astype(np.float32)
+        if audio.dtype == np.int16:
+            frames *= 1 / 32768.0
+        return frames
+
+def split_on_silence(audio: np.ndarray, sample_rate: int = 16000, max_duration: float = 30.0,
+                     search_duration: float = 5.0, pause_duration: float = 0.3) -> List[Tuple[int, int]]:
+    """
+    Split a long recording into chunks of at most `max_duration` seconds, cutting at pauses.
+
+    Each cut is placed in the quietest `pause_duration` stretch within the last `search_duration`
+    seconds before the chunk would exceed `max_duration`, so words are rarely split in two.
+
+    :return: (start, end) sample ranges covering `audio`
+    """
+    vad = EnergyVAD(sample_rate)
+    energy_db = vad.frame_energy_db(audio)
+    frame_size = vad.frame_size
+    max_frames = int(max_duration * sample_rate) // frame_size
+    search_frames = min(int(search_duration * sample_rate) // frame_size, max_frames - 1)
+    pause_frames = max(1, int(pause_duration * sample_rate) // frame_size)
+    # Mean energy of the pause_frames-long stretch starting at each frame
+    cumulative = np.concatenate([[0.0], np.cumsum(energy_db, dtype=np.float64)])
+    pause_energy = (cumulative[pause_frames:] - cumulative[:-pause_frames]) / pause_frames
+
+    bounds = []
+    start = 0
+    while len(audio) - start * frame_size > max_duration * sample_rate:
+        first = start + max_frames - search_frames
+        last = min(start + max_frames - pause_frames, len(pause_energy) - 1)
+        # Cut in the middle of the quietest stretch
+        cut = first + int(np.argmin(pause_energy[first:last + 1])) + pause_frames // 2 if last >= first \
+            else start + max_frames
+        bounds.append((start * frame_size, cut * frame_size))
+        start = cut
+    bounds.append((start * frame_size, len(audio)))
+    return bounds
+
+class GateDecision(str, Enum):
+    SILENCE = "silence"   # nothing to decode; the chunk can be dropped
+    WAIT = "wait"         # speech is buffered but the latency budget allows waiting for more
+    PROCESS = "process"   # decode the pending speech
+    FINISH = "finish"     # speech ended; decode and commit everything pending
+
+class SpeechGate:
+    """
+    Decides, chunk by chunk, when a live session needs inference.
+
+    Decodes are triggered on speech onset, every `max_latency` seconds of ongoing speech, and
+    once `hangover` seconds of silence follow speech (offset). Silence in between is skipped.
+    Samples that do not fill a whole VAD frame are carried into the next chunk, so chunks
+    may be of any length.
+    """
+
+    def __init__(self, vad: EnergyVAD, sample_rate: int = 16000, max_latency: float = 1.0,
+                 hangover: float = 0.5):
+        self.vad = vad
+        self.sample_rate = sample_rate
+        self.max_latency = max_latency
+        self.hangover = hangover
+        self.in_speech = False
+        self.pending = 0.0
+        self.trailing_silence = 0.0
+        self.remainder = np.zeros(0, dtype=np.int16)
+
+    def update(self, audio: np.ndarray) -> GateDecision:
+        samples = np.concatenate([self.remainder, audio]) if self.remainder.size else audio
+        speech = self.vad.speech_frames(samples)
+        # Copied: the caller may reuse the chunk's buffer
+        self.remainder = samples[len(speech) * self.vad.frame_size:].copy()
+        duration = len(audio) / self.sample_rate
+
+        if speech.any():
+            # Silence after the last speech frame, including the samples carried to the next chunk.
+            speech_end = (int(np.flatnonzero(speech)[-1]) + 1) * self.vad.frame_size
+            self.trailing_silence = (len(samples) - speech_end) / self.sample_rate
+        elif self.in_speech:
+            self.trailing_silence += duration
+
+        if not self.in_speech:
+            if not speech.any():
+                return GateDecision.SILENCE
+            self.in_speech = True
+            self.pending = 0.0
+            return GateDecision.PROCESS
+
+        self.pending += duration
+        if self.trailing_silence >= self.hangover:
+            self.in_speech = False
+            self.pending = 0.0
+            return GateDecision.FINISH
+        if self.pending >= self.max_latency:
+            self.pending = 0.0
+            return GateDecision.PROCESS
+        return GateDecision.WAIT